@@ -0,0 +1,6 @@
+"""Benchmarks and a fake Vantage controller for exercising the integration
+without real hardware.  Run from the repository root, e.g.:
+
+    python -m bench.harness     # the whole integration inside Home Assistant
+    python -m bench.roundtrip   # just the controller connection
+"""
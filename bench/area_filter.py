@@ -0,0 +1,120 @@
+"""
+Area filtering over a synthetic ~5,000 object project.
+
+Compares the per-device lineage walk async_setup used to do with the
+AreaFilter index.  Debug logging is enabled for the vantage loggers (but
+sent nowhere) so the per-step logging cost shows up as it would with
+debug logging turned on.
+
+    python -m bench.area_filter
+"""
+import argparse
+import logging
+import time
+
+from custom_components.vantage.filters import AreaFilter
+
+from .synthetic import make_vantage
+
+
+def baseline_filter(vc, only_areas, exclude_areas):
+    """The per-device filter async_setup used before AreaFilter."""
+    logger = logging.getLogger("custom_components.vantage")
+
+    def get_lineage_from_area(area):
+        count = 0
+        answer = [area.name]
+        while area and count < 10:
+            count += 1
+            parent_vid = area.parent
+            if parent_vid == 0:
+                break
+            area = vc._vid_to_area.get(parent_vid)
+            if area:
+                answer.append(area.name)
+        return answer
+
+    def should_keep_for_area(area):
+        area_lineage = get_lineage_from_area(area)
+        logger.debug("area = %s; lineage = %a", area.name, area_lineage)
+        keep = not (only_areas or exclude_areas)
+        if only_areas:
+            for a in area_lineage:
+                if a in only_areas:
+                    logger.debug("maybe including %s because of only_areas",
+                                 area.name)
+                    keep = True
+                    break
+            if keep and exclude_areas:
+                for a in area_lineage:
+                    if a in exclude_areas:
+                        logger.debug("%s is in exclude_areas", a)
+                        keep = False
+                        break
+        elif exclude_areas:
+            keep = True
+            for a in area_lineage:
+                if a in exclude_areas:
+                    logger.debug("discarding %s", area.name)
+                    keep = False
+                    break
+        return keep
+
+    def keep(area_vid):
+        area = vc._vid_to_area.get(area_vid)
+        if not area:
+            return not only_areas
+        return should_keep_for_area(area)
+
+    return keep
+
+
+def devices(vc):
+    """Every object async_setup sorts by area."""
+    return vc.outputs + vc.buttons + vc.sensors + vc.keypads
+
+
+def run(label, make_keep, vc, repeat):
+    """Time building the filter and sorting every device, repeat times."""
+    objs = devices(vc)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        keep = make_keep()
+        kept = {obj.vid for obj in objs if keep(obj.area)}
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("%-10s %5d objects, %5d kept in %8.2fms" % (
+        label, len(objs), len(kept), best * 1000))
+    return kept
+
+
+def main():
+    """Compare baseline and indexed filtering."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("custom_components.vantage")
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    vc = make_vantage(areas=400, loads=3000, keypads=200,
+                      buttons_per_keypad=6, contacts=200, variables=0,
+                      sensors=0)
+    area_names = sorted(area.name for area in vc._vid_to_area.values())
+    only_areas = set(area_names[1:len(area_names) // 2])
+    exclude_areas = set(area_names[len(area_names) // 2::7])
+
+    old = run("baseline", lambda: baseline_filter(vc, only_areas,
+                                                  exclude_areas),
+              vc, args.repeat)
+    new = run("indexed", lambda: AreaFilter(vc._vid_to_area, only_areas,
+                                            exclude_areas).keep,
+              vc, args.repeat)
+    assert old == new, "filters disagree"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Cost of a state write with and without the cached extra_state_attributes.
+
+Sets the integration up inside a minimal Home Assistant against the
+simulated controller, then changes every light's level and writes its
+state, round after round: once with extra_state_attributes as it was
+(a new dict built for every write) and once with the cached dict.  Each
+write goes all the way through Home Assistant's state machine, so the
+difference is what the cache saves per update.
+
+    python -m bench.attributes --loads 1000 --rounds 20
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from custom_components.vantage import VantageDevice
+
+from .common import report
+from .fake_controller import FakeController, FakeDesignCenter
+from .harness import start_hass
+from .synthetic import make_project_xml, make_vantage
+
+
+def uncached_attributes(self):
+    """extra_state_attributes as it was before it was cached."""
+    attr = self._vantage_device._extra_info.copy()
+    attr["vantage_id"] = self._vantage_device.id
+    if self.kind is not None:
+        attr["vantage_kind"] = self.kind
+    if self.unit_of_measurement is not None:
+        attr["unit_of_measurement"] = self.unit_of_measurement
+    return attr
+
+
+def write_round(lights, level):
+    """Set every light to level and write its state; return the times."""
+    samples = []
+    for light in lights:
+        light._vantage_device._level = level
+        start = time.perf_counter()
+        light.async_write_ha_state()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run(lights, rounds):
+    """Alternate rounds of uncached and cached writes, so both see the
+    same state machine and recorder load."""
+    cached = VantageDevice.extra_state_attributes
+    uncached = property(uncached_attributes)
+    samples = {uncached: [], cached: []}
+    try:
+        for i in range(rounds):
+            for j, attributes in enumerate((uncached, cached)):
+                VantageDevice.extra_state_attributes = attributes
+                # a different level every round, so every write changes
+                # the state
+                samples[attributes].extend(
+                    write_round(lights, 10 + (2 * i + j) % 4 * 20))
+    finally:
+        VantageDevice.extra_state_attributes = cached
+    report("new dict per write", samples[uncached], unit="us", scale=1e6)
+    report("cached", samples[cached], unit="us", scale=1e6)
+
+
+async def main():
+    """Compare state writes with the old and the cached attributes."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--loads", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    # pylint: disable=import-outside-toplevel
+    from homeassistant.helpers.entity_component import DATA_INSTANCES
+    from homeassistant.setup import async_setup_component
+
+    xml_db = make_project_xml(areas=20, loads=args.loads, keypads=0,
+                              contacts=0, variables=0, sensors=0)
+    model = make_vantage(xml_db)
+    controller = FakeController(loads=[output.vid for output in model.outputs])
+    design_center = FakeDesignCenter(xml_db)
+    with tempfile.TemporaryDirectory() as config_dir:
+        config = {"host": "127.0.0.1",
+                  "port": await controller.start(),
+                  "file_port": await design_center.start()}
+        hass = await start_hass(config_dir)
+        try:
+            assert await async_setup_component(hass, "vantage",
+                                               {"vantage": config})
+            await hass.async_block_till_done()
+            lights = list(hass.data[DATA_INSTANCES]["light"].entities)
+            run(lights, args.rounds)
+        finally:
+            await hass.async_stop(force=True)
+            await controller.stop()
+            await design_center.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Keypad button event dispatch, from a received status line to the event
+on the Home Assistant bus.
+
+Feeds S:BTN lines through AsyncVantageConnection's line handler (what the
+socket reader calls) into pyvantage and on to the subscribed callbacks,
+once with the old button_pressed that rebuilt its payload per event and
+once with the precomputed callbacks, and times each line until its event
+has been handed to hass.bus.async_fire.  bench.harness measures the same path including the
+socket.
+
+    python -m bench.buttons --keypads 200 --events 20000
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.util import slugify
+
+from custom_components.vantage import button_event_callback
+from custom_components.vantage.connection import AsyncVantageConnection
+
+from .common import report
+from .synthetic import make_vantage
+
+
+def old_button_pressed(hass, button):
+    """button_pressed as it was before the payloads were precomputed."""
+    payload = {
+        'button':        slugify(button.name),
+        'button_vid':    button.vid,
+        'button_number': button.number,
+    }
+    if button._keypad is not None:
+        payload['keypad_name'] = slugify(button.keypad_name)
+        payload['keypad_vid'] = button.keypad_vid
+
+    if button.value == "PRESS" or button.value == "Violated":
+        hass.bus.async_fire('vantage_button_pressed', payload)
+    elif button.value == "RELEASE" or button.value == "Normal":
+        hass.bus.async_fire('vantage_button_released', payload)
+
+
+async def run(label, hass, vc, buttons, subscribe, events):
+    """Dispatch events lines, alternating press and release."""
+    conn = AsyncVantageConnection(None, None, None, 0, vc._recv, False)
+    for button in buttons:
+        vc.subscribe(button, subscribe(button))
+    fired = []
+
+    @callback
+    def on_event(event):
+        fired.append(event)
+
+    unsubs = [hass.bus.async_listen(event_type, on_event)
+              for event_type in ("vantage_button_pressed",
+                                 "vantage_button_released")]
+    lines = ["S:BTN %d %s" % (buttons[i % len(buttons)].vid,
+                              ("PRESS", "RELEASE")[(i // len(buttons)) % 2])
+             for i in range(events)]
+    samples = []
+    for line in lines:
+        start = time.perf_counter()
+        conn._handle_line(line, 0)
+        samples.append(time.perf_counter() - start)
+    await asyncio.sleep(0)  # listeners run on the next loop iteration
+    assert len(fired) == events, "lost events"
+    report(label, samples, unit="us", scale=1e6)
+    for unsub in unsubs:
+        unsub()
+
+
+async def main():
+    """Compare the old and precomputed dispatch."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--keypads", type=int, default=200)
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    vc = make_vantage(areas=50, loads=0, keypads=args.keypads, contacts=0,
+                      variables=0, sensors=0)
+    buttons = [button for button in vc.buttons if button.kind == "button"]
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        await run("button_pressed", hass, vc, buttons,
+            lambda button: lambda device: old_button_pressed(hass, device),
+            args.events)
+        await run("precomputed", hass, vc, buttons,
+            lambda button: button_event_callback(hass, button), args.events)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,21 @@
+"""Helpers shared by the benchmark scripts."""
+import statistics
+
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of samples (nearest rank)."""
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def report(label, samples, unit="ms", scale=1000.0):
+    """Print a one-line latency summary for samples given in seconds."""
+    print("%-28s n=%-6d mean=%8.3f%s p50=%8.3f%s p95=%8.3f%s p99=%8.3f%s" % (
+        label, len(samples),
+        statistics.fmean(samples) * scale, unit,
+        percentile(samples, 50) * scale, unit,
+        percentile(samples, 95) * scale, unit,
+        percentile(samples, 99) * scale, unit))
@@ -0,0 +1,95 @@
+"""
+Memory of the entity side of a large install, and the garbage made by
+every state write.
+
+Builds the entities async_setup and the platforms would for a synthetic
+project of about --entities entities (lights, switches, covers, variables,
+keypads, contacts and sensors), registers each with the state-write
+coalescer, and reports:
+
+  entities  bytes allocated per entity for the entity objects, their
+            StateWriters and their first extra_state_attributes
+  writes    time per extra_state_attributes read (what each state write
+            asks for), over --writes reads spread across the entities
+
+    python -m bench.entities --entities 10000
+"""
+import argparse
+import asyncio
+import gc
+import tempfile
+import time
+import tracemalloc
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.vantage.cover import VantageCover
+from custom_components.vantage.debounce import StateWriteCoalescer
+from custom_components.vantage.light import VantageLight
+from custom_components.vantage.sensor import (
+    VantagePollingSensor, VantageSensor)
+from custom_components.vantage.switch import VantageSwitch
+
+from .synthetic import make_vantage
+
+
+def make_entities(vc):
+    """Return an entity for every device, as the platforms would."""
+    entities = []
+    for output in vc.outputs:
+        if output.kind == "RELAY":
+            entities.append(VantageSwitch("Area", output, vc))
+        elif output.kind == "BLIND":
+            entities.append(VantageCover("Area", output, vc))
+        else:
+            entities.append(VantageLight("Area", output, vc))
+    for device in vc.variables + vc.sensors + vc.keypads + [
+            button for button in vc.buttons if button.kind == "contact"]:
+        if device.needs_poll():
+            entities.append(VantagePollingSensor("", device, vc))
+        else:
+            entities.append(VantageSensor("", device, vc))
+    return entities
+
+
+async def main():
+    """Measure a project of the requested size."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=10000)
+    parser.add_argument("--writes", type=int, default=200000)
+    args = parser.parse_args()
+
+    n = args.entities
+    vc = make_vantage(areas=200, loads=n * 7 // 10, keypads=n // 10,
+                      buttons_per_keypad=6, contacts=n // 20,
+                      variables=n // 10, sensors=n // 20, tasks=0)
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        coalescer = StateWriteCoalescer()
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        entities = make_entities(vc)
+        for i, entity in enumerate(entities):
+            entity.hass = hass
+            entity.entity_id = "sensor.e%d" % i
+            coalescer.add(entity)
+            entity.extra_state_attributes  # noqa: B018
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print("entities   %d, %.0f bytes each, %.1fMB in all" % (
+            len(entities), held / len(entities), held / 2**20))
+
+        start = time.perf_counter()
+        for i in range(args.writes):
+            entities[i % len(entities)].extra_state_attributes  # noqa: B018
+        elapsed = time.perf_counter() - start
+        print("writes     %d, %.2fus each" % (
+            args.writes, elapsed / args.writes * 1e6))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
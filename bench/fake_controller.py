@@ -0,0 +1,236 @@
+"""
+A fake Vantage controller speaking enough of the Host Command protocol
+for pyvantage and the integration to talk to it.
+
+Loads, variables, blinds and sensors are kept in plain dicts keyed by vid.
+Commands get the same R: replies a real controller sends, and state changes
+are echoed as S: status lines to every connection that asked for them with
+STATUS.  An optional per-command latency simulates the controller's own
+processing time, and drop_clients(), stop() and hung simulate a controller
+rebooting, going away and wedging.
+
+FakeDesignCenter serves a project file on the Design Center XML port the
+way a controller does, for pyvantage's project download and the model
+cache's fingerprint request.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class FakeController():
+    """An in-process Host Command server."""
+
+    def __init__(self, loads=(), variables=(), blinds=(), sensors=(),
+                 user=None, password=None, latency=0.0):
+        """Initialize with the vids of the objects the controller knows."""
+        self.levels = {vid: 0.0 for vid in loads}
+        self.variables = {vid: 0 for vid in variables}
+        self.blinds = {vid: 100.0 for vid in blinds}
+        self.sensors = {vid: 0.0 for vid in sensors}
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.commands = 0
+        self.on_command = None  # called with (op, args) for each command
+        self.hung = False  # stop answering, as a wedged controller would
+        self._server = None
+        self._clients = {}  # writer -> set of STATUS types
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening; returns the port actually bound."""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening and drop every client."""
+        self.drop_clients()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def drop_clients(self):
+        """Close every client connection, as a controller reboot would."""
+        for writer in list(self._clients):
+            writer.close()
+        self._clients.clear()
+
+    def press(self, vid, action="PRESS"):
+        """Simulate a keypad button or dry contact changing."""
+        self._status("BTN", "S:BTN %d %s" % (vid, action))
+
+    def set_level(self, vid, level):
+        """Simulate a load changing at the controller (e.g. a keypad)."""
+        self.levels[vid] = float(level)
+        self._status("LOAD", "S:LOAD %d %.3f" % (vid, level))
+
+    async def _serve(self, reader, writer):
+        """Handle one client connection."""
+        self._clients[writer] = set()
+        try:
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                self.commands += 1
+                if not self.hung:
+                    self._handle(writer, line.decode('ascii').strip())
+        except (asyncio.IncompleteReadError, ConnectionError,
+                asyncio.CancelledError):
+            # cancelled when the benchmark's loop shuts down under us
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+
+    def _send(self, writer, line):
+        """Write one line to a client."""
+        if not writer.is_closing():
+            writer.write(line.encode('ascii') + b'\r\n')
+
+    def _status(self, status_type, line):
+        """Send a status line to everyone subscribed to status_type."""
+        for writer, types in self._clients.items():
+            if status_type in types:
+                self._send(writer, line)
+
+    def _handle(self, writer, line):
+        """Process one command and reply as the controller would."""
+        parts = line.split()
+        if not parts:
+            return
+        op, args = parts[0], parts[1:]
+        reply = self._dispatch(writer, op, args)
+        if self.on_command is not None:
+            self.on_command(op, args)
+        if reply is None:
+            reply = "R:ERROR:4 " + line
+        self._send(writer, reply)
+
+    def _dispatch(self, writer, op, args):
+        """Return the R: reply line for op, or None if it is an error."""
+        # pylint: disable=too-many-return-statements
+        if op == "LOGIN":
+            if self.user is None or args == [self.user, self.password]:
+                return "R:LOGIN Login successful"
+            return None
+        if op == "ECHO":
+            return "R:ECHO"
+        if op == "STATUS" and args:
+            self._clients[writer].add(args[0])
+            return "R:STATUS " + args[0]
+        if op in ("ADDSTATUS", "DELSTATUS", "INVOKE"):
+            return "R:%s %s" % (op, " ".join(args))
+        if not args or not args[0].isdigit():
+            return None
+        vid = int(args[0])
+        if op == "GETLOAD" and vid in self.levels:
+            return "R:GETLOAD %d %.3f" % (vid, self.levels[vid])
+        if op in ("LOAD", "RAMPLOAD") and vid in self.levels:
+            level = float(args[1])
+            self.levels[vid] = level
+            self._status("LOAD", "S:LOAD %d %.3f" % (vid, level))
+            return "R:%s %s" % (op, " ".join(args))
+        if op == "GETVARIABLE" and vid in self.variables:
+            return "R:GETVARIABLE %d %s" % (vid, self.variables[vid])
+        if op == "VARIABLE" and vid in self.variables:
+            self.variables[vid] = " ".join(args[1:])
+            self._status("VARIABLE", "S:VARIABLE %d %s" % (
+                vid, self.variables[vid]))
+            return "R:VARIABLE %s" % " ".join(args)
+        if op == "GETBLIND" and vid in self.blinds:
+            return "R:GETBLIND %d %.3f" % (vid, self.blinds[vid])
+        if op == "BLIND" and vid in self.blinds:
+            action = args[1]
+            if action == "OPEN":
+                self.blinds[vid] = 100.0
+            elif action == "CLOSE":
+                self.blinds[vid] = 0.0
+            elif action == "POS":
+                self.blinds[vid] = float(args[2])
+            self._status("BLIND", "S:BLIND %d %.3f" % (vid, self.blinds[vid]))
+            return "R:BLIND %s" % " ".join(args)
+        if op in ("GETLIGHT", "GETPOWER", "GETCURRENT", "GETSENSOR",
+                  "GETTEMPERATURE") and vid in self.sensors:
+            return "R:%s %d %.3f" % (op, vid, self.sensors[vid])
+        if op == "TASK":
+            return "R:TASK %s" % " ".join(args)
+        return None
+
+
+class FakeDesignCenter():
+    """An in-process Design Center XML server holding one project."""
+
+    def __init__(self, xml_db, user=None, password=None):
+        """Serve the project XML xml_db."""
+        self.xml_db = xml_db
+        self.user = user
+        self.password = password
+        self.downloads = 0
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening; returns the port actually bound."""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening."""
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        """Answer requests until the client hangs up or gets the file."""
+        try:
+            while True:
+                request = (await reader.readline()).decode('ascii')
+                if not request:
+                    break
+                if "<ILogin>" in request:
+                    ok = self.user is None or (
+                        "<User>%s</User>" % self.user in request and
+                        "<Password>%s</Password>" % self.password in request)
+                    writer.write(("<ILogin><Login><return>%s</return>"
+                                  "</Login></ILogin>\n" % (
+                                      "true" if ok else "false")).encode())
+                elif "<GetFileInfo>" in request:
+                    digest = hashlib.sha1(self.xml_db.encode()).hexdigest()
+                    writer.write(("<IBackup><GetFileInfo><return>"
+                                  "<Size>%d</Size><Digest>%s</Digest>"
+                                  "</return></GetFileInfo></IBackup>\n" % (
+                                      len(self.xml_db), digest)).encode())
+                elif "<GetFile>" in request:
+                    self.downloads += 1
+                    data = base64.b64encode(self.xml_db.encode()).decode()
+                    writer.write(("<IBackup><GetFile><return>"
+                                  "<?File Encode=\"Base64\" /%s?>"
+                                  "</return></GetFile></IBackup>\n" % (
+                                      data)).encode())
+                    # pyvantage reads the file until the connection closes
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+async def main():
+    """Run a standalone fake controller until interrupted."""
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--loads", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    controller = FakeController(loads=range(1, args.loads + 1),
+                                latency=args.latency)
+    port = await controller.start("0.0.0.0", args.port)
+    print("fake controller listening on port %d" % port)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,401 @@
+"""
+End-to-end benchmark of the integration inside Home Assistant, against a
+simulated controller.
+
+Serves a synthetic project from a FakeDesignCenter, answers Host Commands
+with a FakeController, boots a minimal Home Assistant in a temporary config
+directory with this custom component linked in, and reports:
+
+  setup     async_setup_component("vantage") until every entity exists
+  commands  one light.turn_on for every light, until the controller has
+            applied them all
+  light     light.turn_on service call to the controller receiving it
+  event     keypad press at the controller to vantage_button_pressed on
+            the Home Assistant bus
+  set_state vantage.set_state aimed at a few lights, until the service
+            call returns; then at many, with the lights set concurrently
+            against one at a time, until every command is acknowledged;
+            then at those again, at the level they are already at, with
+            and without force
+  area      vantage.set_area_level on a top-level area, against setting
+            the same loads one acknowledged command at a time
+  reload    changing the area filter in the entry's options until the
+            entities match it (no restart or reparse)
+  project   renaming, deleting and adding a load in the project, until
+            the fingerprint check has updated just those entities
+  memory    peak RSS growth over setup, and with --tracemalloc the Python
+            allocations made during setup (which slows setup down)
+
+With --timings the integration's collect_timings is turned on and its
+per-stage histograms are printed at the end; comparing runs with and
+without it shows what collecting them costs.
+
+No hardware is needed.
+
+    python -m bench.harness --areas 50 --loads 1000 --keypads 100
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from .common import report
+from .fake_controller import FakeController, FakeDesignCenter
+from .synthetic import make_project_xml, make_vantage
+
+COMPONENT_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "custom_components", "vantage")
+WAIT_TIMEOUT = 30
+# vid of the load bench_project adds to the project
+ADDED_VID = 999999
+# lights each vantage.set_state call is aimed at, and for the fan-out
+SET_STATE_TARGETS = 5
+SET_STATE_WIDE = 40
+# seconds for every state write window to have closed
+SETTLE_TIME = 0.5
+
+
+async def start_hass(config_dir):
+    """Boot just enough of Home Assistant to set up integrations."""
+    # pylint: disable=import-outside-toplevel
+    import homeassistant.core  # noqa: F401 -- import order matters
+    from homeassistant import bootstrap, config_entries, loader
+    from homeassistant.core import CoreState, HomeAssistant
+
+    custom = os.path.join(config_dir, "custom_components")
+    os.makedirs(custom, exist_ok=True)
+    os.symlink(COMPONENT_DIR, os.path.join(custom, "vantage"))
+    hass = HomeAssistant(config_dir)
+    loader.async_setup(hass)
+    hass.config.skip_pip = True
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await bootstrap.async_load_base_functionality(hass)
+    hass.set_state(CoreState.running)
+    return hass
+
+
+async def wait_until(predicate, what):
+    """Yield to the loop until predicate() is true."""
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("timed out waiting for " + what)
+        await asyncio.sleep(0.001)
+
+
+def maxrss_mb():
+    """Peak resident set size of this process, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def bench_setup(hass, config, trace):
+    """Time setting up the integration and all its platforms."""
+    # pylint: disable=import-outside-toplevel
+    from homeassistant.setup import async_setup_component
+
+    rss = maxrss_mb()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    assert await async_setup_component(hass, "vantage", {"vantage": config})
+    await hass.async_block_till_done()
+    elapsed = time.perf_counter() - start
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    counts = {domain: len(hass.states.async_entity_ids(domain))
+              for domain in ("light", "switch", "cover", "sensor")}
+    print("setup      %8.1fms  %s" % (elapsed * 1000, ", ".join(
+        "%s: %d" % (domain, n) for domain, n in counts.items())))
+    print("memory     peak RSS +%.1fMB (%.1fMB total)" % (
+        maxrss_mb() - rss, maxrss_mb()))
+    if trace:
+        print("           traced %.1fMB held after setup, %.1fMB peak" % (
+            current / 2**20, peak / 2**20))
+
+
+def light_vids(hass):
+    """Map each light entity_id to the vid of its load."""
+    return {state.entity_id: state.attributes["vantage_id"]
+            for state in hass.states.async_all("light")}
+
+
+async def bench_commands(hass, controller):
+    """Turn every light on with one service call."""
+    lights = light_vids(hass)
+    commands = controller.commands
+    start = time.perf_counter()
+    await hass.services.async_call(
+        "light", "turn_on", {"entity_id": list(lights), "brightness": 128},
+        blocking=True)
+    await wait_until(lambda: all(controller.levels[vid] > 0
+                                 for vid in lights.values()),
+                     "every light to turn on")
+    elapsed = time.perf_counter() - start
+    sent = controller.commands - commands
+    print("commands   %8.1fms  %d commands for %d lights, %.0f cmd/s" % (
+        elapsed * 1000, sent, len(lights), sent / elapsed))
+
+
+async def bench_light(hass, controller, iterations):
+    """Time light.turn_on until the controller gets the command."""
+    loop = asyncio.get_running_loop()
+    lights = list(light_vids(hass).items())
+    waiting = {}
+
+    def on_command(op, args):
+        fut = waiting.pop(args[0] if args else None, None)
+        if fut is not None and op in ("LOAD", "RAMPLOAD"):
+            fut.set_result(None)
+
+    controller.on_command = on_command
+    samples = []
+    for i in range(iterations):
+        entity_id, vid = lights[i % len(lights)]
+        fut = loop.create_future()
+        waiting[str(vid)] = fut
+        start = time.perf_counter()
+        # a level the light isn't at (bench_commands left them all at 128),
+        # or the command is skipped as redundant
+        await hass.services.async_call(
+            "light", "turn_on",
+            {"entity_id": entity_id,
+             "brightness": 64 + 64 * (i // len(lights) % 2)})
+        await asyncio.wait_for(fut, WAIT_TIMEOUT)
+        samples.append(time.perf_counter() - start)
+    controller.on_command = None
+    report("light", samples)
+
+
+async def bench_events(hass, controller, button_vids, iterations):
+    """Time keypad presses until the event is on the bus."""
+    loop = asyncio.get_running_loop()
+    waiting = {}
+
+    def on_event(event):
+        fut = waiting.pop(event.data["button_vid"], None)
+        if fut is not None:
+            fut.set_result(None)
+
+    unsub = hass.bus.async_listen("vantage_button_pressed", on_event)
+    samples = []
+    for i in range(iterations):
+        vid = button_vids[i % len(button_vids)]
+        fut = loop.create_future()
+        waiting[vid] = fut
+        start = time.perf_counter()
+        controller.press(vid)
+        await asyncio.wait_for(fut, WAIT_TIMEOUT)
+        samples.append(time.perf_counter() - start)
+    unsub()
+    report("event", samples)
+
+
+async def bench_set_state(hass, controller, iterations):
+    """Time vantage.set_state calls aimed at SET_STATE_TARGETS lights,
+    then at SET_STATE_WIDE lights with and without fan-out, then count
+    the commands sent setting them to the level they have."""
+    # pylint: disable=import-outside-toplevel
+    from custom_components.vantage import light
+
+    lights = list(light_vids(hass))
+    samples = []
+    for i in range(iterations):
+        first = i * SET_STATE_TARGETS % len(lights)
+        start = time.perf_counter()
+        await hass.services.async_call(
+            "vantage", "set_state",
+            {"entity_id": lights[first:first + SET_STATE_TARGETS],
+             "brightness": 64 + 64 * (i % 2), "force": True},
+            blocking=True)
+        samples.append(time.perf_counter() - start)
+    report("set_state x%d" % SET_STATE_TARGETS, samples)
+    fanout = light.SET_STATE_FANOUT
+    for label, brightness in (("concurrently", 255), ("one at a time", 32)):
+        if label == "one at a time":
+            light.SET_STATE_FANOUT = 1
+        response = await hass.services.async_call(
+            "vantage", "set_state",
+            {"entity_id": lights[:SET_STATE_WIDE], "brightness": brightness},
+            blocking=True, return_response=True)
+        print("           %8.1fms  %d lights %s, %d missed, %d failed" % (
+            response["latency_ms"], response["lights"], label,
+            len(response["missed"]), len(response["errors"])))
+    light.SET_STATE_FANOUT = fanout
+    for force in (False, True):
+        commands = controller.commands
+        response = await hass.services.async_call(
+            "vantage", "set_state",
+            {"entity_id": lights[:SET_STATE_WIDE], "brightness": 32,
+             "force": force},
+            blocking=True, return_response=True)
+        await asyncio.sleep(SETTLE_TIME)
+        print("           %8.1fms  %d lights already set, force=%s: "
+              "%d commands" % (response["latency_ms"], response["lights"],
+                               force, controller.commands - commands))
+    # let the status echoes and their state writes settle, so they don't
+    # land in the next stage
+    await asyncio.sleep(SETTLE_TIME)
+    await hass.async_block_till_done()
+
+
+async def bench_area(hass, area):
+    """Time setting a whole area at once, and one load at a time."""
+    # pylint: disable=import-outside-toplevel
+    from custom_components.vantage.areas import area_loads
+
+    response = await hass.services.async_call(
+        "vantage", "set_area_level", {"area": area, "level": 0},
+        blocking=True, return_response=True)
+    print("area       %8.1fms  %s: %d loads in one burst, %d missed" % (
+        response["latency_ms"], area, response["loads"], response["missed"]))
+    vc = hass.data["vantage_controller"]
+    loads = area_loads(vc, hass.data["vantage_entities"], area)
+    start = time.perf_counter()
+    for load in loads:
+        await vc._conn.command(vc, "LOAD", load.vid, 100)
+    print("           %8.1fms  %s: %d loads one at a time" % (
+        (time.perf_counter() - start) * 1000, area, len(loads)))
+
+
+def print_timings(hass):
+    """Print the integration's own per-stage histograms."""
+    timings = hass.data["vantage_controller"]._conn.timings
+    for stage, summary in timings.summary().items():
+        print("  %-22s %s" % (stage, ", ".join(
+            "%s=%s" % item for item in summary.items())))
+
+
+async def bench_reload(hass, area):
+    """Time excluding an area through the options, and including it
+    again."""
+    entry = hass.config_entries.async_entries("vantage")[0]
+    def available():
+        # removed entities stay in the registry and show as unavailable
+        return sum(1 for state in hass.states.async_all()
+                   if state.state != "unavailable")
+
+    for label, exclude in (("exclude", area), ("include", "")):
+        before = available()
+        start = time.perf_counter()
+        hass.config_entries.async_update_entry(
+            entry, options={**entry.options, "exclude_areas": exclude})
+        await hass.async_block_till_done()
+        elapsed = time.perf_counter() - start
+        print("reload     %8.1fms  %s %s: %d entities, then %d" % (
+            elapsed * 1000, label, area, before, available()))
+
+
+def change_project(xml_db, load):
+    """Return xml_db with load renamed, the load after it deleted and a
+    new load added next to it."""
+    area = re.search(r"<Name>%s</Name><Area>(\d+)</Area>" % re.escape(load),
+                     xml_db).group(1)
+    xml_db = xml_db.replace("<Name>%s</Name>" % load,
+                            "<Name>%s renamed</Name>" % load)
+    xml_db = re.sub(r'<Object><Load VID="\d+"><Name>(?!%s)[^<]*</Name>.*?'
+                    r'</Object>' % re.escape(load), "", xml_db, count=1)
+    added = ('<Object><Load VID="%d"><Name>Added load</Name>'
+             '<Area>%s</Area><LoadType>Incandescent</LoadType></Load>'
+             '</Object>' % (ADDED_VID, area))
+    return xml_db.replace("</Objects>", added + "</Objects>")
+
+
+async def bench_project(hass, controller, design_center):
+    """Time noticing and applying a small project change."""
+    watcher = hass.data["vantage_project_watcher"]
+    await watcher.async_check()  # learn the current fingerprint
+    entities = hass.data["vantage_entities"]
+    before = set(entities)
+    design_center.xml_db = change_project(design_center.xml_db, "Load 0")
+    controller.levels[ADDED_VID] = 0.0
+    start = time.perf_counter()
+    changed = await watcher.async_check()
+    await hass.async_block_till_done()
+    elapsed = time.perf_counter() - start
+    after = set(entities)
+    print("project    %8.1fms  changed=%s: %d entities added, %d removed, "
+          "%d kept" % (elapsed * 1000, changed, len(after - before),
+                       len(before - after), len(before & after)))
+
+
+async def main():
+    """Run every stage against one synthetic project."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--areas", type=int, default=50)
+    parser.add_argument("--loads", type=int, default=1000)
+    parser.add_argument("--keypads", type=int, default=100)
+    parser.add_argument("--buttons-per-keypad", type=int, default=6)
+    parser.add_argument("--variables", type=int, default=100)
+    parser.add_argument("--sensors", type=int, default=30)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--num-connections", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated per-command controller latency")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="also trace Python allocations during setup")
+    parser.add_argument("--timings", action="store_true",
+                        help="collect and print the per-stage timings")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # a fresh config directory has no state to restore
+    logging.getLogger("custom_components.vantage.sensor").setLevel(
+        logging.ERROR)
+
+    xml_db = make_project_xml(areas=args.areas, loads=args.loads,
+                              keypads=args.keypads,
+                              buttons_per_keypad=args.buttons_per_keypad,
+                              variables=args.variables, sensors=args.sensors)
+    model = make_vantage(xml_db)
+    controller = FakeController(
+        loads=[output.vid for output in model.outputs],
+        variables=[var.vid for var in model.variables],
+        sensors=[sensor.vid for sensor in model.sensors],
+        latency=args.latency)
+    design_center = FakeDesignCenter(xml_db)
+    button_vids = [button.vid for button in model.buttons
+                   if button.kind == "button"]
+    print("project    %d bytes: %d areas, %d loads, %d buttons, "
+          "%d variables, %d sensors" % (
+              len(xml_db), args.areas, args.loads, len(button_vids),
+              args.variables, args.sensors))
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        config = {"host": "127.0.0.1",
+                  "port": await controller.start(),
+                  "file_port": await design_center.start(),
+                  "num_connections": args.num_connections,
+                  "collect_timings": args.timings,
+                  # service calls here have no user, so they count as
+                  # automations; measure the pipeline, not the limit
+                  "command_rate": 0}
+        hass = await start_hass(config_dir)
+        try:
+            await bench_setup(hass, config, args.tracemalloc)
+            await bench_commands(hass, controller)
+            await bench_light(hass, controller, args.iterations)
+            await bench_events(hass, controller, button_vids,
+                               args.iterations)
+            await bench_set_state(hass, controller, args.iterations)
+            await bench_area(hass, model._vid_to_area[
+                model._vid_to_area[model.outputs[0].area].parent].name)
+            await bench_reload(hass, model._vid_to_area[
+                model.outputs[0].area].name)
+            await bench_project(hass, controller, design_center)
+            if args.timings:
+                print_timings(hass)
+        finally:
+            await hass.async_stop(force=True)
+            await controller.stop()
+            await design_center.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""
+Cold-start cost of parsing a project versus restoring the model cache.
+
+    python -m bench.model_cache --loads 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from pyvantage import Vantage
+
+from custom_components.vantage import cache
+
+from .synthetic import make_project_xml, make_vantage
+
+
+def main():
+    """Parse a synthetic project, save it, and time restoring it."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--areas", type=int, default=300)
+    parser.add_argument("--loads", type=int, default=5000)
+    parser.add_argument("--keypads", type=int, default=500)
+    parser.add_argument("--variables", type=int, default=1000)
+    args = parser.parse_args()
+
+    xml_db = make_project_xml(areas=args.areas, loads=args.loads,
+                              keypads=args.keypads, variables=args.variables)
+    start = time.perf_counter()
+    vc = make_vantage(xml_db)
+    parsed = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = cache.cache_filename(tmpdir, "bench")
+        start = time.perf_counter()
+        cache.save_model(vc, filename, "fingerprint")
+        saved = time.perf_counter() - start
+        size = os.path.getsize(filename)
+
+        restored_vc = Vantage(None, None, None, filename="bench",
+                              commdebug=False)
+        start = time.perf_counter()
+        assert cache.load_model(restored_vc, filename, "fingerprint")
+        restored = time.perf_counter() - start
+
+    print("project XML      %8d bytes, parsed in %7.1fms" % (
+        len(xml_db), parsed * 1000))
+    print("model cache      %8d bytes, saved in  %7.1fms, restored in "
+          "%7.1fms" % (size, saved * 1000, restored * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Name exclusion over many entities and patterns.
+
+Compares the old one-substring-test-per-pattern loop with NameFilter's
+single compiled matcher.
+
+    python -m bench.name_filter --patterns 200
+"""
+import argparse
+import time
+
+from custom_components.vantage.filters import NameFilter
+
+from .synthetic import make_vantage
+
+
+def baseline_excluded(substrings):
+    """The per-pattern loop async_setup used before NameFilter."""
+    def is_excluded_name(entity):
+        for ns in substrings:
+            if ns in entity.name:
+                return True
+        return False
+    return is_excluded_name
+
+
+def run(label, excluded, objs, repeat):
+    """Time filtering every object, best of repeat."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dropped = {obj.vid for obj in objs if excluded(obj)}
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("%-10s %5d names, %5d excluded in %8.2fms" % (
+        label, len(objs), len(dropped), best * 1000))
+    return dropped
+
+
+def main():
+    """Compare baseline and compiled name filtering."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--patterns", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    vc = make_vantage(areas=300, loads=3000, keypads=200, contacts=200,
+                      variables=500, sensors=100)
+    objs = vc.outputs + vc.variables + vc.buttons + vc.sensors + vc.keypads
+    substrings = {"Load %d7" % i for i in range(args.patterns)}
+
+    old = run("baseline", baseline_excluded(substrings), objs, args.repeat)
+    new = run("compiled", NameFilter(substrings).excluded, objs, args.repeat)
+    assert old == new, "filters disagree"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Reconnecting to the simulated controller, and resyncing what was missed.
+
+Sets the integration up inside a minimal Home Assistant, then makes the
+FakeController misbehave three ways, changing --changed loads behind the
+integration's back each time (no status is sent for them):
+
+  blip     every connection dropped, the controller still up: reconnects
+           at once, entities stay available
+  outage   the controller gone for --outage seconds, longer than the
+           (shortened) unavailable delay: entities turn unavailable and
+           come back
+  hung     the controller stops answering without closing anything: the
+           (shortened) heartbeat notices
+  flap     every connection dropped, and dropped again (with the loads
+           changed again) while the controller is slowly answering the
+           resync
+
+For each it reports how long until every connection was back and resynced,
+how many light states were written, which should be just the changed
+loads (or every light, once, after they had turned unavailable), and how
+many of the changed lights Home Assistant still shows wrong (should be 0).
+
+    python -m bench.reconnect --loads 1000 --changed 10
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from custom_components.vantage import connection, supervisor
+
+from .fake_controller import FakeController, FakeDesignCenter
+from .harness import SETTLE_TIME, start_hass, wait_until
+from .synthetic import make_project_xml, make_vantage
+
+
+class LightWrites():
+    """Counts state changes of the lights."""
+
+    def __init__(self, hass):
+        """Start listening."""
+        self.count = 0
+        self.unavailable = 0
+        hass.bus.async_listen("state_changed", self._on_event)
+
+    def _on_event(self, event):
+        """Count one light's state change."""
+        if not event.data["entity_id"].startswith("light."):
+            return
+        self.count += 1
+        if event.data["new_state"].state == "unavailable":
+            self.unavailable += 1
+
+
+def change_silently(controller, vids, level):
+    """Change loads at the controller without telling anyone."""
+    for vid in vids:
+        controller.levels[vid] = level
+
+
+def wrong_lights(hass, controller, lights):
+    """Return how many of lights Home Assistant shows at a level other
+    than the controller's."""
+    wrong = 0
+    for state in hass.states.async_all("light"):
+        vid = state.attributes["vantage_id"]
+        if vid not in lights:
+            continue
+        brightness = state.attributes.get("brightness") or 0
+        if abs(brightness - controller.levels[vid] * 255 / 100) > 1:
+            wrong += 1
+    return wrong
+
+
+async def scenario(hass, controller, lights, label, writes, misbehave):
+    """Run misbehave(), which returns once the controller is back, then
+    wait for the resync and report."""
+    sup = hass.data["vantage_supervisor"]
+    conn = hass.data["vantage_controller"]._conn
+    resyncs = sup.resyncs
+    writes.count = writes.unavailable = 0
+    start = time.perf_counter()
+    await misbehave()
+    await wait_until(lambda: (sup.resyncs > resyncs and conn.connected and
+                              sup._resync_task is None),
+                     label + " resync")
+    await hass.async_block_till_done()
+    elapsed = time.perf_counter() - start
+    # writes coalesced into the state write window land at its end
+    await asyncio.sleep(SETTLE_TIME)
+    print("%-8s %8.1fms  resync %s, %d light states written "
+          "(%d unavailable), %d wrong, reconnects=%d "
+          "heartbeat_failures=%d" % (
+              label, elapsed * 1000, sup.last_resync, writes.count,
+              writes.unavailable, wrong_lights(hass, controller, lights),
+              conn.reconnects, conn.heartbeat_failures))
+
+
+async def main():
+    """Misbehave at the integration and watch it recover."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loads", type=int, default=1000)
+    parser.add_argument("--changed", type=int, default=10)
+    parser.add_argument("--outage", type=float, default=2.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    # shorten the delays so the run takes seconds, not minutes
+    supervisor.UNAVAILABLE_AFTER = args.outage / 2
+    connection.HEARTBEAT_INTERVAL = 0.5
+    connection.HEARTBEAT_TIMEOUT = 0.5
+
+    xml_db = make_project_xml(areas=20, loads=args.loads, keypads=0,
+                              contacts=0, variables=0, sensors=0)
+    model = make_vantage(xml_db)
+    controller = FakeController(loads=[output.vid for output in model.outputs])
+    lights = [output.vid for output in model.outputs
+              if output.kind == "LIGHT"][:args.changed]
+    design_center = FakeDesignCenter(xml_db)
+    with tempfile.TemporaryDirectory() as config_dir:
+        port = await controller.start()
+        config = {"host": "127.0.0.1", "port": port,
+                  "file_port": await design_center.start()}
+        hass = await start_hass(config_dir)
+        try:
+            # pylint: disable=import-outside-toplevel
+            from homeassistant.setup import async_setup_component
+            assert await async_setup_component(hass, "vantage",
+                                               {"vantage": config})
+            await hass.async_block_till_done()
+            writes = LightWrites(hass)
+
+            async def blip():
+                change_silently(controller, lights, 50.0)
+                controller.drop_clients()
+
+            async def outage():
+                await controller.stop()
+                change_silently(controller, lights, 75.0)
+                await asyncio.sleep(args.outage)
+                await controller.start(port=port)
+
+            async def hung():
+                change_silently(controller, lights, 25.0)
+                controller.hung = True
+                conn = hass.data["vantage_controller"]._conn
+                failures = conn.heartbeat_failures
+                await wait_until(lambda: conn.heartbeat_failures > failures,
+                                 "heartbeat failure")
+                controller.hung = False
+
+            async def flap():
+                conn = hass.data["vantage_controller"]._conn
+                change_silently(controller, lights, 60.0)
+                # slow enough that the second drop lands mid-resync
+                controller.latency = 0.003
+                controller.drop_clients()
+                await wait_until(lambda: conn.connected, "reconnect")
+                await asyncio.sleep(0.1)
+                reconnects = conn.reconnects
+                change_silently(controller, lights, 42.0)
+                controller.drop_clients()
+                await wait_until(lambda: (conn.reconnects > reconnects and
+                                          conn.connected), "reconnect")
+                controller.latency = 0.0
+
+            for label, misbehave in (("blip", blip), ("outage", outage),
+                                     ("hung", hung), ("flap", flap)):
+                await scenario(hass, controller, lights, label, writes,
+                               misbehave)
+        finally:
+            await hass.async_stop(force=True)
+            await controller.stop()
+            await design_center.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
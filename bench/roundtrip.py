@@ -0,0 +1,129 @@
+"""
+Command round-trip latency against the fake controller.
+
+Measures the time from issuing a load level change on the event loop to
+the controller's status echo reaching the subscriber back on the loop,
+once through pyvantage's threaded connection driven from an executor (the
+old path) and once through AsyncVantageConnection (the new path).  Also
+times a burst of one command per load, like a startup storm.
+
+    python -m bench.roundtrip --loads 600 --iterations 500
+"""
+import argparse
+import asyncio
+import functools
+import time
+
+from pyvantage import Vantage, Output
+
+from custom_components.vantage.connection import AsyncVantageConnection
+
+from .common import report
+from .fake_controller import FakeController
+
+# pyvantage's reader thread handles one line per select() wakeup, so
+# lines that arrive together can sit unread until more traffic comes in
+ECHO_TIMEOUT = 1
+BURST_TIMEOUT = 10
+
+
+def make_controller(port, num_loads):
+    """Build a pyvantage controller with num_loads dimmable outputs."""
+    vc = Vantage("127.0.0.1", None, None, cmd_port=port, commdebug=False)
+    outputs = [Output(vc, "Load %d" % vid, 0, 'LIGHT', 'Incandescent',
+                      None, False, vid)
+               for vid in range(1, num_loads + 1)]
+    return vc, outputs
+
+
+async def run_path(name, vc, outputs, iterations, threaded):
+    """Time single round trips and one burst over all outputs."""
+    loop = asyncio.get_running_loop()
+    waiting = {}
+
+    def resolve(fut):
+        if not fut.done():
+            fut.set_result(None)
+
+    def on_status(device):
+        fut = waiting.pop(device.vid, None)
+        if fut is not None:
+            if threaded:
+                loop.call_soon_threadsafe(resolve, fut)
+            else:
+                resolve(fut)
+
+    for output in outputs:
+        vc.subscribe(output, on_status)
+
+    def set_level(output, level):
+        output.level = level
+
+    async def command(output, level):
+        fut = loop.create_future()
+        waiting[output.vid] = fut
+        if threaded:
+            await loop.run_in_executor(
+                None, functools.partial(set_level, output, level))
+        else:
+            set_level(output, level)
+        await fut
+
+    samples = []
+    lost = 0
+    for i in range(iterations):
+        output = outputs[i % len(outputs)]
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                command(output, 100 if output.last_level() == 0 else 0),
+                ECHO_TIMEOUT)
+        except asyncio.TimeoutError:
+            lost += 1
+            continue
+        samples.append(time.perf_counter() - start)
+    report(name + " single", samples)
+    if lost:
+        print("%-28s %d echoes not seen within %ss" % (
+            name + " single", lost, ECHO_TIMEOUT))
+
+    start = time.perf_counter()
+    tasks = [loop.create_task(command(o, 100 if o.last_level() == 0 else 0))
+             for o in outputs]
+    done, pending = await asyncio.wait(tasks, timeout=BURST_TIMEOUT)
+    elapsed = time.perf_counter() - start
+    for task in pending:
+        task.cancel()
+    print("%-28s %d/%d echoed in %.1fms (%.0f cmd/s)" % (
+        name + " burst", len(done), len(outputs), elapsed * 1000,
+        len(done) / elapsed))
+
+
+async def main():
+    """Run both paths against one fake controller."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--loads", type=int, default=600)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated controller latency in seconds")
+    args = parser.parse_args()
+
+    controller = FakeController(loads=range(1, args.loads + 1),
+                                latency=args.latency)
+    port = await controller.start()
+
+    vc, outputs = make_controller(port, args.loads)
+    await asyncio.get_running_loop().run_in_executor(None, vc.connect)
+    await run_path("threaded+executor", vc, outputs, args.iterations, True)
+
+    vc, outputs = make_controller(port, args.loads)
+    vc._conn = AsyncVantageConnection("127.0.0.1", None, None, port,
+                                      vc._recv, False)
+    await vc._conn.async_connect()
+    await run_path("asyncio", vc, outputs, args.iterations, False)
+    await vc._conn.async_close()
+    await controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
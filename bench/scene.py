@@ -0,0 +1,83 @@
+"""
+Scene-style multi-light change against the fake controller.
+
+Turns a set of dimmable loads off the way vantage.set_state does, once
+with every command written as soon as it is issued and once batched into
+a single burst, and reports the time until the last status echo arrives,
+how many socket writes were made and how many superseded level commands
+were dropped.
+
+    python -m bench.scene --lights 40
+"""
+import argparse
+import asyncio
+import time
+
+from custom_components.vantage.connection import AsyncVantageConnection
+
+from .fake_controller import FakeController
+from .roundtrip import make_controller
+
+
+async def run_scene(name, port, num_lights, batched):
+    """Turn num_lights on at 50% then off, as two writes per load."""
+    vc, outputs = make_controller(port, num_lights)
+    conn = AsyncVantageConnection("127.0.0.1", None, None, port,
+                                  vc._recv, False)
+    vc._conn = conn
+    await conn.async_connect()
+    loop = asyncio.get_running_loop()
+    remaining = set()
+    done = loop.create_future()
+
+    def on_status(device):
+        if device.last_level() == 0:
+            remaining.discard(device.vid)
+        if not remaining and not done.done():
+            done.set_result(None)
+
+    for output in outputs:
+        output._level = 100.0
+        vc.subscribe(output, on_status)
+        remaining.add(output.vid)
+
+    start = time.perf_counter()
+    if batched:
+        with conn.batch():
+            for output in outputs:
+                output.set_ramp_sec(1, 1, 1)
+                output.level = 50
+                output.level = 0
+    else:
+        for output in outputs:
+            output.set_ramp_sec(1, 1, 1)
+            output.level = 50
+            conn.scheduler.flush()
+            output.level = 0
+            conn.scheduler.flush()
+    await done
+    elapsed = time.perf_counter() - start
+    print("%-10s %3d lights settled in %7.2fms, %3d writes, "
+          "%3d superseded" % (name, num_lights, elapsed * 1000,
+                              conn.scheduler.bursts,
+                              conn.scheduler.superseded_commands))
+    await conn.async_close()
+
+
+async def main():
+    """Run the scene unbatched and batched."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--lights", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.0005,
+                        help="simulated per-command controller latency")
+    args = parser.parse_args()
+    controller = FakeController(loads=range(1, args.lights + 1),
+                                latency=args.latency)
+    port = await controller.start()
+    await run_scene("unbatched", port, args.lights, False)
+    await run_scene("batched", port, args.lights, True)
+    await controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
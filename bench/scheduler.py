@@ -0,0 +1,83 @@
+"""
+Light command latency while a bulk state fetch is in progress.
+
+Queues a GETLOAD for every load (as at startup) and then, while those are
+still being answered, turns lights on and times each until its status echo
+arrives.  Run once with everything in one first-come-first-served queue
+(the old behavior) and once with the fetch on the bulk queue, for one and
+three connections.
+
+    python -m bench.scheduler --loads 1000 --latency 0.001
+"""
+import argparse
+import asyncio
+import time
+
+from custom_components.vantage.connection import AsyncVantageConnection
+from custom_components.vantage.scheduler import (
+    BULK, INTERACTIVE, command_queue)
+
+from .common import report
+from .fake_controller import FakeController
+from .roundtrip import make_controller
+
+LIGHTS = 20
+
+
+async def run(label, port, num_loads, num_connections, fetch_queue, level):
+    """Time LIGHTS light changes to level issued behind a fetch of every
+    load.  Each run uses a new level so the controller always echoes."""
+    vc, outputs = make_controller(port, num_loads)
+    conn = AsyncVantageConnection("127.0.0.1", None, None, port, vc._recv,
+                                  False, num_connections)
+    vc._conn = conn
+    await conn.async_connect()
+    loop = asyncio.get_running_loop()
+    waiting = {}
+
+    def on_status(device):
+        fut = waiting.pop(device.vid, None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    for output in outputs[:LIGHTS]:
+        vc.subscribe(output, on_status)
+
+    with command_queue(fetch_queue):
+        for output in outputs:
+            vc.send("GETLOAD", output.vid)
+    samples = []
+    for output in outputs[:LIGHTS]:
+        await asyncio.sleep(0.002)
+        fut = loop.create_future()
+        waiting[output.vid] = fut
+        start = time.perf_counter()
+        output.level = level
+        await fut
+        samples.append(time.perf_counter() - start)
+    report("%s x%d" % (label, num_connections), samples)
+    await conn.async_close()
+
+
+async def main():
+    """Compare first-come-first-served with the bulk queue."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--loads", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.001,
+                        help="simulated per-command controller latency")
+    args = parser.parse_args()
+    controller = FakeController(loads=range(1, args.loads + 1),
+                                latency=args.latency)
+    port = await controller.start()
+    level = 10
+    for num_connections in (1, 3):
+        for label, fetch_queue in (("fifo", INTERACTIVE),
+                                   ("bulk queue", BULK)):
+            await run(label, port, args.loads, num_connections, fetch_queue,
+                      level)
+            level += 10
+    await controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
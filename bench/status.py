@@ -0,0 +1,117 @@
+"""
+Status message throughput, with and without batched notification.
+
+Sets the integration up inside a minimal Home Assistant, then has the
+simulated controller send --rounds status messages for each of --ramping
+loads, as if they were all ramping at once, as fast as it can.  Reports
+how long until the last one was handled, the status messages per second
+that makes, and how many times entities were told about a change, once
+with pyvantage notifying per line and once with the StatusDispatcher
+notifying each changed device once per chunk read.
+
+With the default state_write_window the coalescer already folds the
+updates into one write per window, so both take about as long; batching
+only saves subscriber calls.  --window 0 writes every update, and shows
+what batching saves when nothing else coalesces.
+
+    python -m bench.status --loads 1000 --ramping 200 --rounds 50
+    python -m bench.status --window 0
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from .fake_controller import FakeController, FakeDesignCenter
+from .harness import SETTLE_TIME, start_hass, wait_until
+from .synthetic import make_project_xml, make_vantage
+
+
+async def flood(hass, controller, vids, rounds, base, label, batched,
+                settle):
+    """Ramp every load in vids through rounds levels from base up to
+    base + 1 and report, counting the state writes once settle seconds
+    have let the last write window close."""
+    vc = hass.data["vantage_controller"]
+    dispatcher = hass.data["vantage_dispatcher"]
+    if batched:
+        vc.handle_update_and_notify = dispatcher.handle_update_and_notify
+    else:
+        # back to pyvantage's own, one notification per line
+        del vc.handle_update_and_notify
+    devices = [vc._ids["LOAD"][vid] for vid in vids]
+    handlers = {device: vc._subscribers[device] for device in devices}
+    notified = []
+
+    def counting(device):
+        notified.append(device)
+        handlers[device](device)
+
+    for device in devices:
+        vc._subscribers[device] = counting
+    writes = hass.data["vantage_state_writes"].stats()["writes"]
+    start = time.perf_counter()
+    for step in range(1, rounds + 1):
+        for vid in vids:
+            controller.set_level(vid, base + step / rounds)
+        await asyncio.sleep(0)
+    await wait_until(lambda: all(abs(device.last_level() - base - 1) < 0.01
+                                 for device in devices), label)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(settle)
+    await hass.async_block_till_done()
+    messages = rounds * len(vids)
+    print("%-10s %8.1fms  %d status messages, %.0f msg/s, "
+          "%d notifications, %d state writes" % (
+              label, elapsed * 1000, messages, messages / elapsed,
+              len(notified),
+              hass.data["vantage_state_writes"].stats()["writes"] - writes))
+    vc._subscribers.update(handlers)
+
+
+async def main():
+    """Flood the integration with status, per line and batched."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loads", type=int, default=1000)
+    parser.add_argument("--ramping", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--window", type=float, default=None,
+                        help="state_write_window (0 writes every update)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    xml_db = make_project_xml(areas=20, loads=args.loads, keypads=0,
+                              contacts=0, variables=0, sensors=0)
+    model = make_vantage(xml_db)
+    controller = FakeController(loads=[output.vid for output in model.outputs])
+    vids = [output.vid for output in model.outputs
+            if output.kind == "LIGHT"][:args.ramping]
+    design_center = FakeDesignCenter(xml_db)
+    with tempfile.TemporaryDirectory() as config_dir:
+        config = {"host": "127.0.0.1", "port": await controller.start(),
+                  "file_port": await design_center.start()}
+        if args.window is not None:
+            config["state_write_window"] = args.window
+        hass = await start_hass(config_dir)
+        try:
+            # pylint: disable=import-outside-toplevel
+            from homeassistant.setup import async_setup_component
+            assert await async_setup_component(hass, "vantage",
+                                               {"vantage": config})
+            await hass.async_block_till_done()
+            settle = max(SETTLE_TIME, args.window or 0)
+            await flood(hass, controller, vids, args.rounds, 10,
+                        "per line", False, settle)
+            await flood(hass, controller, vids, args.rounds, 50,
+                        "batched", True, settle)
+        finally:
+            await hass.async_stop(force=True)
+            await controller.stop()
+            await design_center.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
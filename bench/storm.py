@@ -0,0 +1,106 @@
+"""
+Light command latency during an automation storm.
+
+An automation (think of a circadian lighting script) sets --storm loads to
+a new level every --period seconds, on the automation queue; each pass
+keeps the simulated controller busy for a while.  Meanwhile lights are turned on the
+way a user would, on the interactive queue, and each is timed until its
+status echo arrives.  Run once without a rate limit and once with the
+default one, and report the interactive latency, how many commands the
+controller had to handle and how many the limit collapsed.
+
+    python -m bench.storm --storm 100 --period 0.5 --latency 0.001
+"""
+import argparse
+import asyncio
+import time
+
+from custom_components.vantage.connection import AsyncVantageConnection
+from custom_components.vantage.scheduler import (
+    AUTOMATION, DEFAULT_COMMAND_BURST, DEFAULT_COMMAND_RATE, INTERACTIVE,
+    command_queue)
+
+from .common import report
+from .fake_controller import FakeController
+from .roundtrip import make_controller
+
+LIGHTS = 20
+
+
+async def storm(outputs, period, stop):
+    """Set every output in outputs to a new level each period until stop
+    is set."""
+    level = 1
+    while not stop.is_set():
+        with command_queue(AUTOMATION):
+            for output in outputs:
+                output.level = level
+        level = level % 99 + 1
+        await asyncio.sleep(period)
+
+
+async def run(label, controller, port, args, rate):
+    """Time LIGHTS user light changes made during a storm."""
+    vc, outputs = make_controller(port, args.storm + LIGHTS)
+    conn = AsyncVantageConnection("127.0.0.1", None, None, port, vc._recv,
+                                  False)
+    conn.scheduler.set_rate_limit(rate, DEFAULT_COMMAND_BURST)
+    vc._conn = conn
+    await conn.async_connect()
+    loop = asyncio.get_running_loop()
+    waiting = {}
+
+    def on_status(device):
+        fut = waiting.pop(device.vid, None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    lights = outputs[args.storm:]
+    for output in lights:
+        vc.subscribe(output, on_status)
+    commands = controller.commands
+    stop = asyncio.Event()
+    storming = asyncio.create_task(storm(outputs[:args.storm], args.period,
+                                         stop))
+    samples = []
+    try:
+        for output in lights:
+            await asyncio.sleep(0.1)
+            fut = loop.create_future()
+            waiting[output.vid] = fut
+            start = time.perf_counter()
+            with command_queue(INTERACTIVE):
+                output.level = 100 if output.last_level() != 100 else 50
+            await asyncio.wait_for(fut, 60)
+            samples.append(time.perf_counter() - start)
+    finally:
+        stop.set()
+        await storming
+    report(label, samples)
+    print("%-10s controller got %d commands, %d superseded, "
+          "throttled %d times" % (label, controller.commands - commands,
+                                  conn.scheduler.superseded_commands,
+                                  conn.scheduler.throttled))
+    await conn.async_close()
+
+
+async def main():
+    """Compare no rate limit with the default one."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--storm", type=int, default=100,
+                        help="loads the automation changes")
+    parser.add_argument("--period", type=float, default=0.5,
+                        help="seconds between automation passes")
+    parser.add_argument("--latency", type=float, default=0.001,
+                        help="simulated per-command controller latency")
+    args = parser.parse_args()
+    controller = FakeController(loads=range(1, args.storm + LIGHTS + 1),
+                                latency=args.latency)
+    port = await controller.start()
+    await run("no limit", controller, port, args, 0)
+    await run("limited", controller, port, args, DEFAULT_COMMAND_RATE)
+    await controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
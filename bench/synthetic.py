@@ -0,0 +1,105 @@
+"""
+Synthetic Design Center projects of any size.
+
+make_project_xml() writes the subset of the Design Center XML that
+pyvantage's parser reads: a tree of areas, loads spread over the leaf
+areas, keypads with buttons, dry contacts, variables, omnisensors and
+tasks.  make_vantage() parses one into a pyvantage controller object
+without talking to any hardware.
+"""
+from xml.sax.saxutils import escape
+
+LOAD_TYPES = ("Incandescent", "LED Dim Type 1", "High Voltage Relay",
+              "Low Voltage Relay", "Magnetic Low Voltage")
+
+
+class _Vids():
+    """Hand out increasing vids."""
+
+    def __init__(self):
+        self.next = 1
+
+    def __call__(self):
+        vid = self.next
+        self.next += 1
+        return vid
+
+
+def make_project_xml(areas=20, loads=200, keypads=20, buttons_per_keypad=6,
+                     contacts=10, variables=50, sensors=10, tasks=10,
+                     fanout=4):
+    """Return the XML for a synthetic project.
+
+    Areas form a tree with the given fanout under a single project root,
+    and everything with an area is spread round-robin over the leaves."""
+    vid = _Vids()
+    objects = []
+
+    def obj(tag, vid_, body):
+        objects.append('<Object><%s VID="%d">%s</%s></Object>' % (
+            tag, vid_, body, tag))
+
+    root = vid()
+    obj("Area", root, "<Name>Synthetic Project</Name><Area>0</Area>")
+    area_vids = [root]
+    parents = [root]
+    while len(area_vids) < areas + 1:
+        children = []
+        for parent in parents:
+            for _ in range(fanout):
+                if len(area_vids) >= areas + 1:
+                    break
+                avid = vid()
+                obj("Area", avid, "<Name>Area %d</Name><Area>%d</Area>" % (
+                    avid, parent))
+                area_vids.append(avid)
+                children.append(avid)
+        parents = children
+    leaves = parents or [root]
+
+    for i in range(loads):
+        area = leaves[i % len(leaves)]
+        load_type = LOAD_TYPES[i % len(LOAD_TYPES)]
+        obj("Load", vid(),
+            "<Name>Load %d</Name><Area>%d</Area><LoadType>%s</LoadType>" % (
+                i, area, escape(load_type)))
+
+    for i in range(keypads):
+        area = leaves[i % len(leaves)]
+        kvid = vid()
+        obj("Keypad", kvid, "<Name>Keypad %d</Name><Area>%d</Area>" % (
+            i, area))
+        for num in range(1, buttons_per_keypad + 1):
+            obj("Button", vid(),
+                '<Name>Button %d</Name><Parent Position="%d">%d</Parent>'
+                '<Text1>Scene %d</Text1><Text2>K%d</Text2>' % (
+                    num, num, kvid, num, i))
+
+    for i in range(contacts):
+        area = leaves[i % len(leaves)]
+        obj("DryContact", vid(),
+            "<Name>Contact %d</Name><Parent>0</Parent><Area>%d</Area>" % (
+                i, area))
+
+    for i in range(variables):
+        tag = ("Number", "Text", "Boolean")[i % 3]
+        obj("GMem", vid(), "<Name>Variable %d</Name><Tag>%s</Tag>" % (i, tag))
+
+    for i in range(sensors):
+        model = ("Power", "Current", "Temperature")[i % 3]
+        obj("OmniSensor", vid(),
+            "<Name>Sensor %d</Name><Model>%s</Model>" % (i, model))
+
+    for i in range(tasks):
+        obj("Task", vid(), "<Name>Task %d</Name>" % i)
+
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<Project><Objects>' +
+            "".join(objects) + "</Objects></Project>")
+
+
+def make_vantage(xml_db=None, **kwargs):
+    """Parse a synthetic project into an unconnected pyvantage controller."""
+    from pyvantage import Vantage
+    vc = Vantage(None, None, None, filename="synthetic", commdebug=False)
+    vc.do_parse(xml_db or make_project_xml(**kwargs))
+    return vc
@@ -0,0 +1,89 @@
+"""
+Stale level echoes while an automation changes loads quickly.
+
+Sets --loads loads to one level and, before the controller has confirmed
+it, to another, --rounds times, with the simulated controller taking
+--latency seconds per command so that the first level's echoes arrive
+after the second was sent.  Counts how often a load was shown going back
+to the level it had already left (a flicker), once applying every echo
+as it comes and once through the WriteCache.
+
+    python -m bench.writes --loads 50 --rounds 20 --latency 0.001
+"""
+import argparse
+import asyncio
+import time
+
+from custom_components.vantage.connection import AsyncVantageConnection
+from custom_components.vantage.dispatch import StatusDispatcher
+from custom_components.vantage.writes import WriteCache
+
+from .fake_controller import FakeController
+from .harness import wait_until
+from .roundtrip import make_controller
+
+
+async def run(label, port, args, cached):
+    """Change every load twice per round and count the flickers."""
+    loop = asyncio.get_running_loop()
+    vc, outputs = make_controller(port, args.loads)
+    writes = None
+    if cached:
+        writes = WriteCache(loop, vc, lambda vid, reconciled: None)
+    dispatcher = StatusDispatcher(vc, writes)
+    conn = AsyncVantageConnection(
+        "127.0.0.1", None, None, port, vc._recv, False,
+        on_batch=dispatcher.flush,
+        on_send=writes.sent if writes is not None else None)
+    vc._conn = conn
+    await conn.async_connect()
+    targets = {}
+    flickers = [0]
+
+    def on_status(device):
+        if abs(device.last_level() - targets[device.vid]) >= 0.5:
+            flickers[0] += 1
+
+    for output in outputs:
+        vc.subscribe(output, on_status)
+    start = time.perf_counter()
+    for i in range(args.rounds):
+        first, second = 10 + i % 40, 60 + i % 40
+        for output in outputs:
+            targets[output.vid] = first
+            output.level = first
+        await asyncio.sleep(0.001)
+        for output in outputs:
+            targets[output.vid] = second
+            output.level = second
+        await wait_until(lambda second=second: all(
+            round(output.last_level()) == second and
+            vc._conn.scheduler.queues["interactive"].in_flight == 0
+            for output in outputs), label)
+    elapsed = time.perf_counter() - start
+    print("%-10s %8.1fms  %d level changes, %d flickers%s" % (
+        label, elapsed * 1000, 2 * args.rounds * args.loads, flickers[0],
+        ", %s" % writes.stats() if writes is not None else ""))
+    await conn.async_close()
+    if writes is not None:
+        writes.close()
+
+
+async def main():
+    """Compare applying every echo with the write cache."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--loads", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.001,
+                        help="simulated per-command controller latency")
+    args = parser.parse_args()
+    controller = FakeController(loads=range(1, args.loads + 1),
+                                latency=args.latency)
+    port = await controller.start()
+    await run("every echo", port, args, False)
+    await run("cached", port, args, True)
+    await controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
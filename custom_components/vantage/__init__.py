@@ -4,27 +4,67 @@ Component for interacting with a Vantage Infusion Controller system
 For more details about this component, please refer to the documentation at
 https://home-assistant.io/components/vantage/
 """
-import asyncio
+from contextlib import contextmanager
 import logging
 import functools
+import time
 
 import voluptuous as vol
 
 import homeassistant.helpers.config_validation as cv
-from homeassistant.const import CONF_HOST, CONF_PASSWORD, CONF_USERNAME
-from homeassistant.helpers import discovery
+from homeassistant.config_entries import SOURCE_IMPORT
+from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.core import SupportsResponse
+from homeassistant.const import (
+    CONF_HOST, CONF_PASSWORD, CONF_PORT, CONF_USERNAME,
+    EVENT_HOMEASSISTANT_STOP)
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.dispatcher import async_dispatcher_send
 from homeassistant.helpers.entity import Entity
-from homeassistant.core import Event
 from homeassistant.util import slugify
 
+from .areas import area_loads, async_set_loads_level
+from .cache import fetch_fingerprint, load_controller_model
+from .connection import CONNECT_ERRORS, AsyncVantageConnection
+from .debounce import DEFAULT_STATE_WRITE_WINDOW, StateWriteCoalescer
+from .dispatch import StatusDispatcher
+from .filters import AreaFilter, NameFilter
+from .index import EntityIndex
+from .memory import MEMORY_SAMPLE_INTERVAL, MemoryProfiler
+from .poll import PollEngine, add_status, async_snapshot
+from .project import (
+    DEFAULT_PROJECT_CHECK_INTERVAL, ProjectWatcher, merge_project)
+from .scheduler import (
+    AUTOMATION, BACKGROUND, DEFAULT_COMMAND_BURST, DEFAULT_COMMAND_RATE,
+    INTERACTIVE, command_queue)
+from .stats import span
+from .supervisor import ConnectionSupervisor
+from .writes import WriteCache
+
 DOMAIN = "vantage"
 
 _LOGGER = logging.getLogger(__name__)
 
 VANTAGE_CONTROLLER = "vantage_controller"
 VANTAGE_DEVICES = "vantage_devices"
+VANTAGE_STATE_WRITES = "vantage_state_writes"
+VANTAGE_POLL_ENGINE = "vantage_poll_engine"
+VANTAGE_MEMORY_PROFILER = "vantage_memory_profiler"
+VANTAGE_PLATFORMS = "vantage_platforms"
+VANTAGE_MODEL = "vantage_model"
+VANTAGE_ENTITIES = "vantage_entities"
+VANTAGE_PROJECT_WATCHER = "vantage_project_watcher"
+VANTAGE_SUPERVISOR = "vantage_supervisor"
+VANTAGE_DISPATCHER = "vantage_dispatcher"
+VANTAGE_WRITE_CACHE = "vantage_write_cache"
+
+PLATFORMS = ("light", "cover", "sensor", "switch")
+
+# sent with the devices to add to an already set up platform
+SIGNAL_ADD_DEVICES = "vantage_add_devices_{}"
 
 CONF_USE_SSL = "use_ssl"
+CONF_FILE_PORT = "file_port"
 CONF_ONLY_AREAS = "only_areas"
 CONF_ENABLE_CACHE = "enable_cache"
 CONF_EXCLUDE_AREAS = "exclude_areas"
@@ -34,44 +74,80 @@ CONF_EXCLUDE_KEYPADS = "exclude_keypads"
 CONF_EXCLUDE_VARIABLES = "exclude_variables"
 CONF_INCLUDE_UNDERSCORE_VARIABLES = "include_underscore_variables"
 CONF_EXCLUDE_NAME_SUBSTRING = "exclude_name_substring"
+CONF_INCLUDE_NAME_SUBSTRING = "include_name_substring"
 CONF_LOG_COMMUNICATIONS = "log_communications"
 CONF_NUM_CONNECTIONS = "num_connections"
+CONF_STATE_WRITE_WINDOW = "state_write_window"
+CONF_POLL_INTERVALS = "poll_intervals"
+CONF_COLLECT_TIMINGS = "collect_timings"
+CONF_PROJECT_CHECK_INTERVAL = "project_check_interval"
+CONF_COMMAND_RATE = "command_rate"
+CONF_COMMAND_BURST = "command_burst"
+CONF_SKIP_REDUNDANT_COMMANDS = "skip_redundant_commands"
 CONF_NAME_MAPPINGS = "name_mappings"
 CONF_AREA = "area"
 CONF_TO = "to"
 
+ATTR_AREA = "area"
+ATTR_LEVEL = "level"
+ATTR_TRANSITION = "transition"
+
 NAME_MAPPING_SCHEMA = vol.Schema(
     {vol.Required(CONF_AREA): cv.string, vol.Required(CONF_TO): cv.string}
 )
 
 NAME_MAPPINGS_SCHEMA = vol.All([NAME_MAPPING_SCHEMA])
 
-CONFIG_SCHEMA = vol.Schema(
+# the settings, whether they come from configuration.yaml or a config entry
+VANTAGE_SCHEMA = vol.Schema(
     {
-        DOMAIN: vol.Schema(
-            {
-                vol.Required(CONF_HOST): cv.string,
-                vol.Optional(CONF_PASSWORD): cv.string,
-                vol.Optional(CONF_USERNAME): cv.string,
-                vol.Optional(CONF_ONLY_AREAS): cv.string,
-                vol.Optional(CONF_EXCLUDE_AREAS): cv.string,
-                vol.Optional(CONF_EXCLUDE_NAME_SUBSTRING): cv.string,
-                vol.Optional(CONF_LOG_COMMUNICATIONS, default=False): cv.boolean,
-                vol.Optional(CONF_NUM_CONNECTIONS, default=1): cv.positive_int,
-                vol.Optional(CONF_INCLUDE_BUTTONS, default=False): cv.boolean,
-                vol.Optional(CONF_EXCLUDE_CONTACTS, default=False): cv.boolean,
-                vol.Optional(CONF_EXCLUDE_KEYPADS, default=False): cv.boolean,
-                vol.Optional(CONF_EXCLUDE_VARIABLES, default=False): cv.boolean,
-                vol.Optional(CONF_INCLUDE_UNDERSCORE_VARIABLES,
-                             default=False): cv.boolean,
-                vol.Optional(CONF_ENABLE_CACHE,
-                             default=False): cv.boolean,  # FIXME
-                vol.Optional(CONF_NAME_MAPPINGS): NAME_MAPPINGS_SCHEMA,
-                vol.Optional(CONF_USE_SSL, default=False): cv.boolean,
-            }
-        )
-    },
-    extra=vol.ALLOW_EXTRA,
+        vol.Required(CONF_HOST): cv.string,
+        vol.Optional(CONF_PASSWORD): cv.string,
+        vol.Optional(CONF_USERNAME): cv.string,
+        vol.Optional(CONF_PORT): cv.port,
+        vol.Optional(CONF_FILE_PORT): cv.port,
+        vol.Optional(CONF_ONLY_AREAS): cv.string,
+        vol.Optional(CONF_EXCLUDE_AREAS): cv.string,
+        vol.Optional(CONF_EXCLUDE_NAME_SUBSTRING): cv.string,
+        vol.Optional(CONF_INCLUDE_NAME_SUBSTRING): cv.string,
+        vol.Optional(CONF_LOG_COMMUNICATIONS, default=False): cv.boolean,
+        vol.Optional(CONF_NUM_CONNECTIONS, default=1): cv.positive_int,
+        vol.Optional(CONF_INCLUDE_BUTTONS, default=False): cv.boolean,
+        vol.Optional(CONF_EXCLUDE_CONTACTS, default=False): cv.boolean,
+        vol.Optional(CONF_EXCLUDE_KEYPADS, default=False): cv.boolean,
+        vol.Optional(CONF_EXCLUDE_VARIABLES, default=False): cv.boolean,
+        vol.Optional(CONF_INCLUDE_UNDERSCORE_VARIABLES,
+                     default=False): cv.boolean,
+        vol.Optional(CONF_ENABLE_CACHE,
+                     default=False): cv.boolean,
+        vol.Optional(CONF_NAME_MAPPINGS): NAME_MAPPINGS_SCHEMA,
+        vol.Optional(CONF_USE_SSL, default=False): cv.boolean,
+        vol.Optional(CONF_STATE_WRITE_WINDOW,
+                     default=DEFAULT_STATE_WRITE_WINDOW):
+            cv.positive_float,
+        vol.Optional(CONF_POLL_INTERVALS, default={}):
+            vol.Schema({cv.string: cv.positive_int}),
+        vol.Optional(CONF_COLLECT_TIMINGS, default=False): cv.boolean,
+        vol.Optional(CONF_PROJECT_CHECK_INTERVAL,
+                     default=DEFAULT_PROJECT_CHECK_INTERVAL):
+            cv.positive_int,
+        vol.Optional(CONF_COMMAND_RATE, default=DEFAULT_COMMAND_RATE):
+            cv.positive_float,
+        vol.Optional(CONF_COMMAND_BURST, default=DEFAULT_COMMAND_BURST):
+            cv.positive_int,
+        vol.Optional(CONF_SKIP_REDUNDANT_COMMANDS, default=True): cv.boolean,
+    }
+)
+
+CONFIG_SCHEMA = vol.Schema({DOMAIN: VANTAGE_SCHEMA}, extra=vol.ALLOW_EXTRA)
+
+SET_AREA_LEVEL_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_AREA): cv.string,
+        vol.Required(ATTR_LEVEL): vol.All(vol.Coerce(float),
+                                          vol.Range(min=0, max=100)),
+        vol.Optional(ATTR_TRANSITION): cv.positive_float,
+    }
 )
 
 
@@ -87,33 +163,20 @@ def mappings_from(nm):
     return answer
 
 
-def handle_dump_memory():
-    """Dump memory using muppy to look for a leak"""
-    from pympler import muppy, summary
-    from collections import Counter
-    import json
-    import random
-
-    _LOGGER.warning("vantage.dump_memory started")
-    all_objects = muppy.get_objects()
-    sum1 = summary.summarize(all_objects)
-    summary.print_(sum1)
-    _LOGGER.warning("vantage.dump_memory summary done")
-    events = [e for e in all_objects if isinstance(e, Event)]
-    event_types = [e.event_type for e in events]
-    c = Counter(event_types)
-    _LOGGER.warning("event_types: %s", json.dumps(c.most_common()))
-    for e in events:
-        if e.event_type == 'call_service':
-            if random.randint(0, 99) == 2:
-                _LOGGER.warning("event_type call_service, data = %s",
-                                json.dumps(e.data))
-                _LOGGER.warning("context =  %s", e.context)
-    _LOGGER.warning("vantage.dump_memory completed")
-
-
-def button_pressed(hass, button):
-    """Generate HASS bus events for button presses and releases."""
+# the event fired for each value a button or dry contact reports
+BUTTON_EVENTS = {
+    "PRESS": "vantage_button_pressed",
+    "Violated": "vantage_button_pressed",
+    "RELEASE": "vantage_button_released",
+    "Normal": "vantage_button_released",
+}
+
+
+def button_payload(button):
+    """Return the event data for button's events.
+
+    None of it changes at runtime, so it's built once per button and the
+    same (read-only) dict is sent with every event."""
     payload = {
         'button':        slugify(button.name),
         'button_vid':    button.vid,
@@ -122,21 +185,45 @@ def button_pressed(hass, button):
     if button._keypad is not None:
         payload['keypad_name'] = slugify(button.keypad_name)
         payload['keypad_vid'] = button.keypad_vid
+    return payload
+
 
-    if button.value == "PRESS" or button.value == "Violated":
-        hass.bus.fire('vantage_button_pressed', payload)
-    elif button.value == "RELEASE" or button.value == "Normal":
-        hass.bus.fire('vantage_button_released', payload)
-    else:
+def button_pressed(hass, button, payload=None):
+    """Generate HASS bus events for button presses and releases."""
+    event_type = BUTTON_EVENTS.get(button.value)
+    if event_type is None:
         _LOGGER.warning("Unexpected state for button %s: %s",
                         button.name, button.value)
+        return
+    if payload is None:
+        payload = button_payload(button)
+    hass.bus.async_fire(event_type, payload)
+
+
+def button_event_callback(hass, button):
+    """Return a pyvantage callback firing button's events."""
+    payload = button_payload(button)
+    fire = hass.bus.async_fire
+
+    def button_update_callback(device):
+        """Run when invoked by pyvantage when the button changes."""
+        event_type = BUTTON_EVENTS.get(device.value)
+        if event_type is None:
+            _LOGGER.warning("Unexpected state for button %s: %s",
+                            device.name, device.value)
+            return
+        fire(event_type, payload)
+
+    return button_update_callback
 
 
 async def async_setup(hass, base_config):
-    """Set up the Vantage component."""
-    from pyvantage import Vantage
+    """Set up the Vantage services, and import any configuration.yaml."""
 
     async def async_handle_set_variable_vid(call):
+        vc = hass.data[VANTAGE_CONTROLLER]
+        if vc is None:
+            return
         vid = call.data.get("vid")
         if vid is None:
             raise Exception("Missing vid on vantage.set_variable_vid")
@@ -144,12 +231,12 @@ async def async_setup(hass, base_config):
         if value is None:
             raise Exception("Missing value on vantage.set_variable_vid")
         _LOGGER.debug("Called SET_VARIABLE_VID service: %s", call)
-        fn = functools.partial(
-            hass.data[VANTAGE_CONTROLLER].set_variable_vid, vid, value
-        )
-        await hass.async_add_executor_job(fn)
+        vc.set_variable_vid(vid, value)
 
     async def async_handle_set_variable(call):
+        vc = hass.data[VANTAGE_CONTROLLER]
+        if vc is None:
+            return
         name = call.data.get("name")
         if name is None:
             raise Exception("Missing name on vantage.set_variable")
@@ -157,33 +244,109 @@ async def async_setup(hass, base_config):
         if value is None:
             raise Exception("Missing value on vantage.set_variable")
         _LOGGER.debug("Called SET_VARIABLE service: %s", str(call))
-        fn = functools.partial(hass.data[VANTAGE_CONTROLLER].set_variable,
-                               name, value)
-        await hass.async_add_executor_job(fn)
+        vc.set_variable(name, value)
 
     async def async_handle_call_task_vid(call):
+        vc = hass.data[VANTAGE_CONTROLLER]
+        if vc is None:
+            return
         vid = call.data.get("vid")
         if vid is None:
             raise Exception("Missing vid on vantage.call_task_vid")
         _LOGGER.debug("Called CALL_TASK_VID service: %s", str(call))
-        fn = functools.partial(hass.data[VANTAGE_CONTROLLER].call_task_vid,
-                               vid)
-        await hass.async_add_executor_job(fn)
+        vc.call_task_vid(vid)
 
     async def async_handle_call_task(call):
+        vc = hass.data[VANTAGE_CONTROLLER]
+        if vc is None:
+            return
         name = call.data.get("name")
         if name is None:
             raise Exception("Missing name on vantage.call_task")
         _LOGGER.debug("Called CALL_TASK service: %s", str(call))
-        fn = functools.partial(hass.data[VANTAGE_CONTROLLER].call_task, name)
-        await hass.async_add_executor_job(fn)
+        vc.call_task(name)
 
     async def async_handle_dump_memory(call):
-        await hass.async_add_executor_job(handle_dump_memory)
-
-    def button_update_callback(device):
-        """Run when invoked by pyvantage when the device state changes."""
-        button_pressed(hass, device)
+        profiler = hass.data.get(VANTAGE_MEMORY_PROFILER)
+        if profiler is None:
+            return
+        if call.data.get("stop"):
+            profiler.stop()
+            _LOGGER.warning("vantage.dump_memory stopped")
+        elif not profiler.running:
+            await profiler.async_start()
+            _LOGGER.warning("vantage.dump_memory started, sampling every "
+                            "%ds; call it again to report",
+                            MEMORY_SAMPLE_INTERVAL)
+            profiler.report()
+        else:
+            await profiler.async_sample()
+            profiler.report()
+
+    async def async_handle_set_area_level(call):
+        vc = hass.data[VANTAGE_CONTROLLER]
+        if vc is None:
+            return None
+        _LOGGER.debug("Called SET_AREA_LEVEL service: %s", str(call))
+        area = call.data[ATTR_AREA]
+        loads = area_loads(vc, hass.data[VANTAGE_ENTITIES], area)
+        if not loads:
+            _LOGGER.warning("vantage.set_area_level: no lights or relays "
+                            "in area %s", area)
+        done, missed, elapsed = await async_set_loads_level(
+            vc, loads, call.data[ATTR_LEVEL], call.data.get(ATTR_TRANSITION))
+        _LOGGER.info("vantage.set_area_level %s: %d loads set in %.1fms, "
+                     "%d not acknowledged", area, done, elapsed * 1000,
+                     missed)
+        return {"loads": done, "missed": missed,
+                "latency_ms": round(elapsed * 1000, 1)}
+
+    async def async_handle_refresh_project(call):
+        watcher = hass.data.get(VANTAGE_PROJECT_WATCHER)
+        if hass.data[VANTAGE_CONTROLLER] is None or watcher is None:
+            return
+        _LOGGER.debug("Called REFRESH_PROJECT service: %s", str(call))
+        await watcher.async_check(force=True)
+
+    async def async_handle_dump_stats(call):
+        vc = hass.data[VANTAGE_CONTROLLER]
+        if vc is None:
+            return
+        for name, metrics in vc._conn.scheduler.metrics()["queues"].items():
+            _LOGGER.warning("vantage.dump_stats queue %s: %s", name, metrics)
+        _LOGGER.warning("vantage.dump_stats scheduler: bursts=%d "
+                        "superseded=%d expired=%d throttled=%d",
+                        vc._conn.scheduler.bursts,
+                        vc._conn.scheduler.superseded_commands,
+                        vc._conn.scheduler.expired_commands,
+                        vc._conn.scheduler.throttled)
+        _LOGGER.warning("vantage.dump_stats status: %s",
+                        hass.data[VANTAGE_DISPATCHER].stats())
+        _LOGGER.warning("vantage.dump_stats level writes: %s",
+                        hass.data[VANTAGE_WRITE_CACHE].stats())
+        writes = hass.data[VANTAGE_STATE_WRITES].stats()
+        _LOGGER.warning("vantage.dump_stats state writes: %d written, "
+                        "%d suppressed", writes["writes"],
+                        writes["suppressed"])
+        for entity_id, written, suppressed in writes["entities"]:
+            _LOGGER.warning("vantage.dump_stats %s: %d written, "
+                            "%d suppressed", entity_id, written, suppressed)
+        for kind, stats in hass.data[VANTAGE_POLL_ENGINE].stats.items():
+            _LOGGER.warning("vantage.dump_stats polling %s: %s", kind, stats)
+        watcher = hass.data[VANTAGE_PROJECT_WATCHER]
+        _LOGGER.warning("vantage.dump_stats project: %d checks, %d changes",
+                        watcher.checks, watcher.changes)
+        supervisor = hass.data[VANTAGE_SUPERVISOR]
+        _LOGGER.warning("vantage.dump_stats connection: available=%s "
+                        "outages=%d reconnects=%d heartbeat_failures=%d "
+                        "resyncs=%d last_resync=%s", supervisor.available,
+                        supervisor.outages, vc._conn.reconnects,
+                        vc._conn.heartbeat_failures, supervisor.resyncs,
+                        supervisor.last_resync)
+        if vc._conn.timings is not None:
+            for stage, summary in vc._conn.timings.summary().items():
+                _LOGGER.warning("vantage.dump_stats timing %s: %s", stage,
+                                summary)
 
     hass.services.async_register(
         DOMAIN, "set_variable_vid", async_handle_set_variable_vid
@@ -192,16 +355,36 @@ async def async_setup(hass, base_config):
     hass.services.async_register(DOMAIN, "set_variable", async_handle_set_variable)
     hass.services.async_register(DOMAIN, "call_task", async_handle_call_task)
     hass.services.async_register(DOMAIN, "dump_memory", async_handle_dump_memory)
+    hass.services.async_register(DOMAIN, "dump_stats", async_handle_dump_stats)
+    hass.services.async_register(DOMAIN, "refresh_project",
+                                 async_handle_refresh_project)
+    hass.services.async_register(DOMAIN, "set_area_level",
+                                 async_handle_set_area_level,
+                                 schema=SET_AREA_LEVEL_SCHEMA,
+                                 supports_response=SupportsResponse.OPTIONAL)
 
     hass.data[VANTAGE_CONTROLLER] = None
-    hass.data[VANTAGE_DEVICES] = {"light": [], "cover": [],
-                                  "sensor": [], "switch": []}
+    if DOMAIN in base_config:
+        # configuration.yaml is imported into (and updates) a config entry
+        hass.async_create_task(hass.config_entries.flow.async_init(
+            DOMAIN, context={"source": SOURCE_IMPORT},
+            data=base_config[DOMAIN]))
+    return True
 
-    config = base_config.get(DOMAIN)
+
+def sort_devices(hass, vc, config):
+    """Sort the devices that pass the filters in config by platform.
+
+    Returns ({platform: [(area name, device)]}, buttons), where buttons are
+    the keypad buttons that only fire events."""
+    devices = {platform: [] for platform in PLATFORMS}
+    event_buttons = []
     only_areas = config.get(CONF_ONLY_AREAS)
     exclude_areas = config.get(CONF_EXCLUDE_AREAS)
     exclude_name_substring = config.get(CONF_EXCLUDE_NAME_SUBSTRING)
+    include_name_substring = config.get(CONF_INCLUDE_NAME_SUBSTRING)
     set_exclude_name_substring = set()
+    set_include_name_substring = set()
 
     if only_areas:
         only_areas = set(only_areas.split(","))
@@ -210,139 +393,39 @@ async def async_setup(hass, base_config):
     if exclude_name_substring:
         set_exclude_name_substring = set(exclude_name_substring.split(","))
         _LOGGER.debug("excluded_names = %s", set_exclude_name_substring)
+    if include_name_substring:
+        set_include_name_substring = set(include_name_substring.split(","))
+        _LOGGER.debug("included_names = %s", set_include_name_substring)
 
-    config_name_mappings = config.get(CONF_NAME_MAPPINGS)
-    name_mappings = None
-    if config_name_mappings is not None:
-        name_mappings = mappings_from(config_name_mappings)
-
-    username = None
-    password = None
-    if CONF_USERNAME in config:
-        username = config[CONF_USERNAME]
-        password = config[CONF_PASSWORD]
-        _LOGGER.info("Username is %s", username)
-
-    use_ssl_connection = config.get(CONF_USE_SSL, False)
-
-    hass.data[VANTAGE_CONTROLLER] = Vantage(
-        config[CONF_HOST],
-        username,
-        password,
-        only_areas,
-        exclude_areas,
-        3010 if use_ssl_connection else 3001,
-        2010 if use_ssl_connection else 2001,
-        name_mappings,
-        None,
-        config.get(CONF_LOG_COMMUNICATIONS),
-        config.get(CONF_NUM_CONNECTIONS),
-        use_ssl=use_ssl_connection
-    )
-
-    vc = hass.data[VANTAGE_CONTROLLER]
-
-    await hass.async_add_executor_job(
-        functools.partial(vc.load_xml_db,
-                          not(config.get(CONF_ENABLE_CACHE, False)),
-                          hass.config.config_dir)
-    )
-    await hass.async_add_executor_job(vc.connect)
-    _LOGGER.debug("Connected to main repeater at %s", config[CONF_HOST])
-
-    def is_excluded_name(entity):
-        for ns in set_exclude_name_substring:
-            if ns in entity.name:
-                _LOGGER.debug(
-                    "skipping %s because exclude_name_substring has '%s'",
-                    entity, ns)
-                return True
-        return False
-
-    def get_lineage_from_area(area):
-        count = 0
-        answer = [area.name]
-        while area and count < 10:
-            count += 1
-            parent_vid = area.parent
-            if parent_vid == 0:
-                break
-            area = vc._vid_to_area.get(parent_vid)
-            if area:
-                answer.append(area.name)
-        return answer
-
-    def should_keep_for_area_vid(area_vid):
-        area = vc._vid_to_area.get(area_vid)
-        if not area:
-            # no area, then we omit this if only_areas was specified,
-            # and include it (since it can't match an exclude_areas)
-            # otherwise
-            return not only_areas
-        return should_keep_for_area(area)
-
-    def should_keep_for_area(area):
-        # list of all the areas from child up to root
-        area_lineage = get_lineage_from_area(area)
-        _LOGGER.debug("area = %s; lineage = %a", area.name, area_lineage)
-        keep = not (only_areas or exclude_areas)
-        if only_areas:
-            for a in area_lineage:
-                if a in only_areas:
-                    _LOGGER.debug(
-                        "maybe including %s " "because of only_areas = %s",
-                        area.name,
-                        only_areas,
-                    )
-                    keep = True
-                    break
-            if keep and exclude_areas:
-                for a in area_lineage:
-                    if a in exclude_areas:
-                        _LOGGER.debug(
-                            "button %s is in exclude_areas," " so skipping", a
-                        )
-                        keep = False
-                        break
-        elif exclude_areas:  # not specified include_areas
-            keep = True
-            for a in area_lineage:
-                if a in exclude_areas:
-                    _LOGGER.debug(
-                        "discarding %s because exclude_areas = %s",
-                        area.name,
-                        exclude_areas,
-                    )
-                    keep = False
-                    break
-        return keep
+    is_excluded_name = NameFilter(set_exclude_name_substring,
+                                  set_include_name_substring).excluded
+    area_filter = AreaFilter(vc._vid_to_area, only_areas, exclude_areas)
 
     # Sort our devices into types
     for output in vc.outputs:
         _LOGGER.debug("output = %s", output)
-        area = vc._vid_to_area[output.area]
-        keep = should_keep_for_area(area)
-        if not keep:
+        if not area_filter.keep(output.area):
             continue
+        area = vc._vid_to_area[output.area]
         if is_excluded_name(output):
             continue
 
         if output.kind == "BLIND":
             _LOGGER.debug("adding blind %s to area=%s", output, area.name)
-            hass.data[VANTAGE_DEVICES]["cover"].append((area.name, output))
+            devices["cover"].append((area.name, output))
         elif output.kind == "RELAY":
             _LOGGER.debug("adding switch %s to area=%s", output, area.name)
-            hass.data[VANTAGE_DEVICES]["switch"].append((area.name, output))
+            devices["switch"].append((area.name, output))
         elif output.kind == "LIGHT":
             _LOGGER.debug("adding light %s to area=%s", output, area.name)
-            hass.data[VANTAGE_DEVICES]["light"].append((area.name, output))
+            devices["light"].append((area.name, output))
         elif output.kind == "GROUP":
             _LOGGER.debug(
                 "adding group (of lights/relays) %s to area=%s",
                 output,
                 area.name,
             )
-            hass.data[VANTAGE_DEVICES]["light"].append((area.name, output))
+            devices["light"].append((area.name, output))
 
     if not config.get(CONF_EXCLUDE_VARIABLES):
         for var in vc.variables:
@@ -354,42 +437,333 @@ async def async_setup(hass, base_config):
                         dom = "switch"
                     else:
                         dom = "sensor"
-                    hass.data[VANTAGE_DEVICES][dom].append((None, var))
+                    devices[dom].append((None, var))
 
     # buttons and dry contacts are are sensors too:
     # Their value is the name of the last action on them
     for button in vc.buttons:
+        if not area_filter.keep(button.area) or is_excluded_name(button):
+            continue
         if (button.kind == "button" and config.get(CONF_INCLUDE_BUTTONS)) or (
             button.kind == "contact" and not config.get(CONF_EXCLUDE_CONTACTS)
         ):
-            if should_keep_for_area_vid(button.area) and not is_excluded_name(button):
-                hass.data[VANTAGE_DEVICES]["sensor"].append((None, button))
+            devices["sensor"].append((None, button))
         if (button.kind == "button" and not config.get(CONF_INCLUDE_BUTTONS)):
-            if should_keep_for_area_vid(button.area) and not is_excluded_name(button):
-                hass.async_add_executor_job(vc.subscribe, button, button_update_callback)
+            event_buttons.append(button)
 
     for sensor in vc.sensors:
-        if should_keep_for_area_vid(sensor.area) and not is_excluded_name(sensor):
-            hass.data[VANTAGE_DEVICES]["sensor"].append((sensor._area, sensor))
+        if area_filter.keep(sensor.area) and not is_excluded_name(sensor):
+            devices["sensor"].append((sensor._area, sensor))
 
     # and so are keypads.  Their value is the name of the last button pressed
     if not config.get(CONF_EXCLUDE_KEYPADS):
         for keypad in vc.keypads:
-            if should_keep_for_area_vid(keypad.area) and not is_excluded_name(keypad):
-                hass.data[VANTAGE_DEVICES]["sensor"].append((None, keypad))
+            if area_filter.keep(keypad.area) and not is_excluded_name(keypad):
+                devices["sensor"].append((None, keypad))
+    return devices, event_buttons
+
+
+async def async_setup_entry(hass, entry):
+    """Connect to the controller and set up the platforms with devices."""
+    from pyvantage import Vantage
+
+    config = VANTAGE_SCHEMA({**entry.data, **entry.options})
+    hass.data[VANTAGE_ENTITIES] = EntityIndex()
+    hass.data[VANTAGE_STATE_WRITES] = StateWriteCoalescer(
+        config[CONF_STATE_WRITE_WINDOW])
+
+    config_name_mappings = config.get(CONF_NAME_MAPPINGS)
+    name_mappings = None
+    if config_name_mappings is not None:
+        name_mappings = mappings_from(config_name_mappings)
+
+    username = None
+    password = None
+    if CONF_USERNAME in config:
+        username = config[CONF_USERNAME]
+        password = config[CONF_PASSWORD]
+        _LOGGER.info("Username is %s", username)
+
+    use_ssl_connection = config.get(CONF_USE_SSL, False)
+    cmd_port = config.get(CONF_PORT, 3010 if use_ssl_connection else 3001)
+    file_port = config.get(CONF_FILE_PORT,
+                           2010 if use_ssl_connection else 2001)
+
+    def new_vantage():
+        """Return an unloaded controller object for this config."""
+        return Vantage(
+            config[CONF_HOST],
+            username,
+            password,
+            config.get(CONF_ONLY_AREAS),
+            config.get(CONF_EXCLUDE_AREAS),
+            cmd_port,
+            file_port,
+            name_mappings,
+            None,
+            config.get(CONF_LOG_COMMUNICATIONS),
+            config.get(CONF_NUM_CONNECTIONS),
+            use_ssl=use_ssl_connection
+        )
+
+    def load_project(vantage):
+        """Read the project into vantage; runs in the executor."""
+        return load_controller_model(vantage, hass.config.config_dir,
+                                     config[CONF_HOST], file_port,
+                                     username, password, use_ssl_connection,
+                                     config.get(CONF_ENABLE_CACHE, False),
+                                     name_mappings)
+
+    def load_new_project():
+        """Parse the current project into a scratch controller object."""
+        vantage = new_vantage()
+        load_project(vantage)
+        return vantage
+
+    model_key = (config[CONF_HOST], file_port, username, password,
+                 use_ssl_connection, repr(name_mappings))
+    vc = None
+    fingerprint = None
+    if VANTAGE_MODEL in hass.data:
+        cached_key, vc, fingerprint = hass.data[VANTAGE_MODEL]
+        if cached_key != model_key:
+            vc = None
+            fingerprint = None
+    model_loaded = vc is not None
+    if vc is None:
+        vc = new_vantage()
+    hass.data[VANTAGE_CONTROLLER] = vc
+
+    def forget_dropped(cmd):
+        """Keep pyvantage's reply bookkeeping in step with dropped commands."""
+        try:
+            vc._cmds.remove(cmd)
+        except ValueError:
+            pass
+
+    def write_status_changed(vid, reconciled):
+        """Show a load's write status, and its level if it was put back."""
+        entity = hass.data[VANTAGE_ENTITIES].get(vid)
+        if entity is None:
+            return
+        entity.invalidate_attributes()
+        if reconciled:
+            entity.async_write_ha_state()
+
+    # Replace pyvantage's threaded connection with one that lives on
+    # the event loop, so commands and status never hop threads, and have
+    # each chunk it reads notify every changed device once, leaving out
+    # levels superseded by commands still in flight
+    writes = hass.data[VANTAGE_WRITE_CACHE] = WriteCache(
+        hass.loop, vc, write_status_changed,
+        config[CONF_SKIP_REDUNDANT_COMMANDS])
+    dispatcher = hass.data[VANTAGE_DISPATCHER] = StatusDispatcher(vc, writes)
+    vc._conn = AsyncVantageConnection(
+        config[CONF_HOST],
+        username,
+        password,
+        cmd_port,
+        vc._recv,
+        config.get(CONF_LOG_COMMUNICATIONS),
+        config.get(CONF_NUM_CONNECTIONS),
+        use_ssl=use_ssl_connection,
+        on_drop=forget_dropped,
+        on_batch=dispatcher.flush,
+        on_send=writes.sent
+    )
+    vc._conn.add_listener(writes.connection_changed)
+    if config[CONF_COLLECT_TIMINGS]:
+        vc._conn.enable_timings()
+    vc._conn.scheduler.set_rate_limit(config[CONF_COMMAND_RATE],
+                                      config[CONF_COMMAND_BURST])
+
+    if not model_loaded:
+        fingerprint = await hass.async_add_executor_job(load_project, vc)
+        # kept across reloads, so changing a filter doesn't reparse
+        hass.data[VANTAGE_MODEL] = (model_key, vc, fingerprint)
+    try:
+        await vc._conn.async_connect(retry=False)
+    except CONNECT_ERRORS as e:
+        writes.close()
+        vc._cmds.clear()
+        hass.data[VANTAGE_CONTROLLER] = None
+        raise ConfigEntryNotReady(
+            "Could not connect to %s:%d: %s" % (config[CONF_HOST], cmd_port,
+                                                e)) from e
+    _LOGGER.debug("Connected to main repeater at %s", config[CONF_HOST])
+
+    hass.data[VANTAGE_POLL_ENGINE] = PollEngine(hass, vc,
+                                                config[CONF_POLL_INTERVALS])
+    hass.data[VANTAGE_MEMORY_PROFILER] = MemoryProfiler(
+        hass, vc, hass.data[VANTAGE_STATE_WRITES])
+    supervisor = ConnectionSupervisor(hass, vc, hass.data[VANTAGE_ENTITIES],
+                                      dispatcher)
+    hass.data[VANTAGE_SUPERVISOR] = supervisor
+    supervisor.start()
+
+    async def async_apply_project(new, new_fingerprint):
+        """Merge a changed project and update only the affected entities."""
+        await async_apply_project_change(hass, entry, config, new)
+        hass.data[VANTAGE_MODEL] = (model_key, vc, new_fingerprint)
+
+    watcher = ProjectWatcher(
+        hass,
+        functools.partial(fetch_fingerprint, config[CONF_HOST], file_port,
+                          username, password, use_ssl_connection),
+        load_new_project, async_apply_project, fingerprint)
+    hass.data[VANTAGE_PROJECT_WATCHER] = watcher
+    entry.async_on_unload(hass.bus.async_listen_once(
+        EVENT_HOMEASSISTANT_STOP, functools.partial(async_shutdown, hass)))
+
+    devices, event_buttons = sort_devices(hass, vc, config)
+    hass.data[VANTAGE_DEVICES] = devices
+    for button in event_buttons:
+        vc.subscribe(button, button_event_callback(hass, button))
+
+    # read every device's state in one pass, so the entities can be added
+    # without each asking for its own
+    start = time.monotonic()
+    queried, missed = await async_snapshot(
+        vc, [device for devs in devices.values() for (_, device) in devs])
+    _LOGGER.info("Read the state of %d devices in %.2fs (%d did not answer)",
+                 queried, time.monotonic() - start, missed)
+
+    # only load the platforms that have something to show, all at once
+    platforms = [platform for platform in PLATFORMS if devices[platform]]
+    hass.data[VANTAGE_PLATFORMS] = platforms
+    await hass.config_entries.async_forward_entry_setups(entry, platforms)
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+    watcher.start(config[CONF_PROJECT_CHECK_INTERVAL])
+    return True
+
+
+def _placements(devices):
+    """Map the vid of every sorted device to (platform, area, device)."""
+    return {device.vid: (platform, area_name, device)
+            for platform, devs in devices.items()
+            for (area_name, device) in devs}
 
-    for component in ("light", "cover", "sensor", "switch"):
-        await discovery.async_load_platform(hass, component, DOMAIN, None, base_config)
 
+async def async_apply_project_change(hass, entry, config, new):
+    """Merge the newly parsed project new into the controller, then add,
+    remove and refresh only the entities whose devices changed."""
+    start = time.monotonic()
+    vc = hass.data[VANTAGE_CONTROLLER]
+    old_placements = _placements(hass.data[VANTAGE_DEVICES])
+    # the other subscriptions are the buttons that only fire events
+    old_buttons = [device for device in vc._subscribers
+                   if device.vid not in old_placements]
+    added, removed, updated = merge_project(vc, new)
+    devices, event_buttons = sort_devices(hass, vc, config)
+    placements = _placements(devices)
+
+    # an entity is replaced when its device is, or moves platform
+    gone = set()
+    for vid, (platform, _, device) in old_placements.items():
+        placement = placements.get(vid)
+        if (placement is None or placement[0] != platform or
+                placement[2] is not device):
+            gone.add(vid)
+    new_devices = {}
+    changed = []
+    for vid, (platform, area_name, device) in placements.items():
+        old = old_placements.get(vid)
+        if old is None or vid in gone:
+            new_devices.setdefault(platform, []).append((area_name, device))
+        elif vid in updated or old[1] != area_name:
+            changed.append((area_name, device))
+
+    for button in old_buttons:
+        vc._subscribers.pop(button, None)
+    for button in event_buttons:
+        vc.subscribe(button, button_event_callback(hass, button))
+
+    registry = er.async_get(hass)
+    entities = hass.data[VANTAGE_ENTITIES]
+    for vid in gone:
+        entity = entities.get(vid)
+        if entity is None:
+            continue
+        if registry.async_get(entity.entity_id) is not None:
+            # removing it from the registry removes the entity too
+            registry.async_remove(entity.entity_id)
+        else:
+            await entity.async_remove()
+
+    for area_name, device in changed:
+        entity = entities.get(device.vid)
+        if entity is not None:
+            entity.async_device_changed(area_name)
+
+    hass.data[VANTAGE_DEVICES] = devices
+    if new_devices:
+        await async_snapshot(vc, [device for devs in new_devices.values()
+                                  for (_, device) in devs])
+    to_set_up = []
+    for platform, devs in new_devices.items():
+        if platform in hass.data[VANTAGE_PLATFORMS]:
+            async_dispatcher_send(hass, SIGNAL_ADD_DEVICES.format(platform),
+                                  devs)
+        else:
+            # the platform's setup adds everything sorted into it
+            hass.data[VANTAGE_PLATFORMS].append(platform)
+            to_set_up.append(platform)
+    if to_set_up:
+        await hass.config_entries.async_forward_entry_setups(entry, to_set_up)
+    _LOGGER.info("Vantage project changed: %d devices added, %d removed and "
+                 "%d updated; %d entities added, %d removed and %d updated "
+                 "in %.2fs", len(added), len(removed), len(updated),
+                 sum(len(devs) for devs in new_devices.values()), len(gone),
+                 len(changed), time.monotonic() - start)
+
+
+async def async_shutdown(hass, _event=None):
+    """Stop polling, sampling and watching and close the connections."""
+    hass.data[VANTAGE_POLL_ENGINE].stop()
+    hass.data[VANTAGE_MEMORY_PROFILER].stop()
+    hass.data[VANTAGE_PROJECT_WATCHER].stop()
+    hass.data[VANTAGE_SUPERVISOR].stop()
+    hass.data[VANTAGE_WRITE_CACHE].close()
+    await hass.data[VANTAGE_CONTROLLER]._conn.async_close()
+
+
+async def async_unload_entry(hass, entry):
+    """Remove the entities and disconnect, keeping the parsed project."""
+    if not await hass.config_entries.async_unload_platforms(
+            entry, hass.data[VANTAGE_PLATFORMS]):
+        return False
+    await async_shutdown(hass)
+    vc = hass.data[VANTAGE_CONTROLLER]
+    vc._subscribers.clear()
+    vc._cmds.clear()
+    hass.data[VANTAGE_CONTROLLER] = None
     return True
 
 
+async def async_reload_entry(hass, entry):
+    """Apply changed options by reloading the entry."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
+async def async_remove_entry(hass, entry):
+    """Forget the parsed project when the entry is deleted."""
+    hass.data.pop(VANTAGE_MODEL, None)
+
+
 class VantageDevice(Entity):
     """Representation of a Vantage device entity.
 
     This is the base class for all the different types of
     HASS objects, each of which will also descend from their
-    object-specific HASS base class."""
+    object-specific HASS base class.
+
+    Large installs have thousands of these, so our own fields live in
+    __slots__ rather than each entity's __dict__; subclasses declare
+    theirs the same way."""
+
+    __slots__ = ("_vantage_device", "_controller", "_area_name",
+                 "_unit_of_measurement", "_device_class", "_state_writer",
+                 "_extra_attrs")
 
     _attr_should_poll = False
 
@@ -399,30 +773,107 @@ class VantageDevice(Entity):
         self._vantage_device = vantage_device
         self._controller = controller
         self._area_name = area_name
-        self._unique_id = "vantagevid-{}".format(vantage_device.vid)
         self._unit_of_measurement = None
         self._device_class = None
+        self._state_writer = None
+        self._extra_attrs = None
 
     async def async_added_to_hass(self):
         """Register callbacks."""
-        # this was async_add_job, but see: https://developers.home-assistant.io/blog/2024/03/13/deprecate_add_run_job/
-        self.hass.async_add_executor_job(
-            self._controller.subscribe, self._vantage_device, self._update_callback
-        )
+        self._state_writer = self.hass.data[VANTAGE_STATE_WRITES].add(self)
+        self.hass.data[VANTAGE_ENTITIES].add(self)
+        self._controller.subscribe(self._vantage_device, self._update_callback)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe, and drop any state write still waiting for its
+        window."""
+        self._controller._subscribers.pop(self._vantage_device, None)
+        self.hass.data[VANTAGE_ENTITIES].remove(self)
+        self.hass.data[VANTAGE_STATE_WRITES].remove(self)
 
     def _update_callback(self, _device):
-        """Run when invoked by pyvantage when the device state changes."""
-        self.schedule_update_ha_state()
+        """Run when invoked by pyvantage when the device state changes.
+
+        Status is read on the event loop; bursts of updates are coalesced
+        into one state write per state_write_window."""
+        self._state_writer.update(self._is_settled())
+
+    def _is_settled(self):
+        """Return true iff the device's current state is final (e.g. a
+        ramp has reached its target) and should be written right away."""
+        return False
+
+    def async_device_changed(self, area_name):
+        """Run when the project changed the device's configuration (it
+        has already been updated in place)."""
+        self._area_name = area_name
+        self.hass.data[VANTAGE_ENTITIES].reindex(self)
+        self.invalidate_attributes()
+        self.async_write_ha_state()
+
+    def invalidate_attributes(self):
+        """Rebuild extra_state_attributes at the next state write.  Call
+        whenever the device's extra info or configuration changes."""
+        self._extra_attrs = None
+
+    def _span(self, stage):
+        """Time a block as stage if collect_timings is on."""
+        return span(self._controller._conn.timings, stage)
+
+    def _command_queue(self):
+        """Return the queue for the commands of the service call being
+        handled: interactive when a user made it (from the UI or a voice
+        assistant), automation when an automation or script did."""
+        context = self._context
+        if context is not None and context.user_id is not None:
+            return INTERACTIVE
+        return AUTOMATION
+
+    @contextmanager
+    def _service(self, stage):
+        """Time a service call as stage, sending its commands on the queue
+        _command_queue() picks."""
+        with self._span(stage), command_queue(self._command_queue()):
+            yield
+
+    def _send_level(self, level, force=False):
+        """Set the load to level, unless it is already there or on its way
+        (see WriteCache.skip_level) and force is false.  Return true iff
+        a command was sent."""
+        device = self._vantage_device
+        if not force and self.hass.data[VANTAGE_WRITE_CACHE].skip_level(
+                device, level):
+            _LOGGER.debug("%s already at %s, not sent", device, level)
+            return False
+        if force:
+            # pyvantage doesn't send a level the device already has
+            device._level = None
+        device.level = level
+        return True
+
+    async def async_query(self, op, queue=BACKGROUND):
+        """Ask the controller for this device's state and wait for it."""
+        with command_queue(queue):
+            if op == "GETLOAD":
+                add_status(self._controller, self._vantage_device)
+            return await self._controller._conn.async_query(
+                self._controller, op, self._vantage_device.vid)
 
     @property
     def name(self):
         """Return the name of the device."""
         return self._vantage_device.name
 
+    @property
+    def available(self):
+        """Return false once the controller has been unreachable for a
+        while."""
+        return self.hass.data[VANTAGE_SUPERVISOR].available
+
     @property
     def unique_id(self):
         """Unique ID of Vantage device - uses vid."""
-        return self._unique_id
+        return "vantagevid-{}".format(self._vantage_device.vid)
 
     @property
     def unit_of_measurement(self):
@@ -442,11 +893,24 @@ class VantageDevice(Entity):
 
     @property
     def extra_state_attributes(self):
-        """Return the extra state attributes."""
-        attr = self._vantage_device._extra_info.copy()
-        attr["vantage_id"] = self._vantage_device.id
-        if self.kind is not None:
-            attr["vantage_kind"] = self.kind
-        if self.unit_of_measurement is not None:
-            attr["unit_of_measurement"] = self.unit_of_measurement
+        """Return the extra state attributes.
+
+        Built once and reused for every state write until
+        invalidate_attributes() is called.  Loads that have been set also
+        show whether their level is pending, confirmed or unconfirmed (see
+        writes.py), and the level the controller last reported."""
+        attr = self._extra_attrs
+        if attr is None:
+            attr = self._vantage_device._extra_info.copy()
+            attr["vantage_id"] = self._vantage_device.id
+            if self.kind is not None:
+                attr["vantage_kind"] = self.kind
+            if self.unit_of_measurement is not None:
+                attr["unit_of_measurement"] = self.unit_of_measurement
+            writes = self.hass.data.get(VANTAGE_WRITE_CACHE)
+            write = (writes.status(self._vantage_device.vid)
+                     if writes is not None else None)
+            if write is not None:
+                attr["vantage_write"], attr["vantage_confirmed_level"] = write
+            self._extra_attrs = attr
         return attr
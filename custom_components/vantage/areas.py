@@ -0,0 +1,63 @@
+"""
+Area-wide level changes.
+
+vantage.set_area_level sets every light and relay in an area and its
+sub-areas (found with the same lineage AreaFilter uses for only_areas) to
+one level.  Rather than a service call per light, each taking its own
+round trip, the commands are all queued at once and written as one
+pipelined burst on the interactive queue; the call then waits for the
+controller to acknowledge every one of them.
+
+The Host Command interface has no command for a whole area, so this is
+always one command per load.  Load groups are left out, since their
+member loads are set directly.
+"""
+import asyncio
+import logging
+import time
+
+from .filters import AreaFilter
+from .scheduler import INTERACTIVE, command_queue
+
+_LOGGER = logging.getLogger(__name__)
+
+# kinds of outputs an area level is applied to
+AREA_LOAD_KINDS = ("LIGHT", "RELAY")
+# seconds to wait for the controller to acknowledge each command
+AREA_COMMAND_TIMEOUT = 5
+
+
+def area_loads(vantage, entities, area_name):
+    """Return the loads (of AREA_LOAD_KINDS) with an entity in entities, an
+    EntityIndex, in area_name or below it."""
+    in_area = AreaFilter(vantage._vid_to_area, {area_name}).keep
+    areas = [vid for vid in vantage._vid_to_area if in_area(vid)]
+    return [entity._vantage_device
+            for entity in entities.in_areas(areas, AREA_LOAD_KINDS)]
+
+
+async def async_set_loads_level(vantage, loads, level, ramp=None):
+    """Set every load in loads to level (0-100), ramping dimmers over ramp
+    seconds if given, in one burst.
+
+    Returns (commands acknowledged, commands not acknowledged, seconds
+    from sending the first to the last acknowledgement)."""
+    conn = vantage._conn
+    level = round(level)
+    start = time.monotonic()
+    replies = []
+    with command_queue(INTERACTIVE), conn.batch():
+        for load in loads:
+            if ramp is not None and load.is_dimmable:
+                replies.append(conn.command(vantage, "RAMPLOAD", load.vid,
+                                            level, ramp,
+                                            timeout=AREA_COMMAND_TIMEOUT))
+            else:
+                # relays are only on or off
+                replies.append(conn.command(
+                    vantage, "LOAD", load.vid,
+                    level if load.is_dimmable or level == 0 else 100,
+                    timeout=AREA_COMMAND_TIMEOUT))
+    results = await asyncio.gather(*replies)
+    missed = results.count(None)
+    return len(results) - missed, missed, time.monotonic() - start
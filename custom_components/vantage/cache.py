@@ -0,0 +1,218 @@
+"""
+On-disk cache of the parsed Vantage object model.
+
+Downloading and parsing the Design Center project is most of the startup
+time on a large job.  Instead of caching the raw XML (which still has to be
+parsed every time), we pickle the controller's parsed object model and
+keep it next to a fingerprint of the project reported by the controller.
+On the next start we ask for the fingerprint again -- a tiny request --
+and only download and parse the project when it has changed (or the
+name_mappings it was parsed with have).
+"""
+import hashlib
+import io
+import logging
+import os
+import pickle
+import re
+import socket
+import ssl
+import time
+import zlib
+from xml.sax.saxutils import escape
+
+_LOGGER = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+FINGERPRINT_TIMEOUT = 5
+
+# Everything VantageXmlDbParser leaves on the Vantage object
+MODEL_ATTRIBUTES = (
+    "outputs", "variables", "tasks", "buttons", "keypads", "sensors",
+    "_name", "_ids", "_names",
+    "_vid_to_area", "_vid_to_load", "_vid_to_variable", "_vid_to_task",
+    "_vid_to_shade", "_vid_to_sensor", "_name_to_task",
+    "_colorvid_to_group_vid", "_brightnessvid_to_group_vid",
+)
+
+FINGERPRINT_REQUEST = ("<IBackup><GetFileInfo><call>Backup\\Project.dc"
+                       "</call></GetFileInfo></IBackup>\n")
+
+
+def cache_filename(config_dir, host):
+    """Return the path of the cache file for the controller at host."""
+    return os.path.join(config_dir, host + "_vantage_model.cache")
+
+
+class _ModelPickler(pickle.Pickler):
+    """Pickle pyvantage objects without the controller or their locks."""
+
+    def __init__(self, file, vantage):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._vantage = vantage
+        self._helper_type = _request_helper_type()
+
+    def persistent_id(self, obj):
+        """Every object points back at the controller; don't save it."""
+        if obj is self._vantage:
+            return "vantage"
+        return None
+
+    def reducer_override(self, obj):
+        """Replace query helpers (which hold a lock) with fresh ones."""
+        if type(obj) is self._helper_type:  # pylint: disable=unidiomatic-typecheck
+            return (self._helper_type, ())
+        return NotImplemented
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    """Reattach unpickled objects to the live controller."""
+
+    def __init__(self, file, vantage):
+        super().__init__(file)
+        self._vantage = vantage
+
+    def persistent_load(self, pid):
+        if pid == "vantage":
+            return self._vantage
+        raise pickle.UnpicklingError("unknown persistent id %r" % pid)
+
+
+def _request_helper_type():
+    """The pyvantage class that waits on query replies."""
+    from pyvantage import _RequestHelper
+    return _RequestHelper
+
+
+def _pyvantage_version():
+    """Version of pyvantage, since the pickled classes come from it."""
+    try:
+        from importlib.metadata import version
+        return version("pyvantage")
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def fetch_fingerprint(host, port, user, password, use_ssl=False):
+    """Ask the controller's Design Center port about the project file.
+
+    Returns a short digest that changes whenever the project is
+    re-downloaded to the controller, or None if the controller would not
+    tell us (in which case the cache can't be trusted)."""
+    sock = socket.create_connection((host, port), FINGERPRINT_TIMEOUT)
+    try:
+        if use_ssl:
+            sock = ssl.SSLContext(ssl.PROTOCOL_TLS).wrap_socket(sock)
+        sock.settimeout(FINGERPRINT_TIMEOUT)
+        if user:
+            response = _xml_call(
+                sock, "<ILogin><Login><call><User>%s</User>"
+                "<Password>%s</Password></call></Login></ILogin>\n" % (
+                    escape(user), escape(password or "")), "</ILogin>")
+            if _xml_return(response) != "true":
+                return None
+        response = _xml_call(sock, FINGERPRINT_REQUEST, "</IBackup>")
+    finally:
+        sock.close()
+    info = _xml_return(response)
+    if not info or info == "false":
+        return None
+    return hashlib.sha1(info.encode('utf-8')).hexdigest()
+
+
+def _xml_call(sock, request, terminator):
+    """Send one Design Center request and read its whole response."""
+    sock.sendall(request.encode('ascii'))
+    response = ""
+    while not response.rstrip().endswith(terminator):
+        data = sock.recv(4096)
+        if not data:
+            break
+        response += data.decode('ascii', 'replace')
+    return response
+
+
+def _xml_return(response):
+    """Pull the contents of the <return> element out of a response."""
+    m = re.search(r'<return>(.*?)</return>', response, re.DOTALL)
+    return m.group(1).strip() if m else None
+
+
+def save_model(vantage, filename, fingerprint, name_mappings=None):
+    """Write the controller's parsed model to filename.  name_mappings
+    are the ones it was parsed with (pyvantage applies them to the device
+    names as it parses)."""
+    model = {attr: getattr(vantage, attr) for attr in MODEL_ATTRIBUTES}
+    header = {"version": CACHE_VERSION,
+              "pyvantage": _pyvantage_version(),
+              "fingerprint": fingerprint,
+              "name_mappings": repr(name_mappings),
+              "saved": time.time()}
+    tmpname = filename + ".tmp"
+    with open(tmpname, "wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        body = io.BytesIO()
+        _ModelPickler(body, vantage).dump(model)
+        f.write(zlib.compress(body.getvalue(), 6))
+    os.replace(tmpname, filename)
+
+
+def load_model(vantage, filename, fingerprint, name_mappings=None):
+    """Restore the parsed model from filename into vantage.
+
+    Returns False (and leaves vantage alone) if there is no usable cache
+    for this fingerprint and these name_mappings."""
+    if fingerprint is None:
+        return False
+    try:
+        with open(filename, "rb") as f:
+            header = pickle.load(f)
+            if (header.get("version") != CACHE_VERSION or
+                    header.get("pyvantage") != _pyvantage_version() or
+                    header.get("fingerprint") != fingerprint or
+                    header.get("name_mappings") != repr(name_mappings)):
+                _LOGGER.info("Vantage model cache %s is stale", filename)
+                return False
+            body = zlib.decompress(f.read())
+        model = _ModelUnpickler(io.BytesIO(body), vantage).load()
+    except FileNotFoundError:
+        return False
+    except Exception as e:  # pylint: disable=broad-except
+        _LOGGER.warning("Could not read vantage model cache %s: %s",
+                        filename, e)
+        return False
+    for attr in MODEL_ATTRIBUTES:
+        setattr(vantage, attr, model[attr])
+    return True
+
+
+def load_controller_model(vantage, config_dir, host, file_port,
+                          user, password, use_ssl, enable_cache,
+                          name_mappings=None):
+    """Populate vantage from the cache if it is current for the project
+    and name_mappings, else from the controller (and refresh the cache).
+    Runs in the executor."""
+    start = time.monotonic()
+    filename = cache_filename(config_dir, host)
+    source = "controller"
+    fingerprint = None
+    if enable_cache:
+        try:
+            fingerprint = fetch_fingerprint(host, file_port, user, password,
+                                            use_ssl)
+        except OSError as e:
+            _LOGGER.warning("Could not fetch vantage project fingerprint: %s",
+                            e)
+        if load_model(vantage, filename, fingerprint, name_mappings):
+            source = "cache"
+    if source != "cache":
+        vantage.load_xml_db(True, config_dir)
+        if enable_cache and fingerprint is not None:
+            try:
+                save_model(vantage, filename, fingerprint, name_mappings)
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.warning("Could not write vantage model cache %s: %s",
+                                filename, e)
+    _LOGGER.info("Loaded vantage project from %s in %.2fs", source,
+                 time.monotonic() - start)
+    return fingerprint
@@ -0,0 +1,124 @@
+"""
+Config flow for the Vantage integration.
+
+The controller can be added from the UI, or from configuration.yaml, which
+is imported into a config entry (and updates it on every restart).  What
+to include -- the area and name filters and the device kinds -- can be
+changed afterwards from the entry's options, which reloads the entry
+without restarting Home Assistant or parsing the project again.
+"""
+import asyncio
+import logging
+
+import voluptuous as vol
+
+from homeassistant import config_entries
+from homeassistant.const import CONF_HOST, CONF_PASSWORD, CONF_PORT, CONF_USERNAME
+from homeassistant.core import callback
+
+from . import (
+    CONF_EXCLUDE_AREAS, CONF_EXCLUDE_CONTACTS, CONF_EXCLUDE_KEYPADS,
+    CONF_EXCLUDE_NAME_SUBSTRING, CONF_EXCLUDE_VARIABLES,
+    CONF_INCLUDE_BUTTONS, CONF_INCLUDE_NAME_SUBSTRING,
+    CONF_INCLUDE_UNDERSCORE_VARIABLES, CONF_NUM_CONNECTIONS,
+    CONF_ONLY_AREAS, CONF_USE_SSL, DOMAIN, VANTAGE_SCHEMA)
+
+_LOGGER = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 10
+
+# options that only change which devices become entities
+FILTER_STRINGS = (CONF_ONLY_AREAS, CONF_EXCLUDE_AREAS,
+                  CONF_EXCLUDE_NAME_SUBSTRING, CONF_INCLUDE_NAME_SUBSTRING)
+FILTER_FLAGS = (CONF_INCLUDE_BUTTONS, CONF_EXCLUDE_CONTACTS,
+                CONF_EXCLUDE_KEYPADS, CONF_EXCLUDE_VARIABLES,
+                CONF_INCLUDE_UNDERSCORE_VARIABLES)
+
+
+async def async_can_connect(host, port):
+    """Return true iff the Host Command port at host answers."""
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError) as e:
+        _LOGGER.debug("Could not connect to %s:%d: %s", host, port, e)
+        return False
+    writer.close()
+    return True
+
+
+class VantageConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
+    """Adds a Vantage controller."""
+
+    VERSION = 1
+
+    async def async_step_user(self, user_input=None):
+        """Ask for the controller's address and login."""
+        if self._async_current_entries():
+            return self.async_abort(reason="single_instance_allowed")
+        errors = {}
+        if user_input is not None:
+            config = VANTAGE_SCHEMA(user_input)
+            port = config.get(CONF_PORT,
+                              3010 if config[CONF_USE_SSL] else 3001)
+            if await async_can_connect(config[CONF_HOST], port):
+                await self.async_set_unique_id(config[CONF_HOST])
+                return self.async_create_entry(title=config[CONF_HOST],
+                                               data=user_input)
+            errors["base"] = "cannot_connect"
+        return self.async_show_form(
+            step_id="user",
+            data_schema=vol.Schema({
+                vol.Required(CONF_HOST): str,
+                vol.Optional(CONF_USERNAME): str,
+                vol.Optional(CONF_PASSWORD): str,
+                vol.Optional(CONF_USE_SSL, default=False): bool,
+            }),
+            errors=errors)
+
+    async def async_step_import(self, import_config):
+        """Create or update the entry from configuration.yaml."""
+        for entry in self._async_current_entries():
+            if entry.data != import_config:
+                self.hass.config_entries.async_update_entry(
+                    entry, data=import_config,
+                    title=import_config[CONF_HOST],
+                    unique_id=import_config[CONF_HOST])
+            return self.async_abort(reason="already_configured")
+        await self.async_set_unique_id(import_config[CONF_HOST])
+        return self.async_create_entry(title=import_config[CONF_HOST],
+                                       data=import_config)
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        """Return the flow for changing what is included."""
+        return VantageOptionsFlow(config_entry)
+
+
+class VantageOptionsFlow(config_entries.OptionsFlow):
+    """Changes the filters and connection count of an entry."""
+
+    def __init__(self, config_entry):
+        """Initialize with the entry being changed."""
+        self.config_entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        """Show the current filters."""
+        if user_input is not None:
+            for key in FILTER_STRINGS:
+                # cleared fields must override what the entry was set up with
+                user_input.setdefault(key, "")
+            return self.async_create_entry(title="", data=user_input)
+        current = {**self.config_entry.data, **self.config_entry.options}
+        schema = {}
+        for key in FILTER_STRINGS:
+            schema[vol.Optional(key, description={
+                "suggested_value": current.get(key)})] = str
+        for key in FILTER_FLAGS:
+            schema[vol.Optional(key, default=current.get(key, False))] = bool
+        schema[vol.Optional(CONF_NUM_CONNECTIONS,
+                            default=current.get(CONF_NUM_CONNECTIONS, 1))] = (
+            vol.All(int, vol.Range(min=1)))
+        return self.async_show_form(step_id="init",
+                                    data_schema=vol.Schema(schema))
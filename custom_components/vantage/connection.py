@@ -0,0 +1,456 @@
+"""
+asyncio transport for the Vantage Host Command interface.
+
+pyvantage talks to the controller from its own VantageConnection thread,
+which means every command issued from Home Assistant has to hop onto an
+executor thread and every status message hops back onto the event loop.
+AsyncVantageConnection is a drop-in replacement for that object: the
+Vantage controller object keeps doing all the parsing and bookkeeping, but
+the sockets are asyncio streams owned by the event loop.
+
+Each connection is watched: when nothing has been received on it for
+HEARTBEAT_INTERVAL a heartbeat command is sent, and a connection that
+doesn't answer within HEARTBEAT_TIMEOUT is closed.  Lost connections are
+reopened right away, then with exponential backoff and jitter, so a
+rebooting controller isn't hammered (and several installs don't retry in
+lockstep).  Listeners are told whenever the connections as a whole go
+down or come back.
+"""
+import asyncio
+from contextlib import contextmanager
+import contextvars
+import functools
+import logging
+import random
+import ssl
+import threading
+import time
+
+from .scheduler import CommandScheduler, classify
+from .stats import Timings, span
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds before the second reconnect attempt, doubling up to the max
+RECONNECT_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+# each delay is scaled by a random factor between this and 1
+RECONNECT_JITTER = 0.5
+LOGIN_TIMEOUT = 10
+QUERY_TIMEOUT = 2
+# seconds of silence before a heartbeat, and for its reply
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 10
+# answered by the controller without touching any device
+HEARTBEAT_COMMAND = "ECHO"
+HEARTBEAT_REPLY = "R:ECHO"
+# most bytes taken from a connection's buffer at once
+READ_CHUNK = 65536
+# what a failed connect or login raises
+CONNECT_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+# (list, timeout) collecting the replies to the commands sent, if any
+_collected_replies = contextvars.ContextVar("vantage_collected_replies",
+                                           default=None)
+
+# the controller only echoes status for these after we ask for them
+STATUS_TYPES = ("LOAD", "BLIND", "BTN", "VARIABLE")
+
+def reconnect_delay(attempt):
+    """Return the seconds to wait before reconnect attempt (0 is the
+    first, which doesn't wait)."""
+    if attempt == 0:
+        return 0
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_DELAY * 2 ** (attempt - 1))
+    return delay * random.uniform(RECONNECT_JITTER, 1)
+
+
+class AsyncVantageConnection():
+    """Encapsulates the connections to the Vantage controller.
+
+    Exposes the same send_ascii_nl() method pyvantage's VantageConnection
+    does, so it can be installed as the controller's _conn, and feeds every
+    received line to recv_callback on the event loop, calling on_batch()
+    after each chunk of lines read.  on_send(cmd) sees every command as
+    it is queued, and on_drop(cmd) every command that will get no reply."""
+
+    def __init__(self, host, user, password, cmd_port, recv_callback,
+                 commdebug=True, num_connections=1, use_ssl=False,
+                 loop=None, on_drop=None, on_batch=None, on_send=None):
+        """Initializes the connection, doesn't actually connect."""
+        self._host = host
+        self._user = user
+        self._password = password
+        self._cmd_port = cmd_port
+        self._recv_cb = recv_callback
+        self._on_drop = on_drop
+        self._on_batch = on_batch
+        self._on_send = on_send
+        self._commdebug = commdebug
+        self._num_connections = num_connections
+        self._ssl_context = None
+        if use_ssl:
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS)
+        self._loop = loop
+        self._loop_thread = None
+        self._readers = [None] * num_connections
+        self._writers = [None] * num_connections
+        self._connected = [False] * num_connections
+        self._reader_tasks = [None] * num_connections
+        self._heartbeat_tasks = [None] * num_connections
+        self._last_received = [0.0] * num_connections
+        self._response_waiters = {}
+        self._listeners = []
+        self._closing = False
+        self.reconnects = 0
+        self.heartbeat_failures = 0
+        self.scheduler = CommandScheduler(num_connections, self._write_burst,
+                                          self._dropped)
+        self.timings = None
+
+    def enable_timings(self):
+        """Start timing each stage commands and status go through."""
+        if self.timings is None:
+            self.timings = self.scheduler.timings = Timings()
+        return self.timings
+
+    @property
+    def connected(self):
+        """Return true iff every connection is up."""
+        return all(self._connected)
+
+    def add_listener(self, listener):
+        """Call listener(connected) on the loop whenever connected changes.
+        Returns a function that removes it."""
+        self._listeners.append(listener)
+        return functools.partial(self._listeners.remove, listener)
+
+    def _set_connected(self, i, value):
+        """Record connection i going up or down, telling the listeners if
+        that changed whether all of them are up."""
+        was = self.connected
+        self._connected[i] = value
+        if self.connected != was:
+            for listener in list(self._listeners):
+                listener(not was)
+
+    async def async_connect(self, retry=True):
+        """Open and log in all the connections, then start reading.
+
+        Unless retry is set, the first connection that can't be made
+        raises one of CONNECT_ERRORS, closing any already open."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.scheduler.attach(self._loop)
+        try:
+            for i in range(self._num_connections):
+                if retry:
+                    await self._async_open(i)
+                else:
+                    await self._async_login(i)
+                    self._opened(i)
+        except BaseException:
+            for i in range(self._num_connections):
+                self._drop(i)
+            raise
+        for i in range(self._num_connections):
+            self._reader_tasks[i] = self._loop.create_task(
+                self._async_read_loop(i))
+            self._heartbeat_tasks[i] = self._loop.create_task(
+                self._async_heartbeat(i))
+
+    async def async_close(self):
+        """Close all connections and stop the readers."""
+        self._closing = True
+        for task in self._reader_tasks + self._heartbeat_tasks:
+            if task is not None:
+                task.cancel()
+        for i in range(self._num_connections):
+            self._drop(i)
+        self.scheduler.close()
+
+    async def _async_open(self, i, retry_now=False):
+        """Connect and log in connection i, retrying until it works.
+
+        If retry_now is set (a connection that was up just dropped), the
+        first retry is immediate."""
+        attempt = 0 if retry_now else 1
+        while True:
+            try:
+                await self._async_login(i)
+                break
+            except CONNECT_ERRORS as e:
+                self._drop(i)
+                delay = reconnect_delay(attempt)
+                attempt += 1
+                _LOGGER.warning("Could not connect #%s to %s:%d, "
+                                "retrying after %.1f sec (%s)", i,
+                                self._host, self._cmd_port, delay, e)
+                await asyncio.sleep(delay)
+        self._opened(i)
+
+    def _opened(self, i):
+        """Note that connection i is up and logged in."""
+        self._last_received[i] = time.monotonic()
+        self._set_connected(i, True)
+        _LOGGER.info("Connected #%s to %s", i, self._host)
+
+    async def _async_login(self, i):
+        """Open connection i, log in and ask for status (on #0)."""
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            self._host, self._cmd_port, ssl=self._ssl_context),
+                                                LOGIN_TIMEOUT)
+        self._readers[i] = reader
+        self._writers[i] = writer
+        if not (self._user is None or self._password is None):
+            _LOGGER.debug("Connection #%s is made, logging in", i)
+            self._write(
+                "LOGIN " + self._user + " " + self._password, i)
+            await self._async_read_reply(i)
+        if i == 0:
+            for status_type in STATUS_TYPES:
+                self._write("STATUS " + status_type, i)
+                await self._async_read_reply(i)
+
+    async def _async_read_reply(self, i):
+        """Read (and drop) the reply to a login-time command."""
+        await asyncio.wait_for(self._readers[i].readuntil(b'\r\n'),
+                               LOGIN_TIMEOUT)
+
+    def _drop(self, i):
+        """Forget connection i."""
+        self._set_connected(i, False)
+        writer = self._writers[i]
+        self._readers[i] = None
+        self._writers[i] = None
+        self.scheduler.reset(i)
+        if writer is not None:
+            writer.close()
+
+    async def _async_read_loop(self, i):
+        """Read connection i a chunk at a time, handing each line to
+        pyvantage, then call on_batch once the whole chunk is handled."""
+        partial = b''
+        while not self._closing:
+            try:
+                data = await self._readers[i].read(READ_CHUNK)
+                if not data:
+                    raise asyncio.IncompleteReadError(partial, None)
+            except (asyncio.IncompleteReadError, OSError) as e:
+                if self._closing:
+                    return
+                _LOGGER.warning("Vantage connection #%s lost (%s), "
+                                "reconnecting", i, e)
+                self._drop(i)
+                self.reconnects += 1
+                partial = b''
+                await self._async_open(i, retry_now=True)
+                continue
+            self._last_received[i] = time.monotonic()
+            lines = (partial + data).split(b'\r\n')
+            partial = lines.pop()
+            for line in lines:
+                # a stray byte or a failing handler mustn't stop the reader
+                try:
+                    self._handle_line(
+                        line.decode('ascii', 'replace').rstrip(), i)
+                except Exception as e:  # pylint: disable=broad-except
+                    _LOGGER.error("Exception handling line %r: %s", line, e)
+            if self._on_batch is not None:
+                try:
+                    with span(self.timings, "notify"):
+                        self._on_batch()
+                except Exception as e:  # pylint: disable=broad-except
+                    _LOGGER.error("Exception notifying status: %s", e)
+
+    async def _async_heartbeat(self, i):
+        """Close connection i if it goes quiet and won't answer a
+        heartbeat, so the read loop reconnects it."""
+        while not self._closing:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            idle = time.monotonic() - self._last_received[i]
+            if not self._connected[i] or idle < HEARTBEAT_INTERVAL:
+                continue
+            sent = time.monotonic()
+            self._write(HEARTBEAT_COMMAND, i)
+            await asyncio.sleep(HEARTBEAT_TIMEOUT)
+            writer = self._writers[i]
+            if self._last_received[i] < sent and writer is not None:
+                self.heartbeat_failures += 1
+                _LOGGER.warning("Vantage connection #%s did not answer a "
+                                "heartbeat in %d sec, reconnecting", i,
+                                HEARTBEAT_TIMEOUT)
+                # the read loop sees the connection end
+                writer.transport.abort()
+
+    def _handle_line(self, line, i):
+        """Dispatch one received line on the event loop."""
+        timings = self.timings
+        if line == HEARTBEAT_REPLY or (line.startswith("R:ERROR") and
+                                       line.endswith(" " + HEARTBEAT_COMMAND)):
+            # ours alone (even if this controller doesn't know it);
+            # pyvantage never sent it
+            return
+        if timings is not None:
+            start = time.perf_counter()
+        try:
+            self._recv_cb(line, i)
+        except Exception as e:  # pylint: disable=broad-except
+            _LOGGER.error("Exception in recv_cb on line %s: %s", line, e)
+        if timings is not None:
+            timings.dispatched(line, start)
+        if line.startswith('R:'):
+            self.scheduler.reply(i)
+            self._resolve_waiters(line)
+
+    def _resolve_waiters(self, line):
+        """Wake anyone waiting for the response to the query in line."""
+        if not self._response_waiters:
+            return
+        parts = line[2:].split(' ', 2)
+        if len(parts) < 2:
+            return
+        result = line
+        if parts[0].startswith("ERROR"):
+            # R:ERROR:<code> <the command>: refused, so no reply is coming
+            parts = (parts[1:] + [''])[:2]
+            parts[1] = parts[1].split(' ', 1)[0]
+            result = None
+        waiters = self._response_waiters.pop((parts[0], parts[1]), None)
+        for fut in waiters or ():
+            if not fut.done():
+                fut.set_result(result)
+
+    def _dropped(self, cmd, superseded=False):
+        """The scheduler gave up on cmd: wake the oldest waiter for its
+        reply, unless a later level for the same load will answer it."""
+        if not superseded:
+            key = tuple((cmd.split(' ', 2) + [''])[:2])
+            waiters = self._response_waiters.get(key)
+            if waiters:
+                fut = waiters.pop(0)
+                if not waiters:
+                    del self._response_waiters[key]
+                if not fut.done():
+                    fut.set_result(None)
+        if self._on_drop is not None:
+            self._on_drop(cmd)
+
+    def _write(self, cmd, i):
+        """Write the command on connection i right away.
+
+        Only used while logging in; everything else goes through
+        send_ascii_nl so it can be batched."""
+        writer = self._writers[i]
+        if writer is None:
+            _LOGGER.warning("Vantage #%s not connected, dropping: %s",
+                            i, cmd)
+            return
+        writer.write(cmd.encode('ascii') + b'\r\n')
+
+    def send_ascii_nl(self, cmd):
+        """Sends the specified command to the vantage controller.
+
+        Safe to call from any thread; pyvantage objects call this whenever
+        their properties are set.  Commands go on the scheduler queue the
+        caller picked with scheduler.command_queue() (or one chosen from
+        the command itself) and are written at the end of the current
+        event-loop tick (or batch()), so a scene that touches many loads
+        goes out as one burst."""
+        name = classify(cmd)
+        if threading.get_ident() == self._loop_thread:
+            collecting = _collected_replies.get()
+            if collecting is not None:
+                op, vid = (cmd.split(' ', 2) + [''])[:2]
+                collecting[0].append(self.expect(op, vid, collecting[1]))
+            self._queue(cmd, name)
+        elif self._loop is None or self._loop.is_closed():
+            # never connected, or shut down: nothing can write it
+            _LOGGER.warning("Vantage not connected, dropping: %s", cmd)
+            if self._on_drop is not None:
+                self._on_drop(cmd)
+        else:
+            self._loop.call_soon_threadsafe(self._queue, cmd, name)
+
+    def _queue(self, cmd, name):
+        """Hand cmd to the scheduler.  Must run on the loop."""
+        if self._commdebug:
+            if cmd.startswith("GET") or cmd.startswith("ADDSTATUS"):
+                _LOGGER.debug("Vantage %s send_ascii_nl: %s", name, cmd)
+            else:
+                _LOGGER.info("Vantage %s send_ascii_nl: %s", name, cmd)
+        if self._on_send is not None:
+            self._on_send(cmd)
+        self.scheduler.submit(cmd, name)
+
+    def _write_burst(self, i, cmds):
+        """Write cmds on connection i in one go; false if it is down."""
+        writer = self._writers[i]
+        if writer is None:
+            _LOGGER.warning("Vantage #%s not connected, dropping %d "
+                            "commands", i, len(cmds))
+            return False
+        writer.write(('\r\n'.join(cmds) + '\r\n').encode('ascii'))
+        return True
+
+    def batch(self):
+        """Hold every command sent in the block and write them as one burst
+        when it exits, even if the block awaits in between."""
+        return self.scheduler.batch()
+
+    def connect(self):
+        """pyvantage's blocking connect; use async_connect instead."""
+        raise RuntimeError("Use async_connect on an AsyncVantageConnection")
+
+    async def async_query(self, vantage, op, vid, timeout=QUERY_TIMEOUT):
+        """Send a GET-style command through vantage and wait for the reply.
+
+        The reply has already updated the pyvantage object by the time this
+        returns.  Returns the reply line, or None on timeout or error."""
+        return await self.command(vantage, op, vid, timeout=timeout)
+
+    def command(self, vantage, op, vid, *args, timeout=QUERY_TIMEOUT):
+        """Send op through vantage now, and return an awaitable for its
+        reply line (None on timeout, or if the controller refused it).
+
+        The command is queued before this returns, so commands issued in
+        a batch() go out together however their replies are awaited."""
+        reply = self.expect(op, vid, timeout)
+        vantage.send(op, vid, *args)
+        return reply
+
+    def expect(self, op, vid, timeout=QUERY_TIMEOUT):
+        """Return an awaitable for the reply line to the next op command
+        for vid (None on timeout or error).  Must run on the loop, before the
+        command is sent."""
+        key = (op, str(vid))
+        fut = self._loop.create_future()
+        self._response_waiters.setdefault(key, []).append(fut)
+        return self._async_wait_reply(key, fut, timeout)
+
+    @contextmanager
+    def collect_replies(self, timeout=QUERY_TIMEOUT):
+        """Yield a list that gets an awaitable (as from expect()) for the
+        reply to every command sent in the block, e.g. by setting pyvantage
+        properties.  Follows the task, like command_queue()."""
+        replies = []
+        token = _collected_replies.set((replies, timeout))
+        try:
+            yield replies
+        finally:
+            _collected_replies.reset(token)
+
+    async def _async_wait_reply(self, key, fut, timeout):
+        """Wait for fut, forgetting it if it times out."""
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.debug("No response to %s %s within %ss", key[0], key[1],
+                          timeout)
+            waiters = self._response_waiters.get(key)
+            if waiters and fut in waiters:
+                waiters.remove(fut)
+                if not waiters:
+                    del self._response_waiters[key]
+            return None
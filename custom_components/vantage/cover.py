@@ -6,33 +6,69 @@ https://home-assistant.io/components/cover.vantage/
 """
 import logging
 
+import voluptuous as vol
+
 from homeassistant.components.cover import (
     CoverEntity,
     CoverEntityFeature,
     ATTR_POSITION,
 )
-from ..vantage import VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER
+from homeassistant.core import callback
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers import entity_platform
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from ..vantage import (
+    VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER, VANTAGE_WRITE_CACHE,
+    SIGNAL_ADD_DEVICES)
 
 _LOGGER = logging.getLogger(__name__)
 
 DEPENDENCIES = ["vantage"]
 
+ATTR_FORCE = "force"
+SERVICE_VANTAGE_SET_COVER_POSITION = "set_cover_position"
+# cover.set_cover_position's field, and force: move even a shade that
+# reports being there already
+VANTAGE_SET_COVER_POSITION_SCHEMA = {
+    vol.Required(ATTR_POSITION):
+        vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+    vol.Optional(ATTR_FORCE, default=False): cv.boolean,
+}
+
 
 # pylint: disable=unused-argument
-async def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
+async def async_setup_entry(hass, entry, async_add_devices):
     """Set up the Vantage shades."""
-    devs = []
-    for (area_name, device) in hass.data[VANTAGE_DEVICES]["cover"]:
-        dev = VantageCover(area_name, device, hass.data[VANTAGE_CONTROLLER])
-        devs.append(dev)
 
-    async_add_devices(devs, True)
+    @callback
+    def add_devices(devices):
+        devs = []
+        for (area_name, device) in devices:
+            dev = VantageCover(area_name, device, hass.data[VANTAGE_CONTROLLER])
+            devs.append(dev)
+        async_add_devices(devs)
+
+    add_devices(hass.data[VANTAGE_DEVICES]["cover"])
+    # devices added to the project later
+    entry.async_on_unload(async_dispatcher_connect(
+        hass, SIGNAL_ADD_DEVICES.format("cover"), add_devices))
+    platform = entity_platform.async_get_current_platform()
+    platform.async_register_entity_service(
+        SERVICE_VANTAGE_SET_COVER_POSITION,
+        VANTAGE_SET_COVER_POSITION_SCHEMA, "async_move")
     return True
 
 
 class VantageCover(VantageDevice, CoverEntity):
     """Representation of a Vantage shade."""
 
+    __slots__ = ("_reported_level",)
+
+    def __init__(self, area_name, vantage_device, controller):
+        """Initialize the shade."""
+        VantageDevice.__init__(self, area_name, vantage_device, controller)
+        self._reported_level = vantage_device.last_level()
+
     @property
     def supported_features(self):
         """Flag supported features."""
@@ -49,27 +85,56 @@ class VantageCover(VantageDevice, CoverEntity):
         """Return the current position of cover."""
         return self._vantage_device.last_level()
 
-    def close_cover(self, **kwargs):
+    def _is_settled(self):
+        """A shade that is fully open or closed has stopped moving."""
+        return self._vantage_device.last_level() in (0, 100)
+
+    def _update_callback(self, device):
+        """Note the position the shade reported, and write state."""
+        self._reported_level = self._vantage_device.last_level()
+        super()._update_callback(device)
+
+    def _move(self, level, force=False):
+        """Move the shade to level, unless it last reported being there
+        and force is false.  pyvantage keeps the level last sent, which
+        doesn't count: the command may have been lost."""
+        if not force and self.hass.data[VANTAGE_WRITE_CACHE].skip_value(
+                self._reported_level, level):
+            return
+        # pyvantage doesn't send a level the shade was already sent
+        self._vantage_device._level = None
+        self._vantage_device.level = level
+
+    async def async_move(self, position, force=False):
+        """Move the shade to position (vantage.set_cover_position)."""
+        with self._service("service.cover"):
+            self._move(position, force)
+
+    async def async_close_cover(self, **kwargs):
         """Close the cover."""
-        self._vantage_device.level = 0
+        with self._service("service.cover"):
+            self._move(0)
 
-    def stop_cover(self, **kwargs):
+    async def async_stop_cover(self, **kwargs):
         """stop the cover."""
-        self._vantage_device.level = None
-        self._vantage_device.stop()
+        with self._service("service.cover"):
+            self._vantage_device.level = None
+            self._vantage_device.stop()
 
-    def open_cover(self, **kwargs):
+    async def async_open_cover(self, **kwargs):
         """Open the cover."""
-        self._vantage_device.level = 100
+        with self._service("service.cover"):
+            self._move(100)
 
-    def set_cover_position(self, **kwargs):
+    async def async_set_cover_position(self, **kwargs):
         """Move the shade to a specific position."""
         if ATTR_POSITION in kwargs:
             position = kwargs[ATTR_POSITION]
-            self._vantage_device.level = position
+            with self._service("service.cover"):
+                self._move(position)
 
     async def async_update(self):
         """Call when forcing a refresh of the device."""
-        # Reading the property (rather than last_level()) fetches value
-        level = self._vantage_device.level
+        await self.async_query("GETBLIND")
+        level = self._vantage_device.last_level()
         _LOGGER.debug("Vantage ID: %d updated to %f", self._vantage_device.id, level)
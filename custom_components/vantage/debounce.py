@@ -0,0 +1,106 @@
+"""
+Coalescing of Home Assistant state writes for chatty Vantage devices.
+
+A ramping dimmer or a power sensor can report many status messages a
+second, and each state write becomes a state-machine change and a recorder
+row.  Each entity gets a StateWriter that writes at most once per window:
+the first update goes through right away, later ones within the window
+are folded into a single write at the end of it (of whatever the state is
+by then), and an update the entity reports as final, such as a ramp
+reaching its target, is always written immediately.
+"""
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds; 0 writes every update
+DEFAULT_STATE_WRITE_WINDOW = 0.25
+
+
+class StateWriter():
+    """Rate limits one entity's state writes."""
+
+    __slots__ = ("_loop", "_window", "_entity", "_last_write", "_handle",
+                 "writes", "suppressed")
+
+    def __init__(self, loop, window, entity):
+        """entity.async_write_ha_state() is called to write the state."""
+        self._loop = loop
+        self._window = window
+        self._entity = entity
+        self._last_write = None
+        self._handle = None
+        self.writes = 0
+        self.suppressed = 0
+
+    def update(self, final=False):
+        """The entity's state changed; write it now or at the window end."""
+        now = self._loop.time()
+        if (final or self._window <= 0 or
+                (self._handle is None and
+                 (self._last_write is None or
+                  now - self._last_write >= self._window))):
+            self.cancel()
+            self._write_now(now)
+            return
+        self.suppressed += 1
+        if self._handle is None:
+            self._handle = self._loop.call_at(
+                self._last_write + self._window, self._flush)
+
+    def _flush(self):
+        """Write the latest state at the end of a window."""
+        self._handle = None
+        self._write_now(self._loop.time())
+
+    def _write_now(self, now):
+        """Write the state and start a new window."""
+        self._last_write = now
+        self.writes += 1
+        self._entity.async_write_ha_state()
+
+    def cancel(self):
+        """Forget any write scheduled for the end of the window."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class StateWriteCoalescer():
+    """Hands out a StateWriter per entity and keeps their counters."""
+
+    def __init__(self, window=DEFAULT_STATE_WRITE_WINDOW):
+        """Initialize with the window, in seconds, for every entity."""
+        self.window = window
+        self._writers = {}  # entity -> StateWriter
+
+    def add(self, entity):
+        """Return the StateWriter for a newly added entity."""
+        writer = StateWriter(entity.hass.loop, self.window, entity)
+        self._writers[entity] = writer
+        return writer
+
+    def remove(self, entity):
+        """Stop tracking entity, dropping any pending write."""
+        writer = self._writers.pop(entity, None)
+        if writer is not None:
+            writer.cancel()
+
+    def stats(self):
+        """Return total writes and suppressed updates, how many entities
+        are tracked and have a write pending, and the per-entity counts
+        for entities that had updates suppressed, worst first."""
+        writes = suppressed = pending = 0
+        per_entity = []
+        for entity, writer in self._writers.items():
+            writes += writer.writes
+            suppressed += writer.suppressed
+            if writer._handle is not None:
+                pending += 1
+            if writer.suppressed:
+                per_entity.append((entity.entity_id, writer.writes,
+                                   writer.suppressed))
+        per_entity.sort(key=lambda e: e[2], reverse=True)
+        return {"writes": writes, "suppressed": suppressed,
+                "tracked": len(self._writers), "pending": pending,
+                "entities": per_entity}
@@ -0,0 +1,47 @@
+"""
+Diagnostics for the Vantage integration.
+
+Returns the counters vantage.dump_stats logs -- state writes (overall and
+per entity), load level writes, status dispatch, the command scheduler,
+polling and the connection -- so they can be downloaded from the
+integration's page rather than read out of the log.
+"""
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+
+from . import (
+    VANTAGE_CONTROLLER, VANTAGE_DISPATCHER, VANTAGE_POLL_ENGINE,
+    VANTAGE_STATE_WRITES, VANTAGE_SUPERVISOR, VANTAGE_WRITE_CACHE)
+
+TO_REDACT = {CONF_PASSWORD, CONF_USERNAME}
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Return the integration's counters for entry."""
+    diagnostics = {"config": async_redact_data(
+        {**entry.data, **entry.options}, TO_REDACT)}
+    vc = hass.data.get(VANTAGE_CONTROLLER)
+    if vc is None:
+        # not loaded
+        return diagnostics
+    writes = hass.data[VANTAGE_STATE_WRITES].stats()
+    writes["entities"] = {
+        entity_id: {"writes": written, "suppressed": suppressed}
+        for entity_id, written, suppressed in writes["entities"]}
+    supervisor = hass.data[VANTAGE_SUPERVISOR]
+    diagnostics.update({
+        "state_writes": writes,
+        "level_writes": hass.data[VANTAGE_WRITE_CACHE].stats(),
+        "status": hass.data[VANTAGE_DISPATCHER].stats(),
+        "scheduler": vc._conn.scheduler.metrics(),
+        "polling": hass.data[VANTAGE_POLL_ENGINE].stats,
+        "connection": {
+            "available": supervisor.available,
+            "outages": supervisor.outages,
+            "reconnects": vc._conn.reconnects,
+            "heartbeat_failures": vc._conn.heartbeat_failures,
+            "resyncs": supervisor.resyncs,
+            "last_resync": supervisor.last_resync,
+        },
+    })
+    return diagnostics
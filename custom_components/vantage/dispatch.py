@@ -0,0 +1,83 @@
+"""
+Batched delivery of device changes to their subscribers.
+
+pyvantage parses each status line, updates the device, and then calls the
+device's subscriber right away.  The connection reads the controller's
+output in chunks, though, and a chunk can hold many lines for the same
+device (a ramping dimmer, a busy power sensor).  The StatusDispatcher
+takes over pyvantage's notification step: changes are collected per
+device while a chunk is parsed, and each changed device's subscriber is
+called once when the connection says the chunk is done, seeing the
+device's final state.
+
+Buttons, keypads and variables are the exception: every press, release
+and variable value is reported on its own (automations trigger on them),
+so they are still notified as each line arrives.
+
+Given a WriteCache, load levels it says are stale are dropped before they
+reach the device.  Devices in held (being resynced) are updated but their
+subscribers aren't called; whoever holds them notifies what changed.
+"""
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# devices notified of every status, not just the last in a chunk
+EVENT_CMD_TYPES = ("BTN", "KEYPAD", "VARIABLE")
+
+
+class StatusDispatcher():
+    """Delivers device changes to vantage's subscribers once per batch."""
+
+    def __init__(self, vantage, writes=None):
+        """Take over vantage's notifications, checking load levels with
+        writes, a WriteCache, if given."""
+        self._vantage = vantage
+        self._writes = writes
+        self._pending = {}  # device -> subscriber, in arrival order
+        self.held = set()  # devices updated without notifying
+        self.updates = 0
+        self.notified = 0
+        self.batches = 0
+        vantage.handle_update_and_notify = self.handle_update_and_notify
+
+    def handle_update_and_notify(self, obj, args, vid):
+        """Update obj from a status line, noting that its subscriber
+        needs calling (as pyvantage's method of the same name does)."""
+        if (self._writes is not None and len(args) == 1 and
+                not self._writes.reported(vid, args[0])):
+            return
+        handled = obj.handle_update(args, vid)
+        if not handled:
+            return
+        if handled in self.held:
+            return
+        handler = self._vantage._subscribers.get(handled)
+        if handler is None:
+            return
+        self.updates += 1
+        if getattr(handled, "CMD_TYPE", None) in EVENT_CMD_TYPES:
+            self.notified += 1
+            handler(handled)
+            return
+        self._pending[handled] = handler
+
+    def flush(self):
+        """Call the subscriber of every device changed since the last
+        flush.  Run by the connection after each chunk it reads."""
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+        self.batches += 1
+        self.notified += len(pending)
+        for device, handler in pending.items():
+            try:
+                handler(device)
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.error("Exception notifying %s: %s", device, e)
+
+    def stats(self):
+        """Return the update/notification counters."""
+        return {"updates": self.updates, "notified": self.notified,
+                "batches": self.batches}
@@ -0,0 +1,102 @@
+"""
+Filters deciding which Vantage objects become Home Assistant entities.
+"""
+import logging
+import re
+
+_LOGGER = logging.getLogger(__name__)
+
+# deepest area nesting we follow, which also guards against parent loops
+MAX_AREA_DEPTH = 10
+
+
+def get_lineage_from_area(vid_to_area, area):
+    """Return the names of area and its ancestors, child first."""
+    count = 0
+    answer = [area.name]
+    while area and count < MAX_AREA_DEPTH:
+        count += 1
+        parent_vid = area.parent
+        if parent_vid == 0:
+            break
+        area = vid_to_area.get(parent_vid)
+        if area:
+            answer.append(area.name)
+    return answer
+
+
+class AreaFilter():
+    """Keep/drop verdict for every area, computed once from only_areas and
+    exclude_areas so that sorting devices is a dict lookup each.
+
+    An area is kept if it or an ancestor is in only_areas (or only_areas is
+    not given), unless it or an ancestor is in exclude_areas -- i.e.
+    exclude_areas wins."""
+
+    def __init__(self, vid_to_area, only_areas=None, exclude_areas=None):
+        """Index every area in vid_to_area."""
+        self._only_areas = only_areas
+        self._exclude_areas = exclude_areas
+        # objects with no (known) area can't match exclude_areas,
+        # so they're kept unless only_areas was specified
+        self._default = not only_areas
+        self._verdicts = {}
+        for vid, area in vid_to_area.items():
+            self._verdicts[vid] = self._verdict(vid_to_area, area)
+
+    def _verdict(self, vid_to_area, area):
+        """Decide whether devices in area are kept."""
+        if not (self._only_areas or self._exclude_areas):
+            return True
+        lineage = get_lineage_from_area(vid_to_area, area)
+        keep = (not self._only_areas or
+                any(a in self._only_areas for a in lineage))
+        if keep and self._exclude_areas:
+            keep = not any(a in self._exclude_areas for a in lineage)
+        _LOGGER.debug("area = %s; lineage = %a; keep = %s",
+                      area.name, lineage, keep)
+        return keep
+
+    def keep(self, area_vid):
+        """Return true iff devices in area_vid should be kept."""
+        return self._verdicts.get(area_vid, self._default)
+
+
+def compile_substrings(substrings):
+    """Compile substrings into one regex matching any of them, or None."""
+    if not substrings:
+        return None
+    # longest first so the reported match is the most specific pattern
+    ordered = sorted(set(substrings), key=len, reverse=True)
+    return re.compile("|".join(re.escape(s) for s in ordered))
+
+
+class NameFilter():
+    """Matches entity names against exclude_name_substring and
+    include_name_substring with one compiled matcher each, rather than
+    one substring test per pattern per entity.
+
+    A name is excluded if it contains any exclude substring, or if
+    include substrings are given and it contains none of them."""
+
+    def __init__(self, exclude_substrings=None, include_substrings=None):
+        """Compile the substring lists."""
+        self._exclude = compile_substrings(exclude_substrings)
+        self._include = compile_substrings(include_substrings)
+
+    def excluded(self, entity):
+        """Return true iff entity should be left out because of its name."""
+        name = entity.name
+        if self._exclude is not None:
+            m = self._exclude.search(name)
+            if m:
+                _LOGGER.debug(
+                    "skipping %s because exclude_name_substring has '%s'",
+                    entity, m.group(0))
+                return True
+        if self._include is not None and not self._include.search(name):
+            _LOGGER.debug(
+                "skipping %s because it matches no include_name_substring",
+                entity)
+            return True
+        return False
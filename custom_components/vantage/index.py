@@ -0,0 +1,88 @@
+"""
+Index of the integration's entities.
+
+Every entity registers itself when it is added to Home Assistant and
+drops out when it is removed, so service handlers and callbacks can find
+entities by vid, entity_id, area or kind with a dict lookup rather than by
+scanning every entity (or every device in the project).
+"""
+
+
+class EntityIndex():
+    """The entities of the integration, by vid, entity_id, area vid and
+    vantage kind."""
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._by_vid = {}
+        self._by_entity_id = {}
+        self._by_area = {}  # area vid -> {vid: entity}
+        self._by_kind = {}  # kind -> {vid: entity}
+        self._keys = {}  # vid -> (entity_id, area, kind) it was indexed by
+
+    def add(self, entity):
+        """Index entity (replacing any other entity for its vid)."""
+        device = entity._vantage_device
+        vid = device.vid
+        if vid in self._keys:
+            self.remove(self._by_vid[vid])
+        keys = (entity.entity_id, getattr(device, "area", None), device.kind)
+        self._keys[vid] = keys
+        self._by_vid[vid] = entity
+        self._by_entity_id[keys[0]] = entity
+        self._by_area.setdefault(keys[1], {})[vid] = entity
+        self._by_kind.setdefault(keys[2], {})[vid] = entity
+
+    def remove(self, entity):
+        """Drop entity from the index, if it is the one indexed."""
+        vid = entity._vantage_device.vid
+        if self._by_vid.get(vid) is not entity:
+            return
+        entity_id, area, kind = self._keys.pop(vid)
+        del self._by_vid[vid]
+        self._by_entity_id.pop(entity_id, None)
+        for index, key in ((self._by_area, area), (self._by_kind, kind)):
+            entities = index[key]
+            del entities[vid]
+            if not entities:
+                del index[key]
+
+    def reindex(self, entity):
+        """Index entity again, e.g. after its device moved area."""
+        self.remove(entity)
+        self.add(entity)
+
+    def get(self, vid, default=None):
+        """Return the entity of the device with vid."""
+        return self._by_vid.get(vid, default)
+
+    def by_entity_id(self, entity_id):
+        """Return the entity with entity_id, or None if it isn't ours."""
+        return self._by_entity_id.get(entity_id)
+
+    def in_areas(self, area_vids, kinds=None):
+        """Return the entities in any of area_vids, of kinds if given."""
+        found = []
+        for area in area_vids:
+            for entity in self._by_area.get(area, {}).values():
+                if kinds is None or entity._vantage_device.kind in kinds:
+                    found.append(entity)
+        return found
+
+    def of_kind(self, kind):
+        """Return the entities of vantage kind."""
+        return list(self._by_kind.get(kind, {}).values())
+
+    def values(self):
+        """Return every entity."""
+        return self._by_vid.values()
+
+    def __iter__(self):
+        """Iterate over the vids of the indexed entities."""
+        return iter(self._by_vid)
+
+    def __len__(self):
+        return len(self._by_vid)
+
+    def __contains__(self, vid):
+        return vid in self._by_vid
@@ -6,6 +6,10 @@ https://home-assistant.io/components/light.vantage/
 """
 import logging
 import asyncio
+import functools
+import time
+
+import voluptuous as vol
 
 from homeassistant.components.light import (
     ATTR_BRIGHTNESS,
@@ -32,47 +36,109 @@ from homeassistant.util.color import (
     color_temperature_kelvin_to_mired,
 )
 
-from homeassistant.helpers import entity_platform
+from homeassistant.core import SupportsResponse, callback
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.service import async_extract_entity_ids
 
-from ..vantage import VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER
+from ..vantage import (
+    VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER, VANTAGE_ENTITIES,
+    SIGNAL_ADD_DEVICES, DOMAIN as VANTAGE_DOMAIN)
 
 _LOGGER = logging.getLogger(__name__)
 
-VANTAGE_SET_STATE_SCHEMA = LIGHT_TURN_ON_SCHEMA
+ATTR_FORCE = "force"
+
+# light.turn_on's fields, and force: send even levels the lights already have
+VANTAGE_SET_STATE_SCHEMA = {
+    **LIGHT_TURN_ON_SCHEMA,
+    vol.Optional(ATTR_FORCE, default=False): cv.boolean,
+}
 SERVICE_VANTAGE_SET_STATE = "set_state"
+# most lights vantage.set_state sets at once
+SET_STATE_FANOUT = 32
+# seconds to wait for the controller to acknowledge each command
+SET_STATE_TIMEOUT = 5
 
 DEPENDENCIES = ["vantage"]
 
 
 # pylint: disable=unused-argument
-async def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
+async def async_setup_entry(hass, entry, async_add_devices):
     """Set up the Vantage lights."""
 
-    devs = []
-
     async def async_handle_set_state(call):
-        entity_ids = await async_extract_entity_ids(hass, call, True)
-        if entity_ids:
-            entities = [entity for entity in devs if entity.entity_id in entity_ids]
-#            tasks = []
-            for light in entities:
-                await light.set_state(**call.data)
-#                task = light.set_state(**call.data)
-#                tasks.append(hass.async_create_task(task))
-#            if tasks:
-#                await asyncio.wait(tasks)
-
-    for (area_name, device) in hass.data[VANTAGE_DEVICES]["light"]:
-        dev = VantageLight(area_name, device, hass.data[VANTAGE_CONTROLLER])
-        devs.append(dev)
-
-    async_add_devices(devs, True)
-    platform = entity_platform.current_platform.get()
-    platform.async_register_entity_service(
-        SERVICE_VANTAGE_SET_STATE,
-        VANTAGE_SET_STATE_SCHEMA, "set_state"
-    )
+        if hass.data[VANTAGE_CONTROLLER] is None:
+            return None
+        index = hass.data[VANTAGE_ENTITIES]
+        entities = []
+        for entity_id in await async_extract_entity_ids(hass, call, True):
+            entity = index.by_entity_id(entity_id)
+            if isinstance(entity, VantageLight):
+                entities.append(entity)
+        data = {key: value for key, value in call.data.items()
+                if key not in cv.ENTITY_SERVICE_FIELDS}
+        conn = hass.data[VANTAGE_CONTROLLER]._conn
+        fanout = asyncio.Semaphore(SET_STATE_FANOUT)
+
+        async def async_set_light(light):
+            """Set one light; return how many of its commands the
+            controller didn't acknowledge."""
+            async with fanout:
+                light.async_set_context(call.context)
+                with conn.collect_replies(SET_STATE_TIMEOUT) as replies:
+                    try:
+                        await light.set_state(**data)
+                    finally:
+                        # whatever was sent, even if it then failed
+                        acks = await asyncio.gather(*replies)
+                return acks.count(None)
+
+        # the lights started together have their commands written as one
+        # burst at the end of the loop tick
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(async_set_light(light) for light in entities),
+            return_exceptions=True)
+        elapsed = time.monotonic() - start
+        if asyncio.current_task().cancelling():
+            # the service call itself was cancelled, not just some lights
+            raise asyncio.CancelledError()
+        missed = []
+        errors = {}
+        for light, result in zip(entities, results):
+            # CancelledError is a BaseException, not an Exception
+            if isinstance(result, BaseException):
+                _LOGGER.warning("vantage.set_state failed for %s: %s",
+                                light.entity_id, result)
+                errors[light.entity_id] = str(result) or type(result).__name__
+            elif result:
+                missed.append(light.entity_id)
+        _LOGGER.debug("vantage.set_state: %d lights set in %.1fms, %d not "
+                      "acknowledged, %d failed", len(entities) - len(errors),
+                      elapsed * 1000, len(missed), len(errors))
+        return {"lights": len(entities) - len(errors), "missed": missed,
+                "errors": errors, "latency_ms": round(elapsed * 1000, 1)}
+
+    @callback
+    def add_devices(devices):
+        new_devs = [VantageLight(area_name, device,
+                                 hass.data[VANTAGE_CONTROLLER])
+                    for (area_name, device) in devices]
+        async_add_devices(new_devs)
+
+    add_devices(hass.data[VANTAGE_DEVICES]["light"])
+    # devices added to the project later
+    entry.async_on_unload(async_dispatcher_connect(
+        hass, SIGNAL_ADD_DEVICES.format("light"), add_devices))
+    # registered for the whole domain (to set the lights together), so
+    # it goes when the entry that serves it does
+    hass.services.async_register(
+        VANTAGE_DOMAIN, SERVICE_VANTAGE_SET_STATE, async_handle_set_state,
+        schema=cv.make_entity_service_schema(VANTAGE_SET_STATE_SCHEMA),
+        supports_response=SupportsResponse.OPTIONAL)
+    entry.async_on_unload(functools.partial(
+        hass.services.async_remove, VANTAGE_DOMAIN, SERVICE_VANTAGE_SET_STATE))
     return True
 
 
@@ -89,9 +155,12 @@ def to_hass_level(level):
 class VantageLight(VantageDevice, LightEntity):
     """Representation of a Vantage Light, including dimmable."""
 
+    __slots__ = ("_prev_brightness", "_target_level")
+
     def __init__(self, area_name, vantage_device, controller):
         """Initialize the light."""
-        self._prev_brightness = None
+        self._prev_brightness = to_hass_level(vantage_device.last_level())
+        self._target_level = None
         VantageDevice.__init__(self, area_name, vantage_device, controller)
 
     # @property
@@ -170,9 +239,18 @@ class VantageLight(VantageDevice, LightEntity):
         # return hs  # self._vantage_device.hs
         return self._vantage_device.hs
 
-    def _set_level(self, brightness):
+    def _set_level(self, brightness, force=False):
         """Set the level, including other dirty properties."""
-        self._vantage_device.level = to_vantage_level(brightness)
+        self._target_level = to_vantage_level(brightness)
+        self._send_level(self._target_level, force)
+
+    def _is_settled(self):
+        """A ramp is done once the load reaches full, off, or the level we
+        last asked for."""
+        level = self._vantage_device.last_level()
+        return (level in (0, 100) or
+                (self._target_level is not None and
+                 abs(level - self._target_level) < 0.5))
 
     async def async_turn_on(self, **kwargs):
         if ATTR_BRIGHTNESS in kwargs and self._vantage_device.is_dimmable:
@@ -187,51 +265,56 @@ class VantageLight(VantageDevice, LightEntity):
 
     def _set_ramp(self, **kwargs):
         transition_time_in_s = kwargs.get(ATTR_TRANSITION, 1)
-        self._vantage_device.set_ramp_sec(transition_time_in_s,
-                                          transition_time_in_s,
-                                          transition_time_in_s)
+        ramp = [transition_time_in_s] * 3
+        if self._vantage_device.get_ramp_sec() != ramp:
+            self._vantage_device.set_ramp_sec(*ramp)
 
     async def set_state(self, **kwargs):
-        """Turn the light on."""
+        """Turn the light on; with force, send the level even if the light
+        is already at it."""
         _LOGGER.debug("light.set_state(%s) to %s",
                       self._vantage_device, kwargs)
-        self._set_ramp(**kwargs)
-        if ATTR_BRIGHTNESS in kwargs:
-            # TODO: is_dimmable test fails for GROUP load types
-            # and self._vantage_device.is_dimmable:
-            brightness = kwargs[ATTR_BRIGHTNESS]
-            self._set_level(brightness)
-        if ATTR_RGB_COLOR in kwargs:
-            _LOGGER.debug("%s set via ATTR_RGB_COLOR", self)
-            self._vantage_device.rgb = kwargs[ATTR_RGB_COLOR]
-        elif ATTR_HS_COLOR in kwargs:
-            _LOGGER.debug("%s set via ATTR_HS_COLOR", self)
-            hs_color = kwargs[ATTR_HS_COLOR]
-            # rgb = color_hs_to_RGB(*hs_color)
-            # self._vantage_device.rgb = [*rgb]
-            self._vantage_device.hs = hs_color
-        elif ATTR_COLOR_TEMP_KELVIN in kwargs:
-            _LOGGER.debug(
-                "%s set via ATTR_COLOR_TEMP_KELVIN - %s", self, kwargs[ATTR_COLOR_TEMP_KELVIN]
-            )
-            kelvin = kwargs[ATTR_COLOR_TEMP_KELVIN]
-            _LOGGER.debug("%s vantage color temp kelvin = %s", self, kelvin)
-            if self._vantage_device._dmx_color:
-                # do conversion
-                rgb = color_temperature_to_rgb(kelvin)
-                self._vantage_device.rgb = [*rgb]
-            elif self._vantage_device._load_type == "DW":
-                rgb = self.color_temperature_to_dw_27k41k(kelvin)
-                self._vantage_device.rgb = [*rgb]
-            self._vantage_device.color_temp = kelvin
-
-        self.schedule_update_ha_state()
+        force = kwargs.pop(ATTR_FORCE, False)
+        with self._service("service.light"):
+            self._set_ramp(**kwargs)
+            if ATTR_BRIGHTNESS in kwargs:
+                # TODO: is_dimmable test fails for GROUP load types
+                # and self._vantage_device.is_dimmable:
+                brightness = kwargs[ATTR_BRIGHTNESS]
+                self._set_level(brightness, force)
+            if ATTR_RGB_COLOR in kwargs:
+                _LOGGER.debug("%s set via ATTR_RGB_COLOR", self)
+                self._vantage_device.rgb = kwargs[ATTR_RGB_COLOR]
+            elif ATTR_HS_COLOR in kwargs:
+                _LOGGER.debug("%s set via ATTR_HS_COLOR", self)
+                hs_color = kwargs[ATTR_HS_COLOR]
+                # rgb = color_hs_to_RGB(*hs_color)
+                # self._vantage_device.rgb = [*rgb]
+                self._vantage_device.hs = hs_color
+            elif ATTR_COLOR_TEMP_KELVIN in kwargs:
+                _LOGGER.debug(
+                    "%s set via ATTR_COLOR_TEMP_KELVIN - %s", self, kwargs[ATTR_COLOR_TEMP_KELVIN]
+                )
+                kelvin = kwargs[ATTR_COLOR_TEMP_KELVIN]
+                _LOGGER.debug("%s vantage color temp kelvin = %s", self, kelvin)
+                if self._vantage_device._dmx_color:
+                    # do conversion
+                    rgb = color_temperature_to_rgb(kelvin)
+                    self._vantage_device.rgb = [*rgb]
+                elif self._vantage_device._load_type == "DW":
+                    rgb = self.color_temperature_to_dw_27k41k(kelvin)
+                    self._vantage_device.rgb = [*rgb]
+                self._vantage_device.color_temp = kelvin
+
+            self.async_write_ha_state()
 
     async def async_turn_off(self, **kwargs):
         """Turn the light off."""
-        self._set_ramp(**kwargs)
-        self._vantage_device.level = 0
-        self.schedule_update_ha_state()
+        with self._service("service.light"):
+            self._set_ramp(**kwargs)
+            self._target_level = 0
+            self._send_level(0)
+            self.async_write_ha_state()
 
     @property
     def is_on(self):
@@ -240,5 +323,4 @@ class VantageLight(VantageDevice, LightEntity):
 
     async def async_update(self):
         """Call when forcing a refresh of the device."""
-        if self._prev_brightness is None:
-            self._prev_brightness = to_hass_level(self._vantage_device.level)
+        await self.async_query("GETLOAD")
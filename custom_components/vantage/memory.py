@@ -0,0 +1,188 @@
+"""
+Memory diagnostics scoped to this integration.
+
+vantage.dump_memory used to walk every object in the Home Assistant
+process with pympler, which froze it for seconds on a real install.  The
+MemoryProfiler instead looks only at what this integration holds:
+
+ - counts of its own objects (pyvantage devices, entities, subscriptions,
+   queued commands, outstanding replies and state writes), which are cheap
+   to read on the event loop
+ - tracemalloc snapshots filtered to allocations made by this integration
+   and pyvantage, taken in the executor
+
+Once started it samples both every MEMORY_SAMPLE_INTERVAL and keeps the
+history, so a report shows how each figure has grown per hour and which
+source lines have allocated the most since the first snapshot.
+tracemalloc slows every allocation in the process while it is tracing, so
+it only runs between start() and stop(), and only traces what is
+allocated after start().
+"""
+from collections import deque
+from datetime import timedelta
+import logging
+import time
+import tracemalloc
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds between background samples
+MEMORY_SAMPLE_INTERVAL = 600
+# samples kept for the trend; a day's worth at the default interval
+MEMORY_SAMPLES = 144
+# samples closer together than this are too noisy to extrapolate from
+MIN_TREND_SPAN = 60
+# stack frames recorded per allocation
+TRACE_FRAMES = 1
+# allocations made in files matching these count as ours
+TRACE_PATTERNS = ("*/custom_components/vantage/*", "*/pyvantage/*")
+# source lines reported per dump
+TOP_LINES = 10
+
+
+def _trace_filters():
+    """Return the tracemalloc filters keeping only our allocations."""
+    return [tracemalloc.Filter(True, pattern) for pattern in TRACE_PATTERNS]
+
+
+def object_counts(hass, vantage, state_writes):
+    """Count the objects this integration holds, without walking the heap."""
+    conn = vantage._conn
+    queues = conn.scheduler.queues.values()
+    writes = state_writes.stats()
+    return {
+        "outputs": len(vantage.outputs or ()),
+        "buttons": len(vantage.buttons or ()),
+        "keypads": len(vantage.keypads or ()),
+        "variables": len(vantage.variables or ()),
+        "sensors": len(vantage.sensors or ()),
+        "entities": writes["tracked"],
+        "subscriptions": len(vantage._subscribers),
+        "pending_state_writes": writes["pending"],
+        "queued_commands": sum(len(q.pending) for q in queues),
+        "in_flight_commands": sum(q.in_flight for q in queues),
+        "unanswered_commands": len(vantage._cmds),
+        "response_waiters": sum(len(waiters) for waiters
+                                in conn._response_waiters.values()),
+        "bus_listeners": sum(hass.bus.async_listeners().values()),
+    }
+
+
+class MemoryProfiler():
+    """Samples this integration's memory use in the background."""
+
+    def __init__(self, hass, vantage, state_writes):
+        """state_writes is the StateWriteCoalescer tracking the entities."""
+        self._hass = hass
+        self._vantage = vantage
+        self._state_writes = state_writes
+        self._unsub = None
+        self._started_tracing = False
+        self._baseline = None  # filtered snapshot at start()
+        self._last = None  # the latest filtered snapshot
+        self._sampling = False
+        self.samples = deque(maxlen=MEMORY_SAMPLES)  # (time, bytes, counts)
+
+    @property
+    def running(self):
+        """Return true iff sampling has been started."""
+        return self._unsub is not None
+
+    async def async_start(self):
+        """Start tracing and take the baseline sample."""
+        if self.running:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self._started_tracing = True
+        self.samples.clear()
+        self._unsub = async_track_time_interval(
+            self._hass, self._start_sample,
+            timedelta(seconds=MEMORY_SAMPLE_INTERVAL))
+        await self.async_sample()
+
+    @callback
+    def _start_sample(self, _now=None):
+        """Take a sample unless the previous one is still running."""
+        if not self._sampling:
+            self._hass.async_create_task(self.async_sample())
+
+    async def async_sample(self):
+        """Record the object counts and our traced allocations."""
+        self._sampling = True
+        try:
+            counts = object_counts(self._hass, self._vantage,
+                                   self._state_writes)
+            snapshot = await self._hass.async_add_executor_job(
+                self._take_snapshot)
+        finally:
+            self._sampling = False
+        if snapshot is None:
+            return
+        if self._baseline is None:
+            self._baseline = snapshot
+        traced = sum(stat.size for stat in snapshot.statistics("filename"))
+        self.samples.append((time.time(), traced, counts))
+        self._last = snapshot
+
+    @staticmethod
+    def _take_snapshot():
+        """Snapshot our allocations; runs in the executor."""
+        if not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.take_snapshot().filter_traces(_trace_filters())
+
+    def trend(self):
+        """Return the growth per hour of the traced bytes and of each
+        count, between the first and the latest sample (empty until they
+        are MIN_TREND_SPAN apart)."""
+        if len(self.samples) < 2:
+            return {}
+        (t0, bytes0, counts0), (t1, bytes1, counts1) = (self.samples[0],
+                                                        self.samples[-1])
+        if t1 - t0 < MIN_TREND_SPAN:
+            return {}
+        hours = (t1 - t0) / 3600
+        answer = {"traced_bytes": round((bytes1 - bytes0) / hours)}
+        for name, count in counts1.items():
+            answer[name] = round((count - counts0.get(name, 0)) / hours, 1)
+        return answer
+
+    def top_growth(self, limit=TOP_LINES):
+        """Return (line, bytes grown, blocks grown) for the source lines
+        whose allocations grew most since the baseline."""
+        if self._baseline is None:
+            return []
+        stats = self._last.compare_to(self._baseline, "lineno")
+        return [(str(stat.traceback), stat.size_diff, stat.count_diff)
+                for stat in stats[:limit] if stat.size_diff > 0]
+
+    def report(self):
+        """Log the latest sample, the trend and the top growth."""
+        if not self.samples:
+            _LOGGER.warning("vantage.dump_memory: no samples yet")
+            return
+        when, traced, counts = self.samples[-1]
+        _LOGGER.warning("vantage.dump_memory: %d samples over %.1f hours, "
+                        "%.1fKB traced", len(self.samples),
+                        (when - self.samples[0][0]) / 3600, traced / 1024)
+        _LOGGER.warning("vantage.dump_memory objects: %s", counts)
+        trend = self.trend()
+        if trend:
+            _LOGGER.warning("vantage.dump_memory growth per hour: %s", trend)
+        for line, size, count in self.top_growth():
+            _LOGGER.warning("vantage.dump_memory %s: +%.1fKB in %+d blocks",
+                            line, size / 1024, count)
+
+    def stop(self, _event=None):
+        """Stop sampling, and tracing if we started it."""
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._baseline = self._last = None
@@ -0,0 +1,175 @@
+"""
+Central polling of the Vantage devices that don't report their own status.
+
+Light sensors, omni sensors (power, current, temperature) and variables
+have to be asked for their values.  Rather than each entity polling on
+Home Assistant's scan interval with its own round trip, the PollEngine
+groups the devices by kind and, once per that kind's interval, sends
+every query in one pipelined burst on the background queue.  Replies
+update the pyvantage objects as usual; entities only write state when a
+value actually changed.
+
+async_snapshot() does the same for everything at startup, so entities can
+be added with their state already known.  Colour loads and groups are
+first subscribed to their colour status with ADDSTATUS, as pyvantage does
+before reading a load's level.
+"""
+import asyncio
+from datetime import timedelta
+import functools
+import logging
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .scheduler import BACKGROUND, BULK, command_queue
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds between polls of each kind, unless configured
+DEFAULT_POLL_INTERVAL = 30
+# the controller pushes variable changes (STATUS VARIABLE), so polling
+# them is only a backstop
+DEFAULT_POLL_INTERVALS = {"variable": 300}
+# a whole kind is queried at once, so allow for the queue ahead of a reply
+POLL_TIMEOUT = 10
+
+
+def poll_kind(device):
+    """Return the kind device is polled as, e.g. variable_bool->variable."""
+    kind = device.kind
+    if kind.startswith("variable"):
+        return "variable"
+    return kind
+
+
+def poll_op(device):
+    """Return the query pyvantage's PollingSensor.update() would send."""
+    kind = device.kind.upper()
+    if kind == "LIGHTSENSOR":
+        kind = "LIGHT"
+    elif kind.startswith("VARIABLE"):
+        kind = "VARIABLE"
+    return "GET" + kind
+
+
+def query_op(device):
+    """Return the query that reads device's state, or None if it has none
+    (e.g. buttons and keypads)."""
+    if device.needs_poll():
+        return poll_op(device)
+    cmd_type = getattr(device, "CMD_TYPE", None)
+    if cmd_type == "LOAD":
+        return "GETLOAD"
+    if cmd_type == "BLIND":
+        return "GETBLIND"
+    return None
+
+
+def add_status(vantage, device):
+    """Ask for the colour status of device, if it is a colour load or group
+    that hasn't asked yet on this connection (ADDSTATUS doesn't survive a
+    reconnect).  Groups ask for their first colour load's, mapped back to
+    the group."""
+    if not getattr(device, "support_color", False) or device._addedstatus:
+        return
+    vid = device.vid
+    color_vids = getattr(device, "_color_vids", None)
+    if color_vids:
+        vantage._colorvid_to_group_vid[color_vids[0]] = vid
+        vid = color_vids[0]
+    vantage.send("ADDSTATUS", vid)
+    device._addedstatus = True
+
+
+async def async_snapshot(vantage, devices):
+    """Read the state of every device in one pipelined pass on the bulk
+    queue.  Returns the number of devices queried and how many of those
+    didn't answer."""
+    queries = []
+    with command_queue(BULK):
+        for device in devices:
+            op = query_op(device)
+            if op == "GETLOAD":
+                add_status(vantage, device)
+            if op is not None:
+                queries.append(vantage._conn.async_query(
+                    vantage, op, device.vid, POLL_TIMEOUT))
+        results = await asyncio.gather(*queries)
+    return len(queries), results.count(None)
+
+
+class PollEngine():
+    """Polls every registered device, a whole kind at a time."""
+
+    def __init__(self, hass, vantage, intervals=None):
+        """intervals maps kind to seconds between polls."""
+        self._hass = hass
+        self._vantage = vantage
+        self._intervals = dict(DEFAULT_POLL_INTERVALS)
+        self._intervals.update(intervals or {})
+        self._devices = {}  # kind -> {vid: device}
+        self._unsubs = {}  # kind -> cancels the interval timer
+        self._running = set()
+        self.stats = {}  # kind -> counters
+
+    def interval(self, kind):
+        """Return the seconds between polls of kind."""
+        return self._intervals.get(kind, DEFAULT_POLL_INTERVAL)
+
+    def add(self, device):
+        """Start polling device, which async_snapshot has already read."""
+        kind = poll_kind(device)
+        devices = self._devices.setdefault(kind, {})
+        devices[device.vid] = device
+        if kind not in self._unsubs:
+            self._unsubs[kind] = async_track_time_interval(
+                self._hass, functools.partial(self._start_poll, kind),
+                timedelta(seconds=self.interval(kind)))
+            self.stats[kind] = {"devices": 0,
+                                "interval": self.interval(kind),
+                                "polls": 0, "missed": 0}
+        self.stats[kind]["devices"] = len(devices)
+
+    def remove(self, device):
+        """Stop polling device."""
+        kind = poll_kind(device)
+        devices = self._devices.get(kind, {})
+        devices.pop(device.vid, None)
+        if kind in self.stats:
+            self.stats[kind]["devices"] = len(devices)
+
+    @callback
+    def _start_poll(self, kind, _now=None):
+        """Poll kind unless the previous poll is still outstanding."""
+        if kind in self._running or not self._devices.get(kind):
+            return
+        self._running.add(kind)
+        self._hass.async_create_task(self._async_poll(kind))
+
+    async def _async_poll(self, kind):
+        """Query every device of kind at once and wait for the replies."""
+        conn = self._vantage._conn
+        devices = list(self._devices[kind].values())
+        start = self._hass.loop.time()
+        try:
+            with command_queue(BACKGROUND):
+                results = await asyncio.gather(*[
+                    conn.async_query(self._vantage, poll_op(device),
+                                     device.vid, POLL_TIMEOUT)
+                    for device in devices])
+        finally:
+            self._running.discard(kind)
+        stats = self.stats[kind]
+        stats["polls"] += 1
+        stats["missed"] += results.count(None)
+        stats["last_duration_ms"] = round(
+            (self._hass.loop.time() - start) * 1000, 1)
+        _LOGGER.debug("polled %d %s devices in %sms", len(devices), kind,
+                      stats["last_duration_ms"])
+
+    def stop(self, _event=None):
+        """Cancel every poll timer."""
+        for unsub in self._unsubs.values():
+            unsub()
+        self._unsubs.clear()
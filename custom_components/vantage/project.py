@@ -0,0 +1,212 @@
+"""
+Following changes to the Design Center project while running.
+
+The ProjectWatcher asks the controller for the project's fingerprint (the
+same small request the model cache uses) every project_check_interval.
+When it changes, the new project is parsed into a scratch controller
+object in the executor and merge_project() folds it into the live one,
+matching devices by vid:
+
+ - devices whose configuration is unchanged are left alone
+ - changed devices are updated in place, keeping their current state, so
+   the entities and subscriptions holding them stay valid
+ - new devices are adopted from the new project, and deleted ones dropped
+
+It returns the vids of each kind of change, so that only the affected
+entities need to be added, removed or refreshed.
+"""
+import asyncio
+from datetime import timedelta
+import logging
+import time
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .cache import MODEL_ATTRIBUTES
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds between fingerprint checks
+DEFAULT_PROJECT_CHECK_INTERVAL = 300
+
+# the lists holding every device the parser creates
+DEVICE_LISTS = ("outputs", "variables", "tasks", "buttons", "keypads",
+                "sensors")
+
+# device fields holding state rather than configuration; they are kept
+# when a device is updated, and don't count as a change
+RUNTIME_ATTRIBUTES = frozenset((
+    "_vantage", "_query_waiters", "_level", "_value", "_rgb", "_hs",
+    "_color_temp", "_rgb_is_dirty", "_addedstatus", "_is_open",
+    "_ramp_sec", "_extra_info"))
+# extra info set by status messages (the last button pressed on a keypad)
+RUNTIME_INFO = ("button_name", "button_action")
+
+
+def project_devices(vantage):
+    """Return every device in vantage's project by vid."""
+    devices = {}
+    for name in DEVICE_LISTS:
+        for device in getattr(vantage, name) or ():
+            devices[device.vid] = device
+    return devices
+
+
+def _signature(value):
+    """Return a comparable form of a configuration value, with references
+    to other devices and areas reduced to their vids."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_signature(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _signature(v)) for k, v in value.items()))
+    if hasattr(value, "vid"):
+        return ("vid", value.vid)
+    return value
+
+
+def device_signature(device):
+    """Return everything the project says about device, for comparing the
+    same vid across two parses."""
+    info = {k: v for k, v in device._extra_info.items()
+            if k not in RUNTIME_INFO}
+    return (type(device).__name__, _signature(info)) + tuple(sorted(
+        (k, _signature(v)) for k, v in vars(device).items()
+        if k not in RUNTIME_ATTRIBUTES))
+
+
+def _relink(value, live):
+    """Return value with every object in live (by id) replaced by the
+    live object it maps to."""
+    if isinstance(value, list):
+        return [_relink(v, live) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_relink(v, live) for v in value)
+    if isinstance(value, dict):
+        return {k: _relink(v, live) for k, v in value.items()}
+    return live.get(id(value), value)
+
+
+def merge_project(vantage, new):
+    """Fold the freshly parsed project in new into vantage.
+
+    Returns (added, removed, updated), the sets of vids of devices that
+    are new, gone, or configured differently.  A device whose type
+    changed is both removed and added."""
+    old_devices = project_devices(vantage)
+    new_devices = project_devices(new)
+    added = set()
+    updated = set()
+    live = {}  # id of each object in new -> the object vantage keeps
+    for vid, device in new_devices.items():
+        old = old_devices.get(vid)
+        if old is None or type(old) is not type(device):
+            added.add(vid)
+            continue
+        live[id(device)] = old
+        if device_signature(old) != device_signature(device):
+            updated.add(vid)
+    removed = {vid for vid, device in old_devices.items()
+               if vid in added or vid not in new_devices}
+
+    for vid in updated:
+        old, device = old_devices[vid], new_devices[vid]
+        info = {k: v for k, v in old._extra_info.items() if k in RUNTIME_INFO}
+        for name, value in vars(device).items():
+            if name not in RUNTIME_ATTRIBUTES:
+                setattr(old, name, _relink(value, live))
+        old._extra_info = {**device._extra_info, **info}
+    for vid in added:
+        device = new_devices[vid]
+        device._vantage = vantage
+        for name, value in vars(device).items():
+            if name not in RUNTIME_ATTRIBUTES:
+                setattr(device, name, _relink(value, live))
+    for area in new._vid_to_area.values():
+        area._vantage = vantage
+        for name, value in vars(area).items():
+            if name != "_vantage":
+                setattr(area, name, _relink(value, live))
+    for name in MODEL_ATTRIBUTES:
+        setattr(vantage, name, _relink(getattr(new, name), live))
+    return added, removed, updated
+
+
+class ProjectWatcher():
+    """Checks the controller's project fingerprint in the background, and
+    applies the project when it changes."""
+
+    def __init__(self, hass, fetch_fingerprint, load_project, apply_project,
+                 fingerprint=None):
+        """fetch_fingerprint() returns the current fingerprint and
+        load_project() a newly parsed controller object; both run in the
+        executor.  apply_project(new, fingerprint) is awaited to merge it."""
+        self._hass = hass
+        self._fetch_fingerprint = fetch_fingerprint
+        self._load_project = load_project
+        self._apply_project = apply_project
+        self.fingerprint = fingerprint
+        self._lock = asyncio.Lock()
+        self._unsub = None
+        self.checks = 0
+        self.changes = 0
+
+    @callback
+    def start(self, interval):
+        """Check every interval seconds; 0 only checks on request."""
+        if interval:
+            self._unsub = async_track_time_interval(
+                self._hass, self._start_check, timedelta(seconds=interval))
+
+    @callback
+    def _start_check(self, _now=None):
+        """Check unless the previous check is still running."""
+        if not self._lock.locked():
+            self._hass.async_create_task(self.async_check())
+
+    async def _async_fingerprint(self):
+        """Return the controller's fingerprint, or None if it won't say."""
+        try:
+            return await self._hass.async_add_executor_job(
+                self._fetch_fingerprint)
+        except OSError as e:
+            _LOGGER.warning("Could not fetch vantage project fingerprint: %s",
+                            e)
+            return None
+
+    async def async_check(self, force=False):
+        """Apply the project if its fingerprint changed, or regardless if
+        force is set.  Returns true iff the project was reloaded."""
+        async with self._lock:
+            self.checks += 1
+            fingerprint = await self._async_fingerprint()
+            if not force:
+                if fingerprint is None:
+                    return False
+                if self.fingerprint is None:
+                    # nothing known to compare against yet
+                    self.fingerprint = fingerprint
+                    return False
+                if fingerprint == self.fingerprint:
+                    return False
+            start = time.monotonic()
+            try:
+                new = await self._hass.async_add_executor_job(
+                    self._load_project)
+                _LOGGER.info("Parsed changed vantage project in %.2fs",
+                             time.monotonic() - start)
+                await self._apply_project(new, fingerprint)
+            except Exception as e:  # pylint: disable=broad-except
+                # keep the old fingerprint, so the next check tries again
+                _LOGGER.error("Could not apply the changed vantage "
+                              "project: %s", e)
+                return False
+            self.fingerprint = fingerprint
+            self.changes += 1
+            return True
+
+    def stop(self, _event=None):
+        """Stop checking."""
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
@@ -0,0 +1,412 @@
+"""
+Command scheduling across the pooled Host Command connections.
+
+Every command sent to the controller is put on one of four queues:
+
+ - interactive: light/switch/cover changes someone is waiting to see
+ - automation:  the same changes made by automations and scripts
+ - background:  polling, variable reads and task calls
+ - bulk:        large fetches such as reading every load at startup
+
+Each queue maps to a connection when num_connections allows it
+(interactive and automation on #0, background on #1, bulk on #2; with
+fewer connections the lower priority queues share the last one), and is
+drained in priority order.  Background and bulk queues only keep a bounded
+number of commands outstanding on the controller, so a pile of queries
+never sits in front of a light command, even when every queue shares one
+connection.
+
+With a rate limit set, commands on the interactive and automation queues
+draw from one token bucket.  Automation commands wait for a token;
+interactive ones never wait, but still use up tokens, so automations back
+off while someone is using the lights.  A waiting level command for a load
+is replaced by any later one for the same load, so an automation storm
+only sends each load its newest level.
+"""
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+AUTOMATION = "automation"
+BACKGROUND = "background"
+BULK = "bulk"
+
+# name, max commands awaiting a reply (None for no limit) and the
+# connection it prefers, in priority order
+QUEUES = ((INTERACTIVE, None, 0), (AUTOMATION, None, 0),
+          (BACKGROUND, 32, 1), (BULK, 16, 2))
+
+# the queues the rate limit applies to
+RATE_LIMITED_QUEUES = (INTERACTIVE, AUTOMATION)
+# commands a second, and how many may go at once, before automations wait
+DEFAULT_COMMAND_RATE = 20
+DEFAULT_COMMAND_BURST = 40
+
+# an outstanding command with no reply after this long is given up on
+IN_FLIGHT_TIMEOUT = 5
+
+# recent latencies kept per queue for the metrics
+LATENCY_SAMPLES = 256
+
+# level commands where only the last one queued for a vid matters
+SUPERSEDABLE_OPS = ("LOAD", "RAMPLOAD")
+
+_current_queue = contextvars.ContextVar("vantage_command_queue",
+                                        default=None)
+
+
+@contextmanager
+def command_queue(name):
+    """Send every command issued in the block on the named queue."""
+    token = _current_queue.set(name)
+    try:
+        yield
+    finally:
+        _current_queue.reset(token)
+
+
+def classify(cmd):
+    """Return the queue cmd belongs on when the caller didn't say."""
+    name = _current_queue.get()
+    if name is not None:
+        return name
+    if cmd.startswith("GET") or cmd.startswith("TASK"):
+        return BACKGROUND
+    return INTERACTIVE
+
+
+def _supersede_key(cmd):
+    """Return the key under which cmd replaces earlier queued commands."""
+    parts = cmd.split(' ', 2)
+    if len(parts) > 2 and parts[0] in SUPERSEDABLE_OPS:
+        return parts[1]
+    return None
+
+
+class TokenBucket():
+    """Allows rate commands a second on average, and up to burst at once."""
+
+    def __init__(self, rate, burst):
+        """Start full."""
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        """Add the tokens earned since the last call."""
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, now):
+        """Use a token if there is one; return true iff there was."""
+        self._refill(now)
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def spend(self, now):
+        """Use a token, or nothing if there are none left."""
+        self._refill(now)
+        self._tokens = max(0.0, self._tokens - 1)
+
+    def delay(self, now):
+        """Return the seconds until the next token."""
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+
+def _percentile(ordered, pct):
+    """Return the pct'th percentile of the already sorted samples."""
+    index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[index]
+
+
+class CommandQueue():
+    """One priority class of commands and its bookkeeping."""
+
+    def __init__(self, name, priority, connection, window):
+        """Initialize an empty queue."""
+        self.name = name
+        self.priority = priority
+        self.connection = connection
+        self.window = window
+        self.pending = deque()  # [cmd or None if superseded, enqueue time]
+        self.rate_limited = False
+        self.in_flight = 0
+        self.sent = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def has_room(self):
+        """Return true iff another command may be sent now."""
+        return self.window is None or self.in_flight < self.window
+
+    def metrics(self):
+        """Return depth and latency figures, latencies in ms."""
+        answer = {
+            "priority": self.priority,
+            "connection": self.connection,
+            "depth": len(self.pending),
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+        }
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            answer.update({
+                "latency_mean": round(
+                    sum(ordered) / len(ordered) * 1000, 2),
+                "latency_p50": round(_percentile(ordered, 50) * 1000, 2),
+                "latency_p95": round(_percentile(ordered, 95) * 1000, 2),
+                "latency_max": round(ordered[-1] * 1000, 2),
+            })
+        return answer
+
+
+class CommandScheduler():
+    """Queues commands by priority and writes them to the connections.
+
+    write(i, cmds) must send the list of commands on connection i as one
+    burst and return true iff they were written.  reply(i) must be called
+    for every R: line read on connection i; the controller answers each
+    connection's commands in order, which is how latency is measured and
+    how the windows of the lower priority queues are reopened.
+
+    on_drop(cmd, superseded) is called for every command that will get no
+    reply: superseded by a later level, not written (the connection is
+    down), written but lost with its connection, unanswered for
+    IN_FLIGHT_TIMEOUT, or still queued at close()."""
+
+    def __init__(self, num_connections, write, on_drop=None):
+        """Set up the queues for num_connections connections."""
+        self._num_connections = num_connections
+        self._write = write
+        self._on_drop = on_drop
+        self._loop = None
+        self.queues = {}
+        for priority, (name, window, connection) in enumerate(QUEUES):
+            self.queues[name] = CommandQueue(
+                name, priority, min(connection, num_connections - 1), window)
+        self._ordered = sorted(self.queues.values(),
+                               key=lambda q: q.priority)
+        # (queue, enqueued, sent, cmd) written on each connection, oldest
+        # first
+        self._in_flight = [deque() for _ in range(num_connections)]
+        self._levels = {}  # vid -> queued level entry it would supersede
+        self._flush_handle = None
+        self._timer = None
+        self._rate_timer = None
+        self._bucket = None
+        self._batch_depth = 0
+        self._istatus = 0  # ADDSTATUS round-robins over the connections
+        self.bursts = 0
+        self.superseded_commands = 0
+        self.expired_commands = 0
+        self.throttled = 0
+        self.timings = None  # a stats.Timings when collecting timings
+
+    def attach(self, loop):
+        """Schedule flushes on loop."""
+        self._loop = loop
+
+    def set_rate_limit(self, rate, burst):
+        """Limit the RATE_LIMITED_QUEUES to rate commands a second, with
+        bursts of up to burst; a rate of 0 removes the limit."""
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        for name in RATE_LIMITED_QUEUES:
+            self.queues[name].rate_limited = self._bucket is not None
+
+    def submit(self, cmd, name):
+        """Queue cmd on the named queue.  Must run on the loop."""
+        queue = self.queues[name]
+        connection = queue.connection
+        if cmd.startswith("ADDSTATUS"):
+            # the controller limits how many of these each connection has
+            connection = self._istatus
+            self._istatus = (self._istatus + 1) % self._num_connections
+        entry = [cmd, time.monotonic(), connection]
+        key = _supersede_key(cmd)
+        if key is not None:
+            previous = self._levels.get(key)
+            if previous is not None and previous[0] is not None:
+                # a later level for the same load, not yet sent, wins
+                dropped = previous[0]
+                previous[0] = None
+                self.superseded_commands += 1
+                self._dropped(dropped, True)
+            self._levels[key] = entry
+        queue.pending.append(entry)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Flush at the end of this loop tick unless batching."""
+        if self._flush_handle is None and not self._batch_depth:
+            self._flush_handle = self._loop.call_soon(self.flush)
+
+    def flush(self):
+        """Write everything the queue windows allow, one burst per
+        connection, highest priority first."""
+        self._flush_handle = None
+        now = time.monotonic()
+        self._expire(now)
+        bursts = [[] for _ in range(self._num_connections)]
+        sent = [[] for _ in range(self._num_connections)]
+        blocked = False
+        throttled = False
+        bucket = self._bucket
+        for queue in self._ordered:
+            pending = queue.pending
+            while pending and queue.has_room():
+                if pending[0][0] is None:
+                    # superseded
+                    pending.popleft()
+                    continue
+                if queue.rate_limited:
+                    if queue.name == INTERACTIVE:
+                        bucket.spend(now)
+                    elif not bucket.take(now):
+                        throttled = True
+                        break
+                entry = pending.popleft()
+                cmd = entry[0]
+                key = _supersede_key(cmd)
+                if key is not None and self._levels.get(key) is entry:
+                    del self._levels[key]
+                bursts[entry[2]].append(cmd)
+                sent[entry[2]].append((queue, entry[1], now, cmd))
+                queue.in_flight += 1
+            if pending:
+                blocked = True
+        timings = self.timings
+        for i, cmds in enumerate(bursts):
+            if not cmds:
+                continue
+            if timings is not None:
+                start = time.perf_counter()
+            if self._write(i, cmds):
+                self.bursts += 1
+                self._in_flight[i].extend(sent[i])
+                for queue, _, _, _ in sent[i]:
+                    queue.sent += 1
+                if timings is not None:
+                    self._time_burst(timings, start, now, cmds, sent[i])
+            else:
+                for queue, _, _, cmd in sent[i]:
+                    queue.in_flight -= 1
+                    self._dropped(cmd)
+        if throttled and self._rate_timer is None:
+            self.throttled += 1
+            self._rate_timer = self._loop.call_later(
+                bucket.delay(now), self._on_rate_timer)
+        if blocked and self._timer is None:
+            # make progress even if replies go missing
+            self._timer = self._loop.call_later(IN_FLIGHT_TIMEOUT,
+                                                self._on_timer)
+
+    @staticmethod
+    def _time_burst(timings, start, now, cmds, sent):
+        """Record the socket write, how long each command waited in its
+        queue, and when each level command went out."""
+        written = time.perf_counter()
+        timings.add("write", written - start)
+        for queue, enqueued, _, _ in sent:
+            timings.add("queue." + queue.name, now - enqueued)
+        for cmd in cmds:
+            key = _supersede_key(cmd)
+            if key is not None:
+                timings.level_sent(key, written)
+
+    def _on_timer(self):
+        """Retry a flush that was held back by a full window."""
+        self._timer = None
+        self._schedule_flush()
+
+    def _on_rate_timer(self):
+        """Send what the rate limit held back, now there are tokens."""
+        self._rate_timer = None
+        self._schedule_flush()
+
+    def _dropped(self, cmd, superseded=False):
+        """Report cmd as never to be answered."""
+        if self._on_drop is not None:
+            self._on_drop(cmd, superseded)
+
+    def _expire(self, now):
+        """Give up on replies that have been outstanding too long."""
+        for in_flight in self._in_flight:
+            while in_flight and now - in_flight[0][2] > IN_FLIGHT_TIMEOUT:
+                queue, _, _, cmd = in_flight.popleft()
+                queue.in_flight -= 1
+                self.expired_commands += 1
+                self._dropped(cmd)
+
+    def reply(self, i):
+        """Account for a reply read on connection i."""
+        in_flight = self._in_flight[i]
+        if not in_flight:
+            return
+        queue, enqueued, sent, _ = in_flight.popleft()
+        queue.in_flight -= 1
+        now = time.monotonic()
+        queue.latencies.append(now - enqueued)
+        if self.timings is not None:
+            self.timings.add("controller." + queue.name, now - sent)
+        if queue.pending:
+            self._schedule_flush()
+
+    def reset(self, i):
+        """Forget what was outstanding on connection i, e.g. on a drop."""
+        in_flight = self._in_flight[i]
+        while in_flight:
+            queue, _, _, cmd = in_flight.popleft()
+            queue.in_flight -= 1
+            self._dropped(cmd)
+        if self._loop is not None and any(q.pending for q in self._ordered):
+            self._schedule_flush()
+
+    @contextmanager
+    def batch(self):
+        """Hold every command sent in the block and write them as one burst
+        when it exits, even if the block awaits in between."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._flush_handle is None:
+                self.flush()
+
+    def metrics(self):
+        """Return per-queue depth/latency figures and overall counters."""
+        return {
+            "queues": {q.name: q.metrics() for q in self._ordered},
+            "bursts": self.bursts,
+            "superseded_commands": self.superseded_commands,
+            "expired_commands": self.expired_commands,
+            "throttled": self.throttled,
+        }
+
+    def close(self):
+        """Drop everything still queued or in flight and cancel any
+        scheduled flush."""
+        for queue in self._ordered:
+            for cmd, _, _ in queue.pending:
+                if cmd is not None:
+                    self._dropped(cmd)
+            queue.pending.clear()
+        for i in range(self._num_connections):
+            self.reset(i)
+        self._levels.clear()
+        for handle in (self._flush_handle, self._timer, self._rate_timer):
+            if handle is not None:
+                handle.cancel()
+        self._flush_handle = None
+        self._timer = None
+        self._rate_timer = None
+
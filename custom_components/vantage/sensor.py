@@ -16,38 +16,60 @@ from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.components.sensor.const import (
     SensorDeviceClass,
 )
-from ..vantage import VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER, button_pressed
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from ..vantage import (
+    VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER, VANTAGE_POLL_ENGINE,
+    SIGNAL_ADD_DEVICES, button_payload, button_pressed)
 
 _LOGGER = logging.getLogger(__name__)
 
 DEPENDENCIES = ["vantage"]
 
+# measurements whose bursts of updates are coalesced; every other sensor
+# (keypads, buttons, contacts, variables) reports discrete events
+COALESCED_KINDS = ("temperature", "power", "current", "lightsensor")
 
-async def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
+
+async def async_setup_entry(hass, entry, async_add_devices):
     """Setup the sensor platform."""
-    devs = []
-    for (area_name, device) in hass.data[VANTAGE_DEVICES]["sensor"]:
-        if not area_name:
-            area_name = ""
-        if device.needs_poll():
-            dev = VantagePollingSensor(area_name, device, hass.data[VANTAGE_CONTROLLER])
-        else:
-            dev = VantageSensor(area_name, device, hass.data[VANTAGE_CONTROLLER])
-        devs.append(dev)
-
-    async_add_devices(devs, True)
+
+    @callback
+    def add_devices(devices):
+        devs = []
+        for (area_name, device) in devices:
+            if not area_name:
+                area_name = ""
+            if device.needs_poll():
+                dev = VantagePollingSensor(area_name, device, hass.data[VANTAGE_CONTROLLER])
+            else:
+                dev = VantageSensor(area_name, device, hass.data[VANTAGE_CONTROLLER])
+            devs.append(dev)
+        async_add_devices(devs)
+
+    add_devices(hass.data[VANTAGE_DEVICES]["sensor"])
+    # devices added to the project later
+    entry.async_on_unload(async_dispatcher_connect(
+        hass, SIGNAL_ADD_DEVICES.format("sensor"), add_devices))
     return True
 
 
 class VantageSensor(VantageDevice, RestoreEntity):
     """Representation of a Sensor."""
 
+    __slots__ = ("_button_payload", "_info_changes")
+
     def __init__(self, area_name, vantage_device, controller):
         """Initialize the sensor."""
         VantageDevice.__init__(self, area_name, vantage_device, controller)
         self._unit_of_measurement = None
         self._device_class = None
         k = self._vantage_device.kind
+        self._button_payload = None
+        if k == "button":
+            self._button_payload = button_payload(vantage_device)
+        # a keypad's extra info holds the last button pressed
+        self._info_changes = k == "keypad"
         if k == "temperature":
             self._unit_of_measurement = "°C"
             self._device_class = "temperature"
@@ -67,6 +89,9 @@ class VantageSensor(VantageDevice, RestoreEntity):
     async def async_added_to_hass(self):
         """Run when entity about to be added."""
         await super().async_added_to_hass()
+        if self._vantage_device.value is not None:
+            # already read from the controller at startup
+            return
         state = await self.async_get_last_state()
         if not state:
             _LOGGER.warning("no state retrieved for %s", self)
@@ -84,27 +109,63 @@ class VantageSensor(VantageDevice, RestoreEntity):
         """Return the state of the sensor."""
         return self._vantage_device.value
 
+    def _is_settled(self):
+        """Only measurements are coalesced."""
+        return self._vantage_device.kind not in COALESCED_KINDS
+
     async def async_update(self):
         """Fetch new state data for the sensor.
 
         This is the only method that should fetch new data for Home Assistant.
         """
 
+    def async_device_changed(self, area_name):
+        """Rebuild the button's event data too."""
+        if self._button_payload is not None:
+            self._button_payload = button_payload(self._vantage_device)
+        super().async_device_changed(area_name)
+
     def _update_callback(self, device):
         """Run when invoked by pyvantage when the device state changes."""
-        self.schedule_update_ha_state()
+        if self._info_changes:
+            self.invalidate_attributes()
+        super()._update_callback(device)
 
-        if self._vantage_device.kind == "button":
-            button_pressed(self.hass, device)
+        if self._button_payload is not None:
+            button_pressed(self.hass, device, self._button_payload)
 
 
-# TODO: this maybe could be just returning true for should_poll
 class VantagePollingSensor(VantageSensor):
-    """Representation of a Vantage sensor that needs polling."""
+    """Representation of a Vantage sensor that needs polling.
 
-    async def async_update(self):
-        """Fetch new data."""
-        self._vantage_device.update()
+    The PollEngine does the polling; state is only written when a reply
+    (or a pushed status) carries a new value."""
+
+    __slots__ = ("_written_value",)
+
+    def __init__(self, area_name, vantage_device, controller):
+        """Initialize the sensor."""
+        VantageSensor.__init__(self, area_name, vantage_device, controller)
+        self._written_value = None
+
+    async def async_added_to_hass(self):
+        """Start polling once registered."""
+        await super().async_added_to_hass()
+        self._written_value = self._vantage_device.value
+        self.hass.data[VANTAGE_POLL_ENGINE].add(self._vantage_device)
+
+    async def async_will_remove_from_hass(self):
+        """Stop polling."""
+        await super().async_will_remove_from_hass()
+        self.hass.data[VANTAGE_POLL_ENGINE].remove(self._vantage_device)
+
+    def _update_callback(self, device):
+        """Write state only if the value changed."""
+        value = self._vantage_device.value
+        if value == self._written_value:
+            return
+        self._written_value = value
+        super()._update_callback(device)
 
     @property
     def state(self):
@@ -115,8 +176,3 @@ class VantagePollingSensor(VantageSensor):
     def assumed_state(self) -> bool:
         """Return true if unable to access real state of entity."""
         return False
-
-    @property
-    def should_poll(self):
-        """These devices do poll."""
-        return True
@@ -0,0 +1,122 @@
+"""
+Optional timing of the stages a command and its status echo go through.
+
+With collect_timings on, the connection gets a Timings object and each
+stage records how long it took into a Histogram:
+
+  service.<platform>   the entity's service handler (e.g. light.set_state)
+  queue.<queue>        waiting in the scheduler queue until written
+  controller.<queue>   written until the controller's reply
+  echo                 LOAD/RAMPLOAD written until its S:LOAD status
+  dispatch             a received line through pyvantage, updating the
+                       device
+  notify               telling the entities of the devices a chunk of
+                       lines changed (including the state writes)
+
+vantage.dump_stats logs them.  With it off, connection.timings is None and
+every probe is a single attribute test.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+import time
+
+# upper bounds of the histogram buckets, in ms; one more for anything larger
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+              1000, 2500, 5000)
+
+_NULL_SPAN = nullcontext()
+
+
+class Histogram():
+    """Counts of durations in fixed log-spaced buckets."""
+
+    def __init__(self):
+        """Initialize an empty histogram."""
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Record one duration."""
+        ms = seconds * 1000
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket holding the pct'th
+        percentile, in ms, capped at the largest duration seen."""
+        rank = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                if i < len(BUCKETS_MS):
+                    return min(BUCKETS_MS[i], round(self.max, 3))
+                return round(self.max, 3)
+        return 0.0
+
+    def summary(self):
+        """Return count, mean, p50/p95/p99 and max, times in ms."""
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count,
+                "mean": round(self.total / self.count, 3),
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "p99": self.percentile(99),
+                "max": round(self.max, 3)}
+
+
+class Timings():
+    """The histograms for every stage, by name."""
+
+    def __init__(self):
+        """Initialize with no samples."""
+        self.histograms = {}
+        self._load_sent = {}  # vid -> when its level command was written
+
+    def add(self, name, seconds):
+        """Record a duration for stage name."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+
+    @contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def level_sent(self, vid, when):
+        """Note that a level command for vid (a string, as in the status
+        line) was written at when."""
+        self._load_sent[vid] = when
+
+    def dispatched(self, line, start):
+        """Record the handling of line, received at start, and the echo
+        time if it is the status of a load we just set."""
+        self.add("dispatch", time.perf_counter() - start)
+        if line.startswith("S:LOAD ") and self._load_sent:
+            sent = self._load_sent.pop(line.split(' ', 2)[1], None)
+            if sent is not None:
+                self.add("echo", start - sent)
+
+    def summary(self):
+        """Return every histogram's summary, by stage name."""
+        return {name: self.histograms[name].summary()
+                for name in sorted(self.histograms)}
+
+
+def span(timings, name):
+    """Return a context manager timing its block as stage name, or one
+    that does nothing if timings is None."""
+    if timings is None:
+        return _NULL_SPAN
+    return timings._span(name)  # pylint: disable=protected-access
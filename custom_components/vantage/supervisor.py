@@ -0,0 +1,171 @@
+"""
+Availability and state resync across controller outages.
+
+AsyncVantageConnection reconnects on its own; the ConnectionSupervisor
+deals with what Home Assistant sees meanwhile:
+
+ - entities only turn unavailable once the controller has been gone for
+   UNAVAILABLE_AFTER seconds, so a quick reconnect doesn't rewrite every
+   entity twice
+ - after every reconnect the state of every device is read again in one
+   pipelined pass, since status messages sent while we were away are lost.
+   Notifications are held back during the pass and then sent only for the
+   devices whose state actually changed (or for everything, once, if the
+   entities had turned unavailable).  One pass runs at a time; a reconnect
+   during a pass has it run again once it is done
+"""
+import logging
+import time
+
+from homeassistant.core import callback
+
+from .poll import async_snapshot, query_op
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds the connection may be down before entities show unavailable
+UNAVAILABLE_AFTER = 10
+
+# the device fields a status or query reply can change
+STATE_ATTRIBUTES = ("_level", "_value", "_rgb", "_hs", "_color_temp",
+                    "_is_open")
+
+
+def device_state(device):
+    """Return a comparable copy of device's current state."""
+    return tuple(tuple(value) if isinstance(value, list) else value
+                 for value in (getattr(device, name, None)
+                               for name in STATE_ATTRIBUTES))
+
+
+class ConnectionSupervisor():
+    """Reports availability, and resyncs state after every reconnect."""
+
+    def __init__(self, hass, vantage, entities, dispatcher):
+        """entities is the EntityIndex of the entities of each device (kept
+        up to date as entities come and go); dispatcher the
+        StatusDispatcher that holds back notifications during a resync."""
+        self._hass = hass
+        self._vantage = vantage
+        self._entities = entities
+        self._dispatcher = dispatcher
+        self._resync_task = None
+        self._rerun = False
+        self._unavailable_handle = None
+        self._unsub = None
+        self.available = True
+        self.outages = 0
+        self.resyncs = 0
+        self.last_resync = None  # (seconds, devices queried, changed)
+
+    @callback
+    def start(self):
+        """Start following the connection."""
+        self._unsub = self._vantage._conn.add_listener(self._on_connection)
+
+    @callback
+    def _on_connection(self, connected):
+        """Run when the connections all come up, or one goes down."""
+        if not connected:
+            self.outages += 1
+            if self._unavailable_handle is None and self.available:
+                self._unavailable_handle = self._hass.loop.call_later(
+                    UNAVAILABLE_AFTER, self._set_unavailable)
+            return
+        if self._unavailable_handle is not None:
+            self._unavailable_handle.cancel()
+            self._unavailable_handle = None
+        self._start_resync()
+
+    @callback
+    def _start_resync(self):
+        """Resync, or if a resync is running, have it run again after."""
+        if self._resync_task is not None:
+            self._rerun = True
+            return
+        self._resync_task = self._hass.async_create_task(
+            self._async_resync_until_current())
+
+    async def _async_resync_until_current(self):
+        """Resync until no reconnect happened during the last pass."""
+        try:
+            while True:
+                self._rerun = False
+                await self.async_resync()
+                if not self._rerun:
+                    return
+        finally:
+            self._resync_task = None
+
+    @callback
+    def _set_unavailable(self):
+        """The controller has been gone too long; say so."""
+        self._unavailable_handle = None
+        _LOGGER.warning("Vantage controller unreachable for %d sec, "
+                        "marking its entities unavailable", UNAVAILABLE_AFTER)
+        self.available = False
+        self._write_all()
+
+    def _write_all(self):
+        """Write every entity's state (e.g. its availability changed)."""
+        for entity in list(self._entities.values()):
+            entity.async_write_ha_state()
+
+    async def async_resync(self):
+        """Read every device's state again, then notify the entities of
+        the devices that changed."""
+        vc = self._vantage
+        start = time.monotonic()
+        devices = [device for device in list(vc._subscribers)
+                   if query_op(device) is not None]
+        before = {device: device_state(device) for device in devices}
+        for device in devices:
+            if getattr(device, "_addedstatus", False):
+                # the colour status subscriptions went with the connection
+                device._addedstatus = False
+        # replies update the devices without telling their entities, so
+        # unchanged ones aren't written; buttons and keypads (which can't
+        # be queried) keep reporting presses
+        held = self._dispatcher.held
+        held.update(devices)
+        try:
+            queried, missed = await async_snapshot(vc, devices)
+        finally:
+            held.difference_update(devices)
+        changed = [device for device, state in before.items()
+                   if device_state(device) != state]
+        self.resyncs += 1
+        elapsed = time.monotonic() - start
+        self.last_resync = (round(elapsed, 3), queried, len(changed))
+        _LOGGER.info("Resynced %d devices after reconnecting in %.2fs: "
+                     "%d changed, %d did not answer", queried, elapsed,
+                     len(changed), missed)
+        if not vc._conn.connected:
+            # dropped again; the next reconnect resyncs, but measures from
+            # the state the replies so far left, so show those changes now
+            self._notify(changed)
+            return
+        if not self.available:
+            self.available = True
+            self._write_all()
+            return
+        self._notify(changed)
+
+    def _notify(self, devices):
+        """Tell the subscriber of each of devices (if it still has one)
+        that it changed."""
+        for device in devices:
+            handler = self._vantage._subscribers.get(device)
+            if handler is not None:
+                handler(device)
+
+    def stop(self, _event=None):
+        """Stop following the connection, and any resync."""
+        if self._resync_task is not None:
+            self._resync_task.cancel()
+        if self._unavailable_handle is not None:
+            self._unavailable_handle.cancel()
+            self._unavailable_handle = None
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
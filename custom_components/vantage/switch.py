@@ -6,33 +6,61 @@ https://home-assistant.io/components/light.vantage/
 """
 import logging
 
+import voluptuous as vol
+
 from homeassistant.components.switch import SwitchEntity
 from homeassistant.const import (
     STATE_OFF,
     STATE_ON,
 )
-from ..vantage import VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER
+from homeassistant.core import callback
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers import entity_platform
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from ..vantage import (
+    VantageDevice, VANTAGE_DEVICES, VANTAGE_CONTROLLER, VANTAGE_WRITE_CACHE,
+    SIGNAL_ADD_DEVICES)
 from ..vantage.sensor import VantagePollingSensor
 
 _LOGGER = logging.getLogger(__name__)
 
 DEPENDENCIES = ["vantage"]
 
+ATTR_STATE = "state"
+ATTR_FORCE = "force"
+SERVICE_VANTAGE_SET_SWITCH = "set_switch"
+# switch.turn_on/turn_off in one, and force: send even if the switch
+# reports being in that state already
+VANTAGE_SET_SWITCH_SCHEMA = {
+    vol.Required(ATTR_STATE): cv.boolean,
+    vol.Optional(ATTR_FORCE, default=False): cv.boolean,
+}
+
 
 # pylint: disable=unused-argument
-async def async_setup_platform(hass, config, async_add_devices,
-                               discovery_info=None):
+async def async_setup_entry(hass, entry, async_add_devices):
     """Set up the Vantage lights."""
-    devs = []
     controller = hass.data[VANTAGE_CONTROLLER]
-    for (area_name, device) in hass.data[VANTAGE_DEVICES]["switch"]:
-        if device.kind == 'variable_bool':
-            dev = VantageVariableSwitch(area_name, device, controller)
-        else:
-            dev = VantageSwitch(area_name, device, controller)
-        devs.append(dev)
 
-    async_add_devices(devs, True)
+    @callback
+    def add_devices(devices):
+        devs = []
+        for (area_name, device) in devices:
+            if device.kind == 'variable_bool':
+                dev = VantageVariableSwitch(area_name, device, controller)
+            else:
+                dev = VantageSwitch(area_name, device, controller)
+            devs.append(dev)
+        async_add_devices(devs)
+
+    add_devices(hass.data[VANTAGE_DEVICES]["switch"])
+    # devices added to the project later
+    entry.async_on_unload(async_dispatcher_connect(
+        hass, SIGNAL_ADD_DEVICES.format("switch"), add_devices))
+    platform = entity_platform.async_get_current_platform()
+    platform.async_register_entity_service(
+        SERVICE_VANTAGE_SET_SWITCH, VANTAGE_SET_SWITCH_SCHEMA,
+        "async_set_switch")
     return True
 
 
@@ -49,6 +77,8 @@ def to_hass_level(level):
 class VantageVariableSwitch(VantagePollingSensor, SwitchEntity):
     """Represents a boolean variable sensor as a switch."""
 
+    __slots__ = ()
+
     def __init__(self, area_name, vantage_device, controller):
         """Initialize the sensor."""
         _LOGGER.debug("SwitchSensor = %s", vantage_device)
@@ -62,13 +92,29 @@ class VantageVariableSwitch(VantagePollingSensor, SwitchEntity):
         """Return the state."""
         return STATE_ON if self.is_on else STATE_OFF
 
-    def turn_on(self, **kwargs):
-        self._vantage_device.value = True
-        self.schedule_update_ha_state()
-
-    def turn_off(self, **kwargs):
-        self._vantage_device.value = False
-        self.schedule_update_ha_state()
+    def _set_value(self, value, force=False):
+        """Set the variable, unless it last reported value and force is
+        false.  pyvantage keeps the value last sent, which doesn't count:
+        the command may have been lost; _written_value is the last one
+        reported."""
+        if not force and self.hass.data[VANTAGE_WRITE_CACHE].skip_value(
+                self._written_value, value):
+            return
+        self._vantage_device.value = value
+        self.async_write_ha_state()
+
+    async def async_turn_on(self, **kwargs):
+        with self._service("service.switch"):
+            self._set_value(True)
+
+    async def async_turn_off(self, **kwargs):
+        with self._service("service.switch"):
+            self._set_value(False)
+
+    async def async_set_switch(self, state, force=False):
+        """Turn the switch on or off (vantage.set_switch)."""
+        with self._service("service.switch"):
+            self._set_value(state, force)
 
     @property
     def is_on(self):
@@ -79,32 +125,45 @@ class VantageVariableSwitch(VantagePollingSensor, SwitchEntity):
 class VantageSwitch(VantageDevice, SwitchEntity):
     """Representation of a Vantage Switch (not dimmable)."""
 
+    __slots__ = ("_prev_brightness",)
+
     def __init__(self, area_name, vantage_device, controller):
         """Initialize the light."""
-        self._prev_brightness = None
+        self._prev_brightness = to_hass_level(vantage_device.last_level())
         VantageDevice.__init__(self, area_name, vantage_device, controller)
 
-    def turn_on(self, **kwargs):
+    async def async_turn_on(self, **kwargs):
         """Turn the light on."""
         if self._prev_brightness == 0:
             brightness = 255
         else:
             brightness = self._prev_brightness
         self._prev_brightness = brightness
-        self._vantage_device.level = to_vantage_level(brightness)
-        self.schedule_update_ha_state()
+        with self._service("service.switch"):
+            self._send_level(to_vantage_level(brightness))
+            self.async_write_ha_state()
 
-    def turn_off(self, **kwargs):
+    async def async_set_switch(self, state, force=False):
+        """Turn the switch on or off (vantage.set_switch)."""
+        with self._service("service.switch"):
+            self._send_level(100 if state else 0, force)
+            self.async_write_ha_state()
+
+    async def async_turn_off(self, **kwargs):
         """Turn the light off."""
-        self._vantage_device.level = 0
-        self.schedule_update_ha_state()
+        with self._service("service.switch"):
+            self._send_level(0)
+            self.async_write_ha_state()
 
     @property
     def is_on(self):
         """Return true iff device is on."""
         return self._vantage_device.last_level() > 0
 
+    def _is_settled(self):
+        """On/off loads don't ramp, so every update is final."""
+        return True
+
     async def async_update(self):
         """Call when forcing a refresh of the device."""
-        if self._prev_brightness is None:
-            self._prev_brightness = to_hass_level(self._vantage_device.level)
+        await self.async_query("GETLOAD")
@@ -0,0 +1,243 @@
+"""
+Write-through cache of load levels.
+
+Setting a load's level updates the pyvantage object right away (so the
+new level shows at once) and sends LOAD or RAMPLOAD.  The controller then
+reports the level back, but not necessarily right away: when an
+automation sets 30 and then 60, the status for 30 can arrive after 60 was
+sent, and applied as it is, it would flip the light back to 30 for a
+moment.
+
+The WriteCache gives every level command sent a sequence number and keeps
+the ones not yet confirmed for each load.  A status for a load with
+commands in flight is then:
+
+ - the newest command's level: it is confirmed, along with everything
+   sent before it
+ - an older command's level: that one is confirmed, but the status is
+   stale and is ignored, so the load keeps showing the newest level
+ - anything else (a ramp in progress, a keypad): ignored while the newest
+   command is in flight
+
+If the newest command isn't confirmed within PENDING_TIMEOUT seconds
+(plus its ramp time), the cache gives up and the load goes back to the
+last level the controller reported.
+
+Knowing what was last sent and last reported, the cache also tells the
+entities which commands would change nothing: setting a load to the level
+it is at, or to the level it is already on its way to at the same ramp
+(an automation making sure the porch light is on every minute).  Those
+are skipped and counted as suppressed, unless the caller forces them.
+"""
+from collections import deque
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds past a command's ramp time to wait for the controller to confirm it
+PENDING_TIMEOUT = 5
+# how far a reported level may be from the level sent and still match it
+LEVEL_TOLERANCE = 0.5
+
+# the write status of a load
+PENDING = "pending"
+CONFIRMED = "confirmed"
+UNCONFIRMED = "unconfirmed"
+
+LEVEL_OPS = ("LOAD", "RAMPLOAD")
+
+
+class LoadWrites():
+    """The level commands of one load that haven't been confirmed."""
+
+    __slots__ = ("in_flight", "confirmed", "status", "handle")
+
+    def __init__(self):
+        """Start with nothing sent."""
+        self.in_flight = deque()  # (seq, level, ramp), oldest first
+        self.confirmed = None  # the last level the controller reported
+        self.status = CONFIRMED
+        self.handle = None
+
+
+class WriteCache():
+    """Tracks the level commands in flight for every load."""
+
+    def __init__(self, loop, vantage, changed, skip_redundant=True):
+        """changed(vid, reconciled) is called when a load's write status
+        changes; reconciled is true when its level was put back to the
+        last one the controller reported.  With skip_redundant false,
+        no command is ever suppressed."""
+        self._loop = loop
+        self._vantage = vantage
+        self._changed = changed
+        self._skip_redundant = skip_redundant
+        self._loads = {}  # vid -> LoadWrites
+        self._seq = 0
+        self.confirmed = 0
+        self.stale = 0  # reported levels not applied
+        self.reconciled = 0
+        self.suppressed = 0  # commands not sent as they'd change nothing
+
+    def sent(self, cmd):
+        """Record cmd, if it sets a load's level.  Called for every command
+        as it is queued."""
+        parts = cmd.split(' ', 4)
+        if parts[0] not in LEVEL_OPS or len(parts) < 3:
+            return
+        try:
+            vid = int(parts[1])
+            level = float(parts[2])
+            ramp = float(parts[3]) if len(parts) > 3 else None
+        except ValueError:
+            return
+        load = self._loads.get(vid)
+        if load is None:
+            device = self._vantage._ids.get("LOAD", {}).get(vid)
+            if getattr(device, "_load_vids", None) is not None:
+                # a LoadGroup: the controller reports its member loads,
+                # never the group, so there is nothing to confirm it
+                return
+            load = self._loads[vid] = LoadWrites()
+        self._seq += 1
+        load.in_flight.append((self._seq, level, ramp))
+        if load.handle is not None:
+            load.handle.cancel()
+        load.handle = self._loop.call_later(PENDING_TIMEOUT + (ramp or 0),
+                                            self._expire, vid, self._seq)
+        if load.status != PENDING:
+            load.status = PENDING
+            self._changed(vid, False)
+
+    def reported(self, vid, value):
+        """The controller reported value as vid's level; return true iff
+        it should be applied to the load."""
+        load = self._loads.get(vid)
+        if load is None:
+            return True
+        try:
+            level = float(value)
+        except ValueError:
+            return True
+        changed = load.confirmed != level
+        load.confirmed = level
+        in_flight = load.in_flight
+        if not in_flight:
+            if changed or load.status != CONFIRMED:
+                # e.g. a keypad, or the controller back after an expiry
+                load.status = CONFIRMED
+                self._changed(vid, False)
+            return True
+        for i, (_, sent, _) in enumerate(in_flight):
+            if abs(sent - level) < LEVEL_TOLERANCE:
+                break
+        else:
+            self.stale += 1
+            if changed:
+                self._changed(vid, False)
+            return False
+        if i < len(in_flight) - 1:
+            # an older command; the newer ones are still on their way
+            for _ in range(i + 1):
+                in_flight.popleft()
+            self.stale += 1
+            if changed:
+                self._changed(vid, False)
+            return False
+        in_flight.clear()
+        load.handle.cancel()
+        load.handle = None
+        load.status = CONFIRMED
+        self.confirmed += 1
+        self._changed(vid, False)
+        return True
+
+    def _expire(self, vid, seq):
+        """Give up on the command seq for vid if it is still the newest
+        unconfirmed one, going back to the level last reported."""
+        load = self._loads[vid]
+        if not load.in_flight or load.in_flight[-1][0] != seq:
+            return
+        load.in_flight.clear()
+        load.handle = None
+        load.status = UNCONFIRMED
+        self.reconciled += 1
+        device = self._vantage._ids.get("LOAD", {}).get(vid)
+        if device is not None and load.confirmed is not None:
+            _LOGGER.debug("Level %s of %s not confirmed, back to %s",
+                          device._level, device, load.confirmed)
+            device._level = load.confirmed
+        self._changed(vid, True)
+
+    def connection_changed(self, connected):
+        """Give up on every command in flight once a connection drops: the
+        ones not yet written were thrown away, and the controller's
+        replies to the rest are lost, so retries mustn't be skipped."""
+        if connected:
+            return
+        for vid, load in list(self._loads.items()):
+            if load.in_flight:
+                load.handle.cancel()
+                self._expire(vid, load.in_flight[-1][0])
+
+    def skip_level(self, device, level):
+        """Return true iff setting device, a load, to level would change
+        nothing: level is the newest one in flight, sent at the ramp it
+        would be sent at now, or nothing is in flight and the load is at
+        level.  Counts the command as suppressed."""
+        if not self._skip_redundant:
+            return False
+        load = self._loads.get(device.vid)
+        if load is not None and load.in_flight:
+            _, sent, ramp = load.in_flight[-1]
+            redundant = (abs(sent - level) < LEVEL_TOLERANCE and
+                         ramp == command_ramp(device, level))
+        else:
+            # the level last reported (or put back to when unconfirmed)
+            current = device.last_level()
+            redundant = (current is not None and
+                         abs(current - level) < LEVEL_TOLERANCE)
+        if redundant:
+            self.suppressed += 1
+        return redundant
+
+    def skip_value(self, current, value):
+        """Return true iff a device whose value is current (as last
+        reported) already has value, counting the command as suppressed.
+        For devices whose commands the cache doesn't track (variables,
+        shades)."""
+        if not self._skip_redundant or current is None or current != value:
+            return False
+        self.suppressed += 1
+        return True
+
+    def status(self, vid):
+        """Return (status, last reported level) for vid, or None if no
+        level was ever sent to it."""
+        load = self._loads.get(vid)
+        if load is None:
+            return None
+        return load.status, load.confirmed
+
+    def stats(self):
+        """Return the counters and how many loads have commands pending."""
+        return {"confirmed": self.confirmed, "stale": self.stale,
+                "reconciled": self.reconciled, "suppressed": self.suppressed,
+                "pending": sum(1 for load in self._loads.values()
+                               if load.in_flight)}
+
+    def close(self):
+        """Cancel every timer."""
+        for load in self._loads.values():
+            if load.handle is not None:
+                load.handle.cancel()
+                load.handle = None
+
+
+def command_ramp(device, level):
+    """Return the ramp time pyvantage sends with a command setting device
+    to level, or None if it sends LOAD, without one."""
+    if not device.is_dimmable:
+        return None
+    up, down, _ = device.get_ramp_sec()
+    return float(down if level == 0 else up)